@@ -0,0 +1,145 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+import structlog
+import metrics
+
+logger = structlog.getLogger()
+
+AI_CACHE_SIZE = int(os.environ.get('AI_CACHE_SIZE', 4096))
+AI_CACHE_TTL = float(os.environ.get('AI_CACHE_TTL', 24 * 3600))
+AI_CACHE_SQLITE = os.environ.get('AI_CACHE_SQLITE')  # Path to enable the on-disk tier
+
+hits = metrics.counter('ai_cache_hits_total', 'LLM responses served from the cache')
+misses = metrics.counter('ai_cache_misses_total', 'LLM lookups that missed the cache')
+disk_hits = metrics.counter('ai_cache_disk_hits_total', 'Cache hits served by the SQLite tier')
+
+
+def _normalize(value):
+    """Canonical form of prompt inputs so equivalent prompts hash alike"""
+    if isinstance(value, str):
+        return value.strip().upper()
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in value.items()}
+    return value
+
+
+def cache_key(kind, model, temperature, **inputs):
+    """Content address for an LLM request"""
+    payload = json.dumps({
+        'kind': kind,
+        'model': model,
+        'temperature': temperature,
+        'inputs': _normalize(inputs)
+    }, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class MemoryCache:
+    """In-process LRU cache with a per-entry TTL"""
+
+    def __init__(self, max_entries=AI_CACHE_SIZE, ttl=AI_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCache:
+    """On-disk cache tier that survives restarts and is shared between workers"""
+
+    def __init__(self, path, ttl=AI_CACHE_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)'
+        )
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value FROM llm_cache WHERE key = ? AND expires_at >= ?', (key, time.time())
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, key, value):
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO llm_cache (key, value, expires_at) VALUES (?, ?, ?)',
+                (key, json.dumps(value), time.time() + self.ttl)
+            )
+
+    def purge_expired(self):
+        with self._lock:
+            self._conn.execute('DELETE FROM llm_cache WHERE expires_at < ?', (time.time(),))
+
+
+class ResponseCache:
+    """Memory LRU in front of an optional SQLite tier, with hit/miss counters"""
+
+    def __init__(self, memory=None, disk=None):
+        self.memory = memory if memory is not None else MemoryCache()
+        self.disk = disk
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                disk_hits.inc()
+                self.memory.put(key, value)
+        if value is None:
+            misses.inc()
+        else:
+            hits.inc()
+        return value
+
+    def put(self, key, value):
+        self.memory.put(key, value)
+        if self.disk is not None:
+            try:
+                self.disk.put(key, value)
+            except sqlite3.Error as e:
+                logger.error(f"Error writing LLM cache to disk: {e}")
+
+
+def build_default_cache():
+    disk = None
+    if AI_CACHE_SQLITE:
+        try:
+            disk = SQLiteCache(AI_CACHE_SQLITE)
+        except sqlite3.Error as e:
+            logger.error(f"Could not open LLM cache at {AI_CACHE_SQLITE}: {e}")
+    return ResponseCache(MemoryCache(), disk)
+
+
+response_cache = build_default_cache()
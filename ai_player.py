@@ -1,34 +1,104 @@
-from openai import OpenAI
-import json
 import os
+import time
+import random
 import structlog
 import retrying
+import metrics
+from ai_cache import response_cache, cache_key
+from embedding_guesser import embedding_guesser
+from prompts import CLUE_PROMPT, GUESS_PROMPT, PLAN_PROMPT
+from json_stream import ArrayStreamParser, StreamFormatError
+from llm_backend import get_backend, CircuitOpenError
+from ai_scheduler import check_task, time_left, DeadlineExceeded, TaskCancelled
+from clue_bank import clue_bank
 
 logger = structlog.getLogger()
 
-# Initialize OpenAI client
-try:
-    api_key = os.environ.get("OPENAI_KEY", None)
-    if not api_key:
-        try:
-            api_key = open('/root/decryptai/.openai_key').read().strip()
-        except:
-            try:
-                api_key = open('/Users/jong/.openai_key').read().strip()
-            except:
-                api_key = open('/app/.openai_key').read().strip()
-    client = OpenAI(api_key=api_key)
-except Exception as e:
-    logger.error(f"Could not initialize OpenAI client: {e}")
-    client = None
-
-DEFAULT_MODEL = 'gpt-4o-mini'
+CLUE_TEMPERATURE = 0.7
+GUESS_TEMPERATURE = 0.3
+# Cached clue variants to collect per prompt before reusing them at random
+AI_CLUE_VARIANTS = int(os.environ.get('AI_CLUE_VARIANTS', 3))
+
+first_item_seconds = metrics.histogram('ai_stream_first_item_seconds', 'Time from request to the first valid clue or guess digit')
+stream_aborts = metrics.counter('ai_stream_aborts_total', 'Streamed answers abandoned at the first malformed item')
+fallback_moves = {kind: metrics.counter('ai_fallback_moves_total', 'AI moves made locally because the LLM was unavailable or failed',
+                                        labels={'kind': kind}) for kind in ('clues', 'guess')}
+retries = metrics.counter('ai_retries_total', 'AI calls retried after raising')
+RETRY_WAIT_MS = 2000
+
+
+def _retry_wait(attempt, delay_since_first_attempt_ms):
+    """Fixed wait between AI call attempts, counting each retry"""
+    retries.inc()
+    return RETRY_WAIT_MS
+
+
+def _should_retry(error):
+    """Retry backend failures, unless the circuit is open or the AI task is over or would time out during the wait"""
+    if isinstance(error, (CircuitOpenError, DeadlineExceeded, TaskCancelled)):
+        return False
+    left = time_left()
+    return left is None or left > RETRY_WAIT_MS / 1000
+
+
+@retrying.retry(stop_max_attempt_number=3, wait_func=_retry_wait, retry_on_exception=_should_retry)
+def stream_answer(backend, prompt, temperature, accept, is_complete, on_item=None):
+    """Stream a JSON answer from the backend's model, validating each array item as it arrives
+
+    accept(key, index, value) rejects items that can't belong to a valid
+    answer, which aborts the stream there rather than after it finishes.
+    Reading stops as soon as is_complete(items) holds, and on_item(key,
+    items) sees every array grow. Returns the items accepted so far, keyed
+    by array name (None for a bare array). Token usage is reported on the
+    prompts.Prompt sent. A request the backend fails is retried up to twice;
+    errors left after that are raised. Raises DeadlineExceeded or
+    TaskCancelled once the AI task running it is out of time or no longer
+    wanted.
+    """
+    started_at = time.monotonic()
+    parser = ArrayStreamParser()
+    items = {}
+    received = []
+    stream = backend.stream(prompt.messages, temperature)
+    try:
+        for text in stream:
+            check_task()
+            received.append(text)
+            for key, index, value in parser.feed(text):
+                if not accept(key, index, value):
+                    raise StreamFormatError(f"Invalid item {value!r} at {key}[{index}]")
+                if not items:
+                    first_item_seconds.observe(time.monotonic() - started_at)
+                items.setdefault(key, []).append(value)
+                if on_item:
+                    on_item(key, list(items[key]))
+                if is_complete(items):
+                    return items
+        parser.close()
+    except StreamFormatError as e:
+        stream_aborts.inc()
+        logger.error(f"Aborted malformed AI answer: {e}")
+    finally:
+        stream.close()
+        prompt.report(''.join(received), time.monotonic() - started_at)
+    return items
 
 class DecryptoAI:
-    def __init__(self, team_color, difficulty='normal'):
+    def __init__(self, team_color, difficulty='normal', cache=response_cache, clue_variants=AI_CLUE_VARIANTS,
+                 local_guesser=embedding_guesser, backend=None, clue_bank=clue_bank):
         self.team_color = team_color
         self.difficulty = difficulty
         self.personality = self.get_personality()
+        self.cache = cache
+        self.clue_variants = clue_variants
+        self.local_guesser = local_guesser
+        self._backend = backend
+        self.clue_bank = clue_bank
+
+    @property
+    def backend(self):
+        """The LLM backend given to this player, else the shared one from LLM_BACKEND"""
+        return self._backend or get_backend()
     
     def get_personality(self):
         personalities = [
@@ -38,158 +108,298 @@ class DecryptoAI:
             "methodical pattern analyzer",
             "intuitive word association expert"
         ]
-        import random
         return random.choice(personalities)
 
-    @retrying.retry(stop_max_attempt_number=3, wait_fixed=2000)
-    def generate_clues(self, code_words, code_sequence):
+    def generate_clues(self, code_words, code_sequence, on_progress=None, used_clues=()):
         """
         Generate clues for a 3-digit code sequence
         
         Args:
             code_words: List of 4 code words for the team
             code_sequence: List of 3 numbers (1-4) indicating which words to give clues for
+            on_progress: Called as on_progress(team_color, clues_so_far) as each clue streams in
+            used_clues: Clues the team already gave this game, which cached answers must not repeat
         
         Returns:
             List of 3 clues corresponding to the code sequence
         """
-        if not client:
-            return ["connection", "mystery", "puzzle"]  # Fallback
+        backend = self.backend
+        if not backend.available:
+            return self._fallback_clues(code_words, code_sequence, used_clues)
+
+        # Reuse a cached answer once enough variants exist to keep games varied
+        key = cache_key('clues', backend.model, CLUE_TEMPERATURE, personality=self.personality,
+                        code_words=code_words, code_sequence=code_sequence)
+        variants = (self.cache.get(key) or []) if self.cache else []
+        used = {clue.lower() for clue in used_clues}
+        unused = [clues for clues in variants if not used.intersection(clue.lower() for clue in clues)]
+        if unused and len(variants) >= self.clue_variants:
+            clues = random.choice(unused)
+            logger.info(f"AI reused cached clues for {code_sequence}: {clues}")
+            return clues
             
-        # Create the prompt
-        prompt = f"""You are a {self.personality} playing Decrypto. You need to give clues for a secret code.
-
-Your team's 4 code words are:
-1. {code_words[0]}
-2. {code_words[1]} 
-3. {code_words[2]}
-4. {code_words[3]}
-
-You need to give clues for the sequence: {code_sequence}
-This means give a clue for word #{code_sequence[0]}, then word #{code_sequence[1]}, then word #{code_sequence[2]}.
-
-CRITICAL RULES:
-- Give exactly 3 clues, one for each position in the sequence
-- Clues MUST help your teammates identify the correct word numbers
-- Clues CANNOT contain any part of the actual code words or sound-alikes
-- Each clue should be 1-2 words maximum
-- Think about synonyms, categories, associations, or descriptions
-- Be specific enough for your team but vague enough that opponents struggle
-
-STRATEGY TIPS:
-- Use categories (e.g., "animal" for TIGER, "metal" for IRON)
-- Use synonyms (e.g., "large" for BIG, "fast" for QUICK) 
-- Use associations (e.g., "fire" for RED, "ocean" for BLUE)
-- Use functions (e.g., "communication" for PHONE, "transportation" for CAR)
-- Avoid obvious rhymes or word parts
-
-Examples of GOOD clues:
-- For ELEPHANT: "Africa", "trunk", "gray"
-- For GUITAR: "strings", "music", "strum"
-- For THUNDER: "storm", "loud", "sky"
-
-Examples of BAD clues:
-- For ELEPHANT: "el-something", "phant", "large mammal with trunk" (too obvious/contains word parts)
-- For GUITAR: "instrument with 6 strings that you play" (too long and obvious)
-
-Respond with a JSON array of exactly 3 clues:
-["clue1", "clue2", "clue3"]"""
+        prompt = CLUE_PROMPT.render(
+            personality=self.personality,
+            code_words="\n".join(f"{i}. {word}" for i, word in enumerate(code_words, 1)),
+            code_sequence=code_sequence,
+            first=code_sequence[0],
+            second=code_sequence[1],
+            third=code_sequence[2]
+        )
 
         try:
-            response = client.chat.completions.create(
-                model=DEFAULT_MODEL,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.7
+            streamed = stream_answer(
+                backend, prompt, CLUE_TEMPERATURE,
+                accept=lambda field, index, clue: field in (None, 'clues') and index < 3 and _is_valid_clue(clue),
+                is_complete=lambda items: len(_unwrap(items, 'clues')) == 3,
+                on_item=on_progress and (lambda field, clues: on_progress(self.team_color, clues))
             )
-            
-            clues_text = response.choices[0].message.content.strip()
-            clues = json.loads(clues_text)
-            
-            if isinstance(clues, list) and len(clues) == 3:
+            clues = _unwrap(streamed, 'clues')
+            if len(clues) == 3:
                 logger.info(f"AI generated clues for {code_sequence}: {clues}")
+                if self.cache and clues not in variants:
+                    self.cache.put(key, variants + [clues])
                 return clues
-            else:
-                raise ValueError("Invalid clues format")
-                
+            # Keep the clues that arrived intact
+            logger.error(f"AI gave {len(clues)} of 3 clues for {code_sequence}")
+            return clues + self._fallback_clues(code_words, code_sequence, used_clues)[len(clues):]
+
+        except CircuitOpenError:
+            return self._fallback_clues(code_words, code_sequence, used_clues)
+        except (DeadlineExceeded, TaskCancelled):
+            raise
         except Exception as e:
             logger.error(f"Error generating clues: {e}")
-            # Fallback clues
-            fallback_clues = []
-            for pos in code_sequence:
-                word = code_words[pos - 1]
-                fallback_clues.append(f"related-to-{word[:3]}")
-            return fallback_clues
-
-    @retrying.retry(stop_max_attempt_number=3, wait_fixed=2000)
-    def guess_code(self, clues, opponent_code_words=None, round_history=None):
+            return self._fallback_clues(code_words, code_sequence, used_clues)
+
+    def _fallback_clues(self, code_words, code_sequence, used_clues=()):
+        """Clues made without the LLM: from the clue bank, unused ones first, else from the words"""
+        fallback_moves['clues'].inc()
+        clues = None
+        if self.clue_bank:
+            clues = (self.clue_bank.assemble(code_words, code_sequence, used_clues)
+                     or self.clue_bank.assemble(code_words, code_sequence))
+        return clues or [f"related-to-{code_words[pos - 1][:3]}" for pos in code_sequence]
+
+    def _fallback_guess(self, clues, code_words, slot_summary):
+        """A guess made without the LLM: the embedding guesser's best code however unsure, else a random one"""
+        fallback_moves['guess'].inc()
+        if self.local_guesser:
+            slot_clues = [slot['clues'] for slot in slot_summary] if slot_summary else None
+            guess, _ = self.local_guesser.guess(clues, code_words, slot_clues)
+            if guess:
+                return guess
+        return random.choices(range(1, 5), k=3)
+
+    def _guess_key(self, clues, code_words, slot_summary, own_team):
+        return cache_key('guess', self.backend.model, GUESS_TEMPERATURE, personality=self.personality, clues=clues,
+                         code_words=code_words, slots=slot_summary, own_team=own_team)
+
+    def _local_guess(self, clues, code_words, slot_summary):
+        """A guess from the local embedding guesser when it is confident enough, else None"""
+        if not self.local_guesser:
+            return None
+        slot_clues = [slot['clues'] for slot in slot_summary] if slot_summary else None
+        return self.local_guesser.confident_guess(clues, code_words, slot_clues)
+
+    def _guess_context(self, code_words, slot_summary, own_team):
+        """Prompt lines describing what a guesser knows"""
+        # Summarize the clue-giving team's earlier clues per word slot
+        history_context = ""
+        if slot_summary and any(slot['clue_count'] for slot in slot_summary):
+            history_context = "\nClues given for each code word in previous rounds:\n"
+            for slot in slot_summary:
+                earlier = slot['clue_count'] - len(slot['clues'])
+                history_context += f"{slot['slot']}. {', '.join(slot['clues']) or '(none yet)'}"
+                if earlier:
+                    history_context += f" (+{earlier} earlier)"
+                if slot.get('likely_words'):
+                    history_context += " - likely " + ", ".join(f"{word} ({p:.0%})" for word, p in slot['likely_words'])
+                history_context += "\n"
+        
+        # Build code words context
+        words_context = ""
+        if code_words:
+            words_context = "\nYour team's code words:\n" if own_team else "\nOpponent's code words:\n"
+            for i, word in enumerate(code_words, 1):
+                words_context += f"{i}. {word}\n"
+
+        return f"{words_context}\n{history_context}"
+
+    def guess_code(self, clues, opponent_code_words=None, slot_summary=None, own_team=False, on_progress=None):
         """
         Guess a 3-digit code based on clues
         
         Args:
             clues: List of 3 clues
-            opponent_code_words: List of opponent's code words (if known)
-            round_history: Previous rounds for pattern recognition
+            opponent_code_words: List of the clue-giving team's code words (if known)
+            slot_summary: ClueModel.summary() of the clue-giving team's earlier clues per word slot
+            own_team: True when decoding a teammate's clues rather than intercepting
+            on_progress: Called as on_progress(team_color, digits_so_far) as the guess streams in
         
         Returns:
             List of 3 numbers (1-4) representing the guessed code
         """
-        if not client:
-            import random
-            return random.choices(range(1, 5), k=3)  # Fallback
-            
-        # Build context from round history
-        history_context = ""
-        if round_history:
-            history_context = "\nPrevious rounds:\n"
-            for round_data in round_history[-3:]:  # Last 3 rounds
-                history_context += f"Clues: {round_data['clues']} → Code: {round_data['code']}\n"
-        
-        # Build opponent words context
-        words_context = ""
-        if opponent_code_words:
-            words_context = f"\nOpponent's code words:\n"
-            for i, word in enumerate(opponent_code_words, 1):
-                words_context += f"{i}. {word}\n"
+        # Obvious decodes are settled locally without an LLM round trip
+        guess = self._local_guess(clues, opponent_code_words, slot_summary)
+        if guess:
+            return guess
+
+        backend = self.backend
+        if not backend.available:
+            return self._fallback_guess(clues, opponent_code_words, slot_summary)
+
+        key = self._guess_key(clues, opponent_code_words, slot_summary, own_team)
+        cached = self.cache.get(key) if self.cache else None
+        if cached:
+            logger.info(f"AI reused cached guess {cached} for clues: {clues}")
+            return cached
         
-        prompt = f"""You are a {self.personality} playing Decrypto. You need to guess a 3-digit code based on clues.
+        prompt = GUESS_PROMPT.render_within_budget(
+            {'personality': self.personality, 'clues': clues,
+             'context': self._guess_context(opponent_code_words, _trim_summary(slot_summary, keep), own_team)}
+            for keep in SUMMARY_TRIM_STEPS
+        )
 
-The clues given were: {clues}
+        try:
+            streamed = stream_answer(
+                backend, prompt, GUESS_TEMPERATURE,
+                accept=lambda field, index, digit: field in (None, 'guess') and index < 3 and _is_valid_digit(digit),
+                is_complete=lambda items: len(_unwrap(items, 'guess')) == 3,
+                on_item=on_progress and (lambda field, digits: on_progress(self.team_color, digits))
+            )
+            guess = _unwrap(streamed, 'guess')
+            if _is_valid_guess(guess):
+                logger.info(f"AI guessed code: {guess} for clues: {clues}")
+                if self.cache:
+                    self.cache.put(key, guess)
+                return guess
+            logger.error(f"AI gave {len(guess)} of 3 guess digits for clues: {clues}")
+            return guess + random.choices(range(1, 5), k=3 - len(guess))
 
-{words_context}
-{history_context}
+        except CircuitOpenError:
+            return self._fallback_guess(clues, opponent_code_words, slot_summary)
+        except (DeadlineExceeded, TaskCancelled):
+            raise
+        except Exception as e:
+            logger.error(f"Error guessing code: {e}")
+            return self._fallback_guess(clues, opponent_code_words, slot_summary)
 
-You need to guess which 3 code words (numbered 1-4) these clues refer to, in order.
+    def plan_guesses(self, clues, guessers, on_progress=None):
+        """
+        Make every AI guess for a round's clues in a single request
 
-STRATEGY:
-- Analyze each clue and think what code word it might refer to
-- Consider the patterns from previous rounds
-- Each number in your guess should be 1, 2, 3, or 4
-- The same number can appear multiple times in a code
+        Args:
+            clues: List of 3 clues
+            guessers: Dict of team color -> {'code_words', 'slot_summary', 'own_team'}
+                describing what each guessing team knows
+            on_progress: Called as on_progress(team_color, digits_so_far) as each guess streams in
 
-Think through each clue carefully and respond with a JSON array of exactly 3 numbers:
-[number1, number2, number3]
+        Returns:
+            Dict of team color -> list of 3 numbers (1-4)
+        """
+        if len(guessers) == 1:
+            (team_color, guesser), = guessers.items()
+            return {team_color: self.guess_code(clues, guesser['code_words'], guesser['slot_summary'], guesser['own_team'],
+                                                on_progress=on_progress)}
+
+        guesses = {}
+        keys = {}
+        for team_color, guesser in guessers.items():
+            local = self._local_guess(clues, guesser['code_words'], guesser['slot_summary'])
+            if local:
+                guesses[team_color] = local
+                continue
+            keys[team_color] = self._guess_key(clues, guesser['code_words'], guesser['slot_summary'], guesser['own_team'])
+            cached = self.cache.get(keys[team_color]) if self.cache else None
+            if cached:
+                guesses[team_color] = cached
+        pending = [team_color for team_color in guessers if team_color not in guesses]
+        if not pending:
+            logger.info(f"AI reused cached or local guesses {guesses} for clues: {clues}")
+            return guesses
+
+        def fallback(team_color):
+            guesser = guessers[team_color]
+            return self._fallback_guess(clues, guesser['code_words'], guesser['slot_summary'])
 
-Example: [2, 1, 4]"""
+        backend = self.backend
+        if not backend.available:
+            return {**guesses, **{team_color: fallback(team_color) for team_color in pending}}
+
+        def sections(keep):
+            text = ""
+            for team_color in pending:
+                guesser = guessers[team_color]
+                role = "decoding their own teammate's clues" if guesser['own_team'] else "trying to intercept the opponent's code"
+                context = self._guess_context(guesser['code_words'], _trim_summary(guesser['slot_summary'], keep),
+                                              guesser['own_team'])
+                text += f"\n### Team {team_color} ({role})\n{context}\n"
+            return text
+
+        prompt = PLAN_PROMPT.render_within_budget(
+            {'personality': self.personality, 'clues': clues, 'sections': sections(keep)} for keep in SUMMARY_TRIM_STEPS
+        )
 
         try:
-            response = client.chat.completions.create(
-                model=DEFAULT_MODEL,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.3
+            planned = stream_answer(
+                backend, prompt, GUESS_TEMPERATURE,
+                accept=lambda team_color, index, digit: team_color in pending and index < 3 and _is_valid_digit(digit),
+                is_complete=lambda items: all(len(items.get(team_color, [])) == 3 for team_color in pending),
+                on_item=on_progress
             )
-            
-            guess_text = response.choices[0].message.content.strip()
-            guess = json.loads(guess_text)
-            
-            if (isinstance(guess, list) and len(guess) == 3 and 
-                all(isinstance(x, int) and 1 <= x <= 4 for x in guess)):
-                logger.info(f"AI guessed code: {guess} for clues: {clues}")
-                return guess
-            else:
-                raise ValueError("Invalid guess format")
-                
+            for team_color in pending:
+                guess = planned.get(team_color, [])
+                if _is_valid_guess(guess):
+                    guesses[team_color] = guess
+                    if self.cache:
+                        self.cache.put(keys[team_color], guess)
+                else:
+                    logger.error(f"Incomplete planned guess for team {team_color}: {guess}")
+                    guesses[team_color] = guess + random.choices(range(1, 5), k=3 - len(guess))
+            logger.info(f"AI planned guesses {guesses} for clues: {clues}")
+            return guesses
+
+        except CircuitOpenError:
+            return {**guesses, **{team_color: fallback(team_color) for team_color in pending}}
+        except (DeadlineExceeded, TaskCancelled):
+            raise
         except Exception as e:
-            logger.error(f"Error guessing code: {e}")
-            # Fallback random guess
-            import random
-            return random.choices(range(1, 5), k=3)
\ No newline at end of file
+            logger.error(f"Error planning guesses: {e}")
+            for team_color in pending:
+                guesses[team_color] = fallback(team_color)
+            return guesses
+
+
+def _trim_summary(slot_summary, keep):
+    """slot_summary with at most `keep` clues per slot, and no likely words once nothing is kept"""
+    if not slot_summary or keep is None:
+        return slot_summary
+    trimmed = []
+    for slot in slot_summary:
+        slot = {**slot, 'clues': slot['clues'][-keep:] if keep else []}
+        if not keep:
+            slot.pop('likely_words', None)
+        trimmed.append(slot)
+    return trimmed
+
+
+# Clues kept per slot when a prompt runs over budget, fullest first
+SUMMARY_TRIM_STEPS = (None, 2, 1, 0)
+
+
+def _unwrap(items, field):
+    """Accept both {"field": [...]} structured output and a bare JSON array"""
+    return items.get(field) or items.get(None) or []
+
+
+def _is_valid_clue(clue):
+    return isinstance(clue, str) and 0 < len(clue.strip()) and len(clue.split()) <= 3
+
+
+def _is_valid_digit(digit):
+    return isinstance(digit, int) and 1 <= digit <= 4
+
+
+def _is_valid_guess(guess):
+    return isinstance(guess, list) and len(guess) == 3 and all(map(_is_valid_digit, guess))
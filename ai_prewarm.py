@@ -0,0 +1,178 @@
+"""Speculative AI clues for the next round, generated while the current round is being guessed
+
+The next code doesn't depend on the guesses, so when a round enters
+'guessing' and the team giving clues next is an AI, the game draws the next
+code early and a Prewarmer starts generating its clues in the background.
+When the next round starts, the game claims the speculation: finished clues
+are submitted at once, and clues still being generated are waited for
+instead of asking the LLM again. Speculations nobody claims (the game ended,
+the room closed, the clues came from the clue bank) are cancelled: a queued
+one never runs, and a running one stops soon after (see
+ai_scheduler.check_task). Those that had started count as wasted calls.
+
+Speculative tasks only go to the AI scheduler while it has an idle worker,
+so they don't hold up moves players are waiting for.
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+import structlog
+import metrics
+
+logger = structlog.getLogger()
+
+AI_PREWARM = os.environ.get('AI_PREWARM', '1') == '1'
+# Seconds a round start waits for speculative clues that are still being generated
+AI_PREWARM_WAIT = float(os.environ.get('AI_PREWARM_WAIT', 15))
+# Speculations kept at once; the oldest unclaimed one is dropped beyond this
+AI_PREWARM_MAX = int(os.environ.get('AI_PREWARM_MAX', 1000))
+
+started = metrics.counter('ai_prewarm_started_total', 'Speculative next-round clue generations started')
+skipped = metrics.counter('ai_prewarm_skipped_total', 'Speculations not started because no AI worker was idle')
+hits = metrics.counter('ai_prewarm_hits_total', 'AI clue turns answered by a speculation')
+misses = metrics.counter('ai_prewarm_misses_total', 'AI clue turns that had no usable speculation')
+wasted = metrics.counter('ai_prewarm_wasted_total', 'Speculative LLM calls whose clues were never used')
+# Seconds between checks that the task waiting for speculative clues is still wanted
+WAIT_SLICE = 0.25
+
+wait_seconds = metrics.histogram('ai_prewarm_wait_seconds', 'Time a round start waited for speculative clues')
+
+
+def task_key(room_code):
+    """Scheduler key of a room's speculations, so cancelling the room's moves leaves them running"""
+    return f"{room_code}:prewarm"
+
+
+class Speculation:
+    """Clues being generated for one room's next round and code"""
+
+    def __init__(self, code):
+        self.code = code
+        self.clues = None
+        self.running = False
+        self.claimed = False
+        self.cancelled = False
+        self._done = threading.Event()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def finish(self, clues):
+        self.clues = clues
+        self._done.set()
+
+    def result(self, timeout=0, check=None):
+        """The speculative clues, waiting up to timeout seconds for them; None if there are none
+
+        While waiting, check() is called every WAIT_SLICE seconds and may
+        raise to stop, which cancels the speculation.
+        """
+        if not self._done.is_set():
+            waited_from = time.monotonic()
+            deadline = waited_from + timeout
+            try:
+                while (not self._done.wait(min(WAIT_SLICE, max(deadline - time.monotonic(), 0)))
+                       and time.monotonic() < deadline):
+                    if check is not None:
+                        check()
+            except Exception:
+                self.cancelled = True
+                wasted.inc()
+                raise
+            finally:
+                wait_seconds.observe(time.monotonic() - waited_from)
+        if self.clues:
+            hits.inc()
+            return self.clues
+        misses.inc()
+        if not self._done.is_set():
+            wasted.inc()
+            logger.warning(f"Speculative clues for code {self.code} not ready after {timeout}s")
+        return None
+
+
+class Prewarmer:
+    def __init__(self, wait=AI_PREWARM_WAIT, max_entries=AI_PREWARM_MAX):
+        self.wait = wait
+        self.max_entries = max_entries
+        self._speculations = OrderedDict()  # (room_code, round) -> Speculation
+        self._lock = threading.Lock()
+
+    def start(self, room_code, round_number, code, generate, scheduler):
+        """Generate clues for a room's next round in the background with generate()"""
+        idle_workers = getattr(scheduler, 'idle_workers', None)
+        if idle_workers is not None and not idle_workers():
+            skipped.inc()
+            return None
+        speculation = Speculation(code)
+        with self._lock:
+            self._drop(self._speculations.pop((room_code, round_number), None))
+            self._speculations[(room_code, round_number)] = speculation
+            while len(self._speculations) > self.max_entries:
+                self._drop(self._speculations.popitem(last=False)[1])
+
+        def run():
+            if speculation.claimed:
+                return None
+            speculation.running = True
+            return generate()
+
+        started.inc()
+        scheduler.submit(task_key(room_code), run, on_result=speculation.finish, fallback=lambda: None,
+                         is_current=lambda: not speculation.cancelled and (not speculation.claimed or speculation.running))
+        return speculation
+
+    def peek(self, room_code, round_number, code):
+        """The speculation for this round if it is for this code and got to run, leaving it in place"""
+        with self._lock:
+            speculation = self._speculations.get((room_code, round_number))
+        if speculation is not None and speculation.code == code and speculation.running:
+            return speculation
+        return None
+
+    def claim(self, room_code, round_number, code):
+        """The speculation for this round if it was for this code and got to run; counts a miss otherwise"""
+        with self._lock:
+            speculation = self._speculations.pop((room_code, round_number), None)
+        if speculation is not None:
+            speculation.claimed = True
+            if speculation.code == code and speculation.running:
+                return speculation
+            self._drop(speculation)
+        misses.inc()
+        return None
+
+    def cancel(self, room_code, round_number):
+        """Drop the speculation for a round whose clues came from elsewhere"""
+        with self._lock:
+            speculation = self._speculations.pop((room_code, round_number), None)
+        self._drop(speculation)
+
+    def discard(self, room_code):
+        """Drop a room's speculations, e.g. when its game ends or the room closes"""
+        with self._lock:
+            dropped = [key for key in self._speculations if key[0] == room_code]
+            for key in dropped:
+                self._drop(self._speculations.pop(key))
+
+    def _drop(self, speculation):
+        if speculation is None:
+            return
+        speculation.claimed = True
+        speculation.cancelled = True
+        if speculation.running:
+            wasted.inc()
+
+    def stats(self):
+        claimed = hits.value + misses.value
+        return {
+            'enabled': AI_PREWARM,
+            'pending': len(self._speculations),
+            'hit_rate': round(hits.value / claimed, 3) if claimed else None,
+            **metrics.snapshot('ai_prewarm_')
+        }
+
+
+prewarmer = Prewarmer() if AI_PREWARM else None
@@ -0,0 +1,207 @@
+import os
+import time
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+import structlog
+import metrics
+import tracing
+
+logger = structlog.getLogger()
+
+AI_MAX_CONCURRENCY = int(os.environ.get('AI_MAX_CONCURRENCY', 8))
+AI_MAX_QUEUE = int(os.environ.get('AI_MAX_QUEUE', 64))
+AI_TASK_TIMEOUT = float(os.environ.get('AI_TASK_TIMEOUT', 20))
+# Seconds between a running task's is_current checks, which may read the room from an external store
+AI_CURRENT_CHECK_INTERVAL = float(os.environ.get('AI_CURRENT_CHECK_INTERVAL', 0.5))
+
+# [deadline, is_current, time of the next is_current check] of the task running on this thread
+_running_task = contextvars.ContextVar('ai_running_task', default=None)
+
+
+class DeadlineExceeded(Exception):
+    """Raised inside an AI task that is still working after its timeout, as its fallback is already applied"""
+
+
+class TaskCancelled(Exception):
+    """Raised inside an AI task whose result would be dropped, e.g. as its room moved on"""
+
+
+def time_left():
+    """Seconds until the running AI task's deadline, or None outside a scheduled task"""
+    task = _running_task.get()
+    return None if task is None else task[0] - time.monotonic()
+
+
+def check_task():
+    """Stop the running AI task once its deadline has passed or its result is no longer wanted, freeing its worker"""
+    task = _running_task.get()
+    if task is None:
+        return
+    deadline, is_current, next_check_at = task
+    now = time.monotonic()
+    if now >= deadline:
+        raise DeadlineExceeded()
+    if now >= next_check_at:
+        task[2] = now + AI_CURRENT_CHECK_INTERVAL
+        if not is_current():
+            raise TaskCancelled()
+
+
+class AIScheduler:
+    """Bounded worker pool for LLM-backed AI moves
+
+    At most `max_concurrency` tasks run at once and at most `max_queue` wait
+    behind them. When the queue is full a task is rejected and its fallback
+    is applied immediately, so a spike of AI rooms degrades to fallback moves
+    instead of piling up threads and blocking calls.
+
+    Every task belongs to a room and carries an `is_current` check. Tasks
+    whose room has moved on are skipped before they run and their results
+    are dropped if the room moved on while they were running.
+
+    A task still running `timeout` seconds after it started has its fallback
+    applied then, and its own result is dropped when it arrives. Long calls
+    (see ai_player.stream_answer) call check_task() as they go so the worker
+    is freed soon after that, or soon after the task stops being current.
+    """
+
+    def __init__(self, max_concurrency=AI_MAX_CONCURRENCY, max_queue=AI_MAX_QUEUE, task_timeout=AI_TASK_TIMEOUT):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.task_timeout = task_timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='ai-worker')
+        self._slots = threading.BoundedSemaphore(max_concurrency + max_queue)
+        self._futures = {}  # room_code -> set of pending futures
+        self._lock = threading.Lock()
+
+        self.queue_depth = metrics.gauge('ai_queue_depth', 'AI tasks waiting for a worker')
+        self.active = metrics.gauge('ai_active_tasks', 'AI tasks currently running')
+        self.submitted = metrics.counter('ai_tasks_submitted_total', 'AI tasks accepted by the scheduler')
+        self.rejected = metrics.counter('ai_tasks_rejected_total', 'AI tasks rejected because the queue was full')
+        self.cancelled = metrics.counter('ai_tasks_cancelled_total', 'AI tasks dropped because their room moved on')
+        self.timed_out = metrics.counter('ai_tasks_timed_out_total', 'AI tasks that exceeded their timeout')
+        self.failed = metrics.counter('ai_tasks_failed_total', 'AI tasks that raised')
+        self.late = metrics.counter('ai_tasks_late_results_total', 'AI results dropped because their fallback was applied at the deadline')
+        self.queue_wait = metrics.histogram('ai_queue_wait_seconds', 'Time AI tasks spent queued')
+        self.run_time = metrics.histogram('ai_task_seconds', 'Time AI tasks spent running')
+
+    def submit(self, room_code, task, on_result, fallback, is_current=lambda: True, timeout=None):
+        """Queue `task` for a room; returns False if it was rejected
+
+        `on_result` receives the task's return value, or `fallback()` if the
+        task fails, is rejected or hasn't finished within `timeout` seconds.
+        """
+        if not self._slots.acquire(blocking=False):
+            self.rejected.inc()
+            logger.warning(f"AI queue full, using fallback for room {room_code}")
+            self._apply(on_result, fallback(), is_current)
+            return False
+
+        timeout = self.task_timeout if timeout is None else timeout
+        self.submitted.inc()
+        self.queue_depth.inc()
+        queued_at = time.monotonic()
+        # Run in the submitter's context so the task's trace spans join the request that queued it
+        context = contextvars.copy_context()
+        future = self._executor.submit(context.run, self._run, room_code, task, on_result, fallback, is_current,
+                                       queued_at, timeout)
+        with self._lock:
+            self._futures.setdefault(room_code, set()).add(future)
+        future.add_done_callback(lambda f: self._done(room_code, f))
+        return True
+
+    def cancel(self, room_code):
+        """Cancel queued tasks for a room; running tasks are dropped on completion"""
+        with self._lock:
+            futures = self._futures.pop(room_code, set())
+        for future in futures:
+            if future.cancel():
+                self.cancelled.inc()
+
+    def idle_workers(self):
+        """Workers with nothing to do, counting queued tasks as taking one each"""
+        return max(self.max_concurrency - self.active.value - self.queue_depth.value, 0)
+
+    def stats(self):
+        return {
+            'max_concurrency': self.max_concurrency,
+            'max_queue': self.max_queue,
+            **metrics.snapshot('ai_')
+        }
+
+    def _run(self, room_code, task, on_result, fallback, is_current, queued_at, timeout):
+        with tracing.span('ai_task', room=room_code):
+            self._run_traced(room_code, task, on_result, fallback, is_current, queued_at, timeout)
+
+    def _run_traced(self, room_code, task, on_result, fallback, is_current, queued_at, timeout):
+        self.queue_depth.dec()
+        self.queue_wait.observe(time.monotonic() - queued_at)
+        if not is_current():
+            self.cancelled.inc()
+            return
+
+        self.active.inc()
+        started_at = time.monotonic()
+        settled = threading.Lock()  # Taken by whichever of the result and the deadline comes first
+
+        def on_deadline():
+            if settled.acquire(blocking=False):
+                self.timed_out.inc()
+                logger.warning(f"AI task for room {room_code} still running after {timeout:.1f}s, using fallback")
+                self._apply(on_result, fallback(), is_current)
+
+        timer = threading.Timer(timeout, contextvars.copy_context().run, args=(on_deadline,))
+        timer.daemon = True
+        timer.start()
+        token = _running_task.set([started_at + timeout, is_current, started_at + AI_CURRENT_CHECK_INTERVAL])
+        error = None
+        try:
+            result = task()
+        except Exception as e:
+            error = e
+        finally:
+            _running_task.reset(token)
+            timer.cancel()
+            self.active.dec()
+            self.run_time.observe(time.monotonic() - started_at)
+
+        if isinstance(error, TaskCancelled):
+            self.cancelled.inc()
+            return
+        if not settled.acquire(blocking=False):
+            self.late.inc()
+            logger.info(f"Dropped the late AI result for room {room_code}")
+            return
+        if isinstance(error, DeadlineExceeded):
+            # Ran out of time just before the timer fired
+            self.timed_out.inc()
+            result = fallback()
+        elif error is not None:
+            self.failed.inc()
+            logger.error(f"AI task for room {room_code} failed: {error}")
+            result = fallback()
+        self._apply(on_result, result, is_current)
+
+    def _apply(self, on_result, result, is_current):
+        if not is_current():
+            self.cancelled.inc()
+            return
+        try:
+            on_result(result)
+        except Exception as e:
+            logger.error(f"Error applying AI result: {e}")
+
+    def _done(self, room_code, future):
+        if future.cancelled():
+            self.queue_depth.dec()
+        self._slots.release()
+        with self._lock:
+            futures = self._futures.get(room_code)
+            if futures is not None:
+                futures.discard(future)
+                if not futures:
+                    del self._futures[room_code]
+
+
+ai_scheduler = AIScheduler()
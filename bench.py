@@ -0,0 +1,241 @@
+"""Micro-benchmarks for server hot paths
+
+    python bench.py serialize --rounds 15
+    python bench.py startup --runs 5
+    python bench.py replay --rooms 200 --rounds 15
+    python bench.py deal --words 50000
+
+Each benchmark prints a JSON report so runs can be compared between commits.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import subprocess
+import statistics
+import argparse
+import tempfile
+import tracemalloc
+import structlog
+
+# Game logs every move at info level, which would dominate the timings
+structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(logging.WARNING))
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def build_game(rounds, room_code='BENCH1'):
+    """A human-vs-human game that has played `rounds` rounds with nobody scoring"""
+    import game as game_engine
+    from game import DecryptoGame
+
+    game_engine.load_code_words(os.path.join(HERE, 'code_words.txt'))
+    game = DecryptoGame(room_code)
+    for team_color in ('red', 'blue'):
+        game.add_player(f"{team_color}-player", team_color)
+        game.generate_code_words(team_color)
+    game.start_round()
+    for _ in range(rounds):
+        game.submit_clues([f"clue-{game.current_round}-{i}" for i in range(3)])
+        wrong = [5 - digit for digit in game.current_code]
+        game.submit_guess('red', wrong)
+        game.submit_guess('blue', wrong)
+    return game
+
+
+def measure(fn, iterations):
+    """Mean seconds and peak bytes allocated per call"""
+    fn()
+    started_at = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    seconds = (time.perf_counter() - started_at) / iterations
+
+    tracemalloc.start()
+    samples = min(iterations, 200)
+    peak = 0
+    for _ in range(samples):
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        fn()
+        peak = max(peak, tracemalloc.get_traced_memory()[1] - baseline)
+    tracemalloc.stop()
+    return {'us_per_call': round(seconds * 1e6, 2), 'peak_bytes_per_call': peak}
+
+
+def bench_serialize(args):
+    game = build_game(args.rounds)
+    report = {
+        'rounds': len(game.round_history),
+        'to_dict': measure(game.to_dict, args.iterations),
+        'to_dict+json.dumps': measure(lambda: json.dumps(game.to_dict()), args.iterations),
+        'to_state': measure(game.to_state, args.iterations)
+    }
+    if hasattr(game, 'to_json'):
+        def to_json_uncached():
+            game._json = {}
+            return game.to_json()
+        report['to_json'] = measure(game.to_json, args.iterations)
+        report['to_json_after_change'] = measure(to_json_uncached, args.iterations)
+    report['response_bytes'] = len(json.dumps(game.to_dict()))
+    return report
+
+
+# Modules timed by the startup benchmark, and heavy dependencies that importing the server shouldn't load
+STARTUP_MODULES = ('game', 'ai_player', 'server')
+LAZY_MODULES = ('openai', 'httpx', 'flasgger', 'tiktoken')
+
+COLD_START = """
+import sys, time, json
+started_at = time.perf_counter()
+import server
+imported_at = time.perf_counter()
+client = server.app.test_client()
+client.get('/api/health')
+health_at = time.perf_counter()
+room_code = client.post('/api/create_room').get_json()['room_code']
+client.get(f'/api/room/{room_code}')
+# Server logs go to stdout too, so the report is the last line
+print()
+json.dump({'import_ms': (imported_at - started_at) * 1000, 'first_request_ms': (health_at - imported_at) * 1000,
+           'first_room_ms': (time.perf_counter() - health_at) * 1000,
+           'lazy_modules_loaded': [name for name in %r if name in sys.modules]}, sys.stdout)
+""" % (LAZY_MODULES,)
+
+
+def run_python(*argv):
+    """Seconds a fresh interpreter takes to run argv, and its stdout and stderr"""
+    started_at = time.perf_counter()
+    result = subprocess.run([sys.executable, *argv], cwd=HERE, capture_output=True, text=True, check=True)
+    return time.perf_counter() - started_at, result.stdout, result.stderr
+
+
+def import_profile(module):
+    """Cumulative import microseconds of module and of each package it imports directly"""
+    _, _, stderr = run_python('-X', 'importtime', '-c', f'import {module}')
+    direct = {}
+    total = 0
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line.split('|')
+        if not cumulative.strip().isdigit():
+            continue
+        if name.strip() == module and name.startswith(' ' + module):
+            total = int(cumulative)
+        elif name.startswith('   ') and not name.startswith('    '):
+            direct[name.strip()] = int(cumulative)
+    return total, direct
+
+
+def bench_startup(args):
+    interpreter = statistics.median(run_python('-c', 'pass')[0] for _ in range(args.runs))
+    report = {'runs': args.runs, 'interpreter_ms': round(interpreter * 1000, 1), 'import_ms': {}}
+    for module in STARTUP_MODULES:
+        seconds = statistics.median(run_python('-c', f'import {module}')[0] for _ in range(args.runs))
+        report['import_ms'][module] = round((seconds - interpreter) * 1000, 1)
+
+    total, direct = import_profile('server')
+    slowest = sorted(direct.items(), key=lambda item: -item[1])[:10]
+    report['server_importtime_ms'] = round(total / 1000, 1)
+    report['server_slowest_imports_ms'] = {name: round(us / 1000, 1) for name, us in slowest}
+
+    cold_starts = [json.loads(run_python('-c', COLD_START)[1].splitlines()[-1]) for _ in range(args.runs)]
+    report['cold_start_ms'] = {key: round(statistics.median(run[key] for run in cold_starts), 1)
+                               for key in ('import_ms', 'first_request_ms', 'first_room_ms')}
+    report['lazy_modules_loaded'] = cold_starts[-1]['lazy_modules_loaded']
+    return report
+
+
+def bench_replay(args):
+    """Event log append throughput with fsync'd group commits, then recovery with and without a snapshot"""
+    import game as game_engine
+    import event_log
+
+    changes = []
+    game_engine.change_listeners.append(lambda room_code, payload: changes.append((room_code, payload)))
+    games = [build_game(args.rounds, f"BENCH{i}") for i in range(args.rooms)]
+    game_engine.change_listeners.clear()
+
+    report = {'rooms': args.rooms, 'rounds': args.rounds, 'events': len(changes)}
+    with tempfile.TemporaryDirectory() as directory:
+        log = event_log.EventLog(directory)
+        started_at = time.perf_counter()
+        for room_code, payload in changes:
+            log.append(room_code, payload)
+        log.flush(timeout=None)
+        seconds = time.perf_counter() - started_at
+        commits = event_log.commit_events.count
+        report['append'] = {'events_per_s': round(len(changes) / seconds), 'commits': commits,
+                            'events_per_commit': round(len(changes) / commits, 1),
+                            'commit_ms_mean': round(event_log.commit_seconds.sum / commits * 1000, 2),
+                            'log_bytes': sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))}
+
+        started_at = time.perf_counter()
+        recovered = event_log.EventLog(directory).recover()
+        seconds = time.perf_counter() - started_at
+        report['recover_from_log'] = {'ms': round(seconds * 1000, 1), 'events_per_s': round(len(changes) / seconds),
+                                      'matches': all(recovered[game.room_code].to_dict() == game.to_dict() for game in games)}
+
+        started_at = time.perf_counter()
+        log.snapshot(games)
+        report['snapshot_ms'] = round((time.perf_counter() - started_at) * 1000, 1)
+        log.close()
+        started_at = time.perf_counter()
+        recovered = event_log.EventLog(directory).recover()
+        report['recover_from_snapshot'] = {'ms': round((time.perf_counter() - started_at) * 1000, 1),
+                                           'matches': all(recovered[game.room_code].to_dict() == game.to_dict() for game in games)}
+    return report
+
+
+def bench_deal(args):
+    """Conflict precomputation and dealing both teams' words, from the real list and a synthetic one of --words words"""
+    import random
+    import numpy as np
+    from word_list import WordList
+
+    rng = random.Random(1)
+    synthetic = set()
+    while len(synthetic) < args.words:
+        synthetic.add(''.join(rng.choice('ABCDEFGHIKLMNOPRSTU') for _ in range(rng.randint(4, 10))))
+    with open(os.path.join(HERE, 'code_words.txt')) as f:
+        lists = {'code_words': WordList(f), 'synthetic': WordList(sorted(synthetic))}
+
+    report = {}
+    for name, word_list in lists.items():
+        started_at = time.perf_counter()
+        pairs = word_list.build_conflicts()
+
+        def deal_teams():
+            word_list.deal(4, exclude=word_list.deal(4))
+        report[name] = {'words': len(word_list), 'shared_stem_pairs': pairs,
+                        'build_ms': round((time.perf_counter() - started_at) * 1000, 1),
+                        'deal_teams': measure(deal_teams, args.iterations)}
+        # Random unit vectors stand in for a word vector table
+        vectors = np.random.default_rng(1).normal(size=(len(word_list), 100)).astype(np.float32)
+        word_list.build_conflicts(vectors / np.linalg.norm(vectors, axis=1, keepdims=True))
+        report[name]['deal_teams_with_vectors'] = measure(deal_teams, args.iterations)
+    return report
+
+
+BENCHMARKS = {
+    'serialize': bench_serialize,
+    'startup': bench_startup,
+    'replay': bench_replay,
+    'deal': bench_deal
+}
+
+
+if __name__ == '__main__':
+    sys.path.insert(0, HERE)
+    parser = argparse.ArgumentParser(description='DecryptAI micro-benchmarks')
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--rounds', type=int, default=15, help='Rounds played before serializing')
+    parser.add_argument('--iterations', type=int, default=5000, help='Calls to time')
+    parser.add_argument('--runs', type=int, default=5, help='Fresh interpreters to start per startup measurement')
+    parser.add_argument('--rooms', type=int, default=200, help='Rooms whose changes are logged and replayed')
+    parser.add_argument('--words', type=int, default=50000, help='Size of the synthetic word list dealt from')
+    args = parser.parse_args()
+    json.dump(BENCHMARKS[args.benchmark](args), sys.stdout, indent=2)
+    print()
@@ -0,0 +1,137 @@
+import os
+import time
+import threading
+from collections import deque
+import structlog
+import metrics
+
+logger = structlog.getLogger()
+
+BREAKER_WINDOW = float(os.environ.get('AI_BREAKER_WINDOW', 30))
+BREAKER_MIN_CALLS = int(os.environ.get('AI_BREAKER_MIN_CALLS', 8))
+BREAKER_ERROR_RATE = float(os.environ.get('AI_BREAKER_ERROR_RATE', 0.5))
+BREAKER_SLOW_SECONDS = float(os.environ.get('AI_BREAKER_SLOW_SECONDS', 6))
+BREAKER_SLOW_RATE = float(os.environ.get('AI_BREAKER_SLOW_RATE', 0.5))
+BREAKER_COOLDOWN = float(os.environ.get('AI_BREAKER_COOLDOWN', 15))
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """Stops calling an unhealthy dependency and probes for its recovery
+
+    Closed: every call goes through and its outcome joins a rolling window
+    of the last `window` seconds. Once the window holds `min_calls` calls and
+    either the share that failed reaches `error_rate` or the share slower
+    than `slow_seconds` reaches `slow_rate`, the breaker opens.
+
+    Open: allow() refuses every call for `cooldown` seconds, so callers go
+    straight to their fallback instead of waiting out a timeout.
+
+    Half open: one probe call at a time goes through. A quick success closes
+    the breaker with an empty window; a failure or slow answer reopens it.
+    """
+
+    def __init__(self, name, window=BREAKER_WINDOW, min_calls=BREAKER_MIN_CALLS, error_rate=BREAKER_ERROR_RATE,
+                 slow_seconds=BREAKER_SLOW_SECONDS, slow_rate=BREAKER_SLOW_RATE, cooldown=BREAKER_COOLDOWN,
+                 clock=time.monotonic):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_seconds = slow_seconds
+        self.slow_rate = slow_rate
+        self.cooldown = cooldown
+        self.clock = clock
+        self._state = CLOSED
+        self._calls = deque()  # (finished_at, failed, slow)
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+        self.trips = metrics.counter(f'{name}_breaker_trips_total', 'Times the circuit breaker opened')
+        self.short_circuits = metrics.counter(f'{name}_breaker_short_circuits_total',
+                                              'Calls refused while the circuit breaker was open')
+        self.open_gauge = metrics.gauge(f'{name}_breaker_open', '1 while the circuit breaker is not closed')
+
+    @property
+    def state(self):
+        with self._lock:
+            self._expire_open()
+            return self._state
+
+    def allow(self):
+        """Whether a call may go ahead now; every allowed call must be followed by record()"""
+        with self._lock:
+            self._expire_open()
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self.short_circuits.inc()
+            return False
+
+    def record(self, ok, seconds):
+        """Outcome of an allowed call: whether it succeeded and how long it took"""
+        now = self.clock()
+        slow = seconds >= self.slow_seconds
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probing = False
+                if ok and not slow:
+                    self._state = CLOSED
+                    self._calls.clear()
+                    self.open_gauge.set(0)
+                    logger.info(f"Circuit {self.name} closed after a healthy probe")
+                else:
+                    self._open(now, 'probe failed' if not ok else f"probe took {seconds:.1f}s")
+                return
+            if self._state == OPEN:
+                return  # A call from before the breaker opened
+
+            self._calls.append((now, not ok, slow))
+            self._prune(now)
+            calls = len(self._calls)
+            if calls < self.min_calls:
+                return
+            failed = sum(1 for _, failed, _ in self._calls if failed)
+            slowed = sum(1 for _, _, slow in self._calls if slow)
+            if failed / calls >= self.error_rate:
+                self._open(now, f"{failed} of {calls} calls failed")
+            elif slowed / calls >= self.slow_rate:
+                self._open(now, f"{slowed} of {calls} calls took over {self.slow_seconds:.0f}s")
+
+    def _open(self, now, reason):
+        self._state = OPEN
+        self._opened_at = now
+        self._calls.clear()
+        self.trips.inc()
+        self.open_gauge.set(1)
+        logger.warning(f"Circuit {self.name} opened for {self.cooldown:.0f}s: {reason}")
+
+    def _expire_open(self):
+        if self._state == OPEN and self.clock() - self._opened_at >= self.cooldown:
+            self._state = HALF_OPEN
+            self._probing = False
+
+    def _prune(self, now):
+        while self._calls and now - self._calls[0][0] > self.window:
+            self._calls.popleft()
+
+    def stats(self):
+        with self._lock:
+            self._expire_open()
+            self._prune(self.clock())
+            calls = len(self._calls)
+            return {
+                'state': self._state,
+                'window_calls': calls,
+                'window_error_rate': round(sum(1 for _, failed, _ in self._calls if failed) / calls, 3) if calls else 0.0,
+                'window_slow_rate': round(sum(1 for _, _, slow in self._calls if slow) / calls, 3) if calls else 0.0,
+                'reopens_in': round(max(self.cooldown - (self.clock() - self._opened_at), 0), 1) if self._state == OPEN else None,
+                'trips': self.trips.value,
+                'short_circuits': self.short_circuits.value
+            }
@@ -0,0 +1,160 @@
+"""Precomputed clue candidates per code word
+
+Build offline with:
+
+    python clue_bank.py --words code_words.txt --per-word 8 --out clue_bank.json
+
+At runtime `clue_bank.assemble` answers an AI encryptor's turn from the
+bank without an LLM call, skipping clues the team has already used.
+"""
+import os
+import json
+import random
+import argparse
+import threading
+import structlog
+import metrics
+
+logger = structlog.getLogger()
+
+CLUE_BANK_PATH = os.environ.get('CLUE_BANK_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'clue_bank.json'))
+CLUE_BANK_BATCH_SIZE = 10
+
+bank_hits = metrics.counter('ai_clue_bank_hits_total', 'AI clue turns answered from the clue bank')
+bank_misses = metrics.counter('ai_clue_bank_misses_total', 'AI clue turns the clue bank could not answer')
+
+
+def _is_valid_clue(clue, word):
+    clue = clue.strip()
+    return bool(clue) and len(clue.split()) <= 2 and word.upper() not in clue.upper()
+
+
+class ClueBank:
+    def __init__(self, path=CLUE_BANK_PATH):
+        self.path = path
+        self.clues = {}  # WORD -> list of candidate clues
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            try:
+                with open(self.path, 'r') as f:
+                    self.add_all(json.load(f))
+                logger.info(f"Loaded clue bank with {len(self.clues)} words")
+            except FileNotFoundError:
+                logger.info(f"No clue bank at {self.path}, AI clues will use the LLM")
+            except (ValueError, OSError) as e:
+                logger.error(f"Could not load clue bank: {e}")
+            self._loaded = True
+
+    def add_all(self, clues_by_word):
+        """Merge candidates into the bank, dropping clues that break the rules"""
+        for word, candidates in clues_by_word.items():
+            word = word.strip().upper()
+            existing = self.clues.setdefault(word, [])
+            for clue in candidates:
+                if isinstance(clue, str) and _is_valid_clue(clue, word) and clue not in existing:
+                    existing.append(clue.strip())
+
+    def save(self, path=None):
+        with open(path or self.path, 'w') as f:
+            json.dump(self.clues, f, indent=1, sort_keys=True)
+
+    def missing_words(self, words, per_word):
+        self._ensure_loaded()
+        return [w for w in words if len(self.clues.get(w.upper(), [])) < per_word]
+
+    def assemble(self, code_words, code_sequence, used_clues=()):
+        """Pick one unused clue per code position, or None if the bank runs dry"""
+        self._ensure_loaded()
+        used = {clue.lower() for clue in used_clues}
+        clues = []
+        for position in code_sequence:
+            word = code_words[position - 1].upper()
+            candidates = [c for c in self.clues.get(word, []) if c.lower() not in used]
+            if not candidates:
+                bank_misses.inc()
+                return None
+            clue = random.choice(candidates)
+            used.add(clue.lower())
+            clues.append(clue)
+        bank_hits.inc()
+        return clues
+
+    def covers(self, code_words, code_sequence, used_clues=()):
+        """Whether assemble() would find clues for this code, without picking any"""
+        self._ensure_loaded()
+        used = {clue.lower() for clue in used_clues}
+        needed = {}
+        for position in code_sequence:
+            needed[position] = needed.get(position, 0) + 1
+        return all(len({c.lower() for c in self.clues.get(code_words[position - 1].upper(), [])} - used) >= count
+                   for position, count in needed.items())
+
+    def build(self, words, per_word=8, batch_size=CLUE_BANK_BATCH_SIZE):
+        """Fill the bank for `words` with batched LLM requests; returns words still short"""
+        from llm_backend import get_backend
+
+        backend = get_backend()
+        if not backend.available:
+            logger.error("Cannot build clue bank without an LLM backend")
+            return list(words)
+
+        pending = self.missing_words(words, per_word)
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start + batch_size]
+            prompt = f"""You are building a clue list for the word game Decrypto.
+
+For each word below, give {per_word} different clues that would help a teammate guess the word.
+
+RULES:
+- Each clue is 1-2 words
+- Clues CANNOT contain any part of the word or sound-alikes
+- Mix categories, synonyms, associations and functions
+
+Words: {', '.join(batch)}
+
+Respond with a JSON object mapping each word to its list of clues:
+{{"WORD": ["clue1", "clue2", ...]}}"""
+            try:
+                answer = backend.complete([{"role": "user", "content": prompt}], temperature=0.9)
+                self.add_all(json.loads(answer))
+                logger.info(f"Clue bank batch {start // batch_size + 1}: {batch}")
+            except Exception as e:
+                logger.error(f"Error building clue bank batch {batch}: {e}")
+        return self.missing_words(words, per_word)
+
+    def build_in_background(self, words, per_word=8):
+        """Build missing entries on a daemon thread and save them when done"""
+        def run():
+            if self.missing_words(words, per_word):
+                self.build(words, per_word)
+                self.save()
+
+        thread = threading.Thread(target=run, name='clue-bank-builder', daemon=True)
+        thread.start()
+        return thread
+
+
+clue_bank = ClueBank()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the AI clue bank')
+    parser.add_argument('--words', default='code_words.txt', help='Word list, one word per line')
+    parser.add_argument('--per-word', type=int, default=8, help='Candidate clues to store per word')
+    parser.add_argument('--batch-size', type=int, default=CLUE_BANK_BATCH_SIZE, help='Words per LLM request')
+    parser.add_argument('--out', default=CLUE_BANK_PATH, help='Clue bank JSON file')
+    args = parser.parse_args()
+
+    with open(args.words, 'r') as f:
+        words = [word.strip().upper() for word in f if word.strip()]
+    bank = ClueBank(args.out)
+    missing = bank.build(words, args.per_word, args.batch_size)
+    bank.save()
+    print(f"Clue bank saved to {args.out}: {len(bank.clues)} words, {len(missing)} still short")
@@ -0,0 +1,185 @@
+"""Local code guessing from word vectors, without an LLM round trip
+
+Build the vector table offline from GloVe (https://nlp.stanford.edu/projects/glove/):
+
+    python embedding_guesser.py --glove glove.6B.100d.txt --words code_words.txt --out word_vectors
+
+This writes word_vectors.vectors.npy (unit-length float16 rows) and
+word_vectors.vocab.npy (the matching words, sorted), both memory-mapped at
+runtime so startup costs nothing and pages are shared between workers.
+
+`embedding_guesser.guess` scores every clue against every code word and
+against the clues previously given for each word slot, ranks all 64 codes and
+returns the best with its probability. Callers escalate to the LLM when that
+probability is below EMBEDDING_GUESS_CONFIDENCE.
+"""
+import os
+import re
+import time
+import argparse
+import threading
+import numpy as np
+import structlog
+import metrics
+
+logger = structlog.getLogger()
+
+WORD_VECTORS_PATH = os.environ.get('WORD_VECTORS_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'word_vectors'))
+EMBEDDING_GUESS_CONFIDENCE = float(os.environ.get('EMBEDDING_GUESS_CONFIDENCE', 0.5))
+# Weights of clue-to-word and clue-to-past-clue similarity, and the softmax temperature turning them into odds
+WORD_WEIGHT = 1.0
+HISTORY_WEIGHT = 1.2
+TEMPERATURE = 0.08
+CODE_WORDS = 4
+
+local_guesses = metrics.counter('ai_local_guesses_total', 'AI guesses answered by the embedding guesser')
+local_escalations = metrics.counter('ai_local_escalations_total', 'AI guesses the embedding guesser passed to the LLM')
+local_guess_seconds = metrics.histogram('ai_local_guess_seconds', 'Time to rank codes with the embedding guesser')
+
+# Every code as 0-based word indices, in the order of the flattened probability table
+ALL_CODES = np.array(np.unravel_index(np.arange(CODE_WORDS ** 3), (CODE_WORDS,) * 3)).T
+
+
+def _tokens(text):
+    return re.findall(r"[a-z]+", text.lower())
+
+
+class EmbeddingGuesser:
+    def __init__(self, path=WORD_VECTORS_PATH, threshold=EMBEDDING_GUESS_CONFIDENCE):
+        self.path = path
+        self.threshold = threshold
+        self._vectors = None
+        self._vocab = None
+        self._word_matrix = (None, None)  # (words, embed(words)) for the last word list scored
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            try:
+                self._vectors = np.load(f"{self.path}.vectors.npy", mmap_mode='r')
+                self._vocab = np.load(f"{self.path}.vocab.npy", mmap_mode='r')
+                logger.info(f"Mapped {len(self._vocab)} word vectors from {self.path}")
+            except FileNotFoundError:
+                logger.warning(f"No word vectors at {self.path}, every AI guess goes to the LLM")
+            self._loaded = True
+
+    @property
+    def available(self):
+        self._ensure_loaded()
+        return self._vectors is not None
+
+    def _row(self, token):
+        index = int(np.searchsorted(self._vocab, token))
+        if index < len(self._vocab) and self._vocab[index] == token:
+            return index
+        return None
+
+    def embed(self, texts):
+        """Unit vectors for each text (mean of its known words), zero rows for unknown texts"""
+        embedded = np.zeros((len(texts), self._vectors.shape[1]), dtype=np.float32)
+        for i, text in enumerate(texts):
+            rows = [row for row in map(self._row, _tokens(text)) if row is not None]
+            if rows:
+                vector = self._vectors[sorted(rows)].astype(np.float32).mean(axis=0)
+                norm = np.linalg.norm(vector)
+                if norm:
+                    embedded[i] = vector / norm
+        return embedded
+
+    def similarity(self, texts, words):
+        """Cosine similarity of each text to each word, reusing the embedding of a repeated word list"""
+        cached_words, matrix = self._word_matrix
+        if cached_words is not words:
+            matrix = self.embed(words)
+            self._word_matrix = (words, matrix)
+        return self.embed(texts) @ matrix.T
+
+    def rank(self, clues, code_words=None, slot_clues=None):
+        """Probability of each of the 64 codes (in ALL_CODES order), or None without any evidence
+
+        slot_clues holds the clues given so far for each of the 4 word slots.
+        """
+        past = [(clue, position) for position, given in enumerate(slot_clues or []) for clue in given]
+        if not code_words and not past:
+            return None
+
+        clue_vectors = self.embed(clues)
+        scores = np.zeros((len(clues), CODE_WORDS), dtype=np.float32)
+        if code_words:
+            scores += WORD_WEIGHT * (clue_vectors @ self.embed(code_words).T)
+        if past:
+            similarity = clue_vectors @ self.embed([clue for clue, _ in past]).T
+            labels = np.array([position for _, position in past])
+            for position in range(CODE_WORDS):
+                given = labels == position
+                if given.any():
+                    scores[:, position] += HISTORY_WEIGHT * similarity[:, given].max(axis=1)
+
+        odds = np.exp((scores - scores.max(axis=1, keepdims=True)) / TEMPERATURE)
+        odds /= odds.sum(axis=1, keepdims=True)
+        return (odds[0][:, None, None] * odds[1][None, :, None] * odds[2][None, None, :]).ravel()
+
+    def guess(self, clues, code_words=None, slot_clues=None):
+        """Most likely code (1-based) and its probability; (None, 0.0) when it can't judge"""
+        if len(clues) != 3 or not self.available:
+            return None, 0.0
+        started_at = time.perf_counter()
+        probabilities = self.rank(clues, code_words, slot_clues)
+        local_guess_seconds.observe(time.perf_counter() - started_at)
+        if probabilities is None:
+            return None, 0.0
+        best = int(probabilities.argmax())
+        return [int(position) + 1 for position in ALL_CODES[best]], float(probabilities[best])
+
+    def confident_guess(self, clues, code_words=None, slot_clues=None):
+        """A guess when the ranking clears the confidence threshold, else None"""
+        guess, confidence = self.guess(clues, code_words, slot_clues)
+        if guess is not None and confidence >= self.threshold:
+            local_guesses.inc()
+            logger.info(f"Embedding guesser decoded {clues} as {guess} ({confidence:.2f})")
+            return guess
+        local_escalations.inc()
+        return None
+
+
+embedding_guesser = EmbeddingGuesser()
+
+
+def build_vectors(glove_path, out, vocab_size, extra_words=()):
+    """Write a memory-mappable table of the vocab_size most frequent GloVe words plus extra_words"""
+    wanted = {word.lower() for word in extra_words}
+    words, vectors = [], []
+    with open(glove_path, encoding='utf8') as f:
+        for rank, line in enumerate(f):
+            word, _, values = line.rstrip().partition(' ')
+            if not word.isalpha() or (rank >= vocab_size and word not in wanted):
+                continue
+            words.append(word)
+            vectors.append(np.array(values.split(), dtype=np.float32))
+    matrix = np.vstack(vectors)
+    matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-9)
+    order = np.argsort(words)
+    np.save(f"{out}.vectors.npy", matrix[order].astype(np.float16))
+    np.save(f"{out}.vocab.npy", np.array(words)[order])
+    missing = wanted - set(words)
+    logger.info(f"Wrote {len(words)} word vectors to {out}, {len(missing)} code words missing")
+    return len(words)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the word vector table for the embedding guesser')
+    parser.add_argument('--glove', required=True, help='GloVe text file, e.g. glove.6B.100d.txt')
+    parser.add_argument('--words', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'code_words.txt'),
+                        help='Code word list, always included in the table')
+    parser.add_argument('--vocab-size', type=int, default=40000, help='Most frequent GloVe words to keep for clues')
+    parser.add_argument('--out', default=WORD_VECTORS_PATH, help='Output path prefix')
+    args = parser.parse_args()
+
+    with open(args.words) as f:
+        words = [word.strip() for word in f if word.strip()]
+    build_vectors(args.glove, args.out, args.vocab_size, words)
@@ -0,0 +1,223 @@
+"""Append-only log of room state changes, with snapshots, for crash recovery
+
+With EVENT_LOG_DIR set, every versioned state change a room publishes
+(player_joined, round_started, clues_submitted, guess_submitted,
+round_evaluated, ...) is appended to a JSONL segment in that directory:
+
+    {"room": "ABC123", "version": 7, "event": "clues_submitted", "at": 1700000000.0, "delta": {...}}
+
+A writer thread commits whatever has queued up every
+EVENT_LOG_COMMIT_INTERVAL seconds with a single write and fsync, so one
+fsync covers every room's changes in that window. Rooms share segments
+rather than having a file each for the same reason.
+
+Every EVENT_LOG_SNAPSHOT_INTERVAL seconds the log starts a new segment and
+writes a snapshot of every room's to_state(); older segments and snapshots
+are then deleted. On startup recover() loads the newest snapshot and
+replays the segments written since, skipping changes a room's snapshot
+already includes, so recovery reads at most one snapshot interval of
+events.
+"""
+import os
+import glob
+import time
+import threading
+import structlog
+import metrics
+from game import DecryptoGame, dumps, loads
+
+logger = structlog.getLogger()
+
+EVENT_LOG_DIR = os.environ.get('EVENT_LOG_DIR')
+EVENT_LOG_COMMIT_INTERVAL = float(os.environ.get('EVENT_LOG_COMMIT_INTERVAL', 0.005))
+EVENT_LOG_SNAPSHOT_INTERVAL = float(os.environ.get('EVENT_LOG_SNAPSHOT_INTERVAL', 60))
+
+events_logged = metrics.counter('event_log_events_total', 'Room changes appended to the event log')
+commit_seconds = metrics.histogram('event_log_commit_seconds', 'Time to write and fsync one group commit')
+commit_events = metrics.histogram('event_log_commit_events', 'Events written per group commit',
+                                  buckets=(1, 2, 5, 10, 25, 50, 100, 250, 1000))
+snapshot_seconds = metrics.histogram('event_log_snapshot_seconds', 'Time to snapshot every room')
+replayed_events = metrics.counter('event_log_replayed_events_total', 'Logged changes replayed during recovery')
+
+# Logged when a room is deleted, so recovery doesn't bring it back
+ROOM_CLOSED = 'room_closed'
+
+
+def _sequence(path):
+    return int(os.path.basename(path).split('-')[1].split('.')[0])
+
+
+class EventLog:
+    def __init__(self, directory, commit_interval=EVENT_LOG_COMMIT_INTERVAL, fsync=True):
+        self.directory = directory
+        self.commit_interval = commit_interval
+        self.fsync = fsync
+        os.makedirs(directory, exist_ok=True)
+        segments = self._files('events')
+        self._segment = _sequence(segments[-1]) + 1 if segments else 1
+        self._file = open(self._path('events', self._segment), 'ab')
+        self._queue = []
+        self._written = 0        # Records handed to the writer so far, and how many are durable
+        self._durable = 0
+        self._cond = threading.Condition()
+        self._file_lock = threading.Lock()
+        self._writer = None
+        self._closed = False
+
+    def _path(self, kind, sequence):
+        return os.path.join(self.directory, f"{kind}-{sequence:08d}.jsonl")
+
+    def _files(self, kind):
+        return sorted(glob.glob(os.path.join(self.directory, f"{kind}-*.jsonl")), key=_sequence)
+
+    def start(self):
+        """Start the group-commit writer thread once"""
+        with self._cond:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_forever, name='event-log-writer', daemon=True)
+                self._writer.start()
+
+    def append(self, room_code, payload):
+        """Queue a published state change; usable directly as a game change listener"""
+        self._enqueue(dumps({'room': room_code, 'version': payload['version'], 'event': payload['event'],
+                             'at': time.time(), 'delta': payload['delta']}))
+
+    def drop(self, room_code):
+        """Record that a room was deleted"""
+        self._enqueue(dumps({'room': room_code, 'event': ROOM_CLOSED, 'at': time.time()}))
+
+    def _enqueue(self, record):
+        if self._writer is None:
+            self.start()
+        with self._cond:
+            self._queue.append(record)
+            self._written += 1
+            self._cond.notify_all()
+
+    def flush(self, timeout=5):
+        """Block until everything queued so far is written and synced"""
+        with self._cond:
+            target = self._written
+            return self._cond.wait_for(lambda: self._durable >= target, timeout=timeout)
+
+    def _write_forever(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._queue or self._closed)
+                if self._closed and not self._queue:
+                    return
+            # Let more changes join this commit
+            time.sleep(self.commit_interval)
+            with self._cond:
+                batch, self._queue = self._queue, []
+            try:
+                self._commit(batch)
+            except Exception as e:
+                logger.error(f"Event log commit of {len(batch)} events failed: {e}")
+            with self._cond:
+                self._durable += len(batch)
+                self._cond.notify_all()
+
+    def _commit(self, batch):
+        started_at = time.perf_counter()
+        with self._file_lock:
+            self._file.write(('\n'.join(batch) + '\n').encode())
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+        commit_seconds.observe(time.perf_counter() - started_at)
+        commit_events.observe(len(batch))
+        events_logged.inc(len(batch))
+
+    def snapshot(self, games):
+        """Start a new segment, write the state of every game, then drop what the snapshot covers
+
+        games is an iterable of rooms read after the segment switch (under
+        each room's lock), so every change in an older segment is in it.
+        """
+        started_at = time.perf_counter()
+        self.flush()
+        with self._file_lock:
+            self._file.close()
+            self._segment += 1
+            segment = self._segment
+            self._file = open(self._path('events', segment), 'ab')
+
+        path = self._path('snapshot', segment)
+        count = 0
+        with open(path + '.tmp', 'wb') as f:
+            for game in games:
+                if game is not None:
+                    f.write(game.to_state().encode() + b'\n')
+                    count += 1
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+
+        for old in self._files('events') + self._files('snapshot'):
+            if _sequence(old) < segment:
+                os.remove(old)
+        elapsed = time.perf_counter() - started_at
+        snapshot_seconds.observe(elapsed)
+        logger.info(f"Snapshotted {count} rooms in {elapsed * 1000:.1f}ms")
+        return count
+
+    def recover(self):
+        """Rooms as of the last logged change: the newest snapshot plus the events after it"""
+        started_at = time.perf_counter()
+        games = {}
+        snapshots = self._files('snapshot')
+        first_segment = 0
+        if snapshots:
+            first_segment = _sequence(snapshots[-1])
+            with open(snapshots[-1], 'rb') as f:
+                for line in f:
+                    game = DecryptoGame.from_state(line)
+                    games[game.room_code] = game
+
+        replayed = 0
+        for path in self._files('events'):
+            if _sequence(path) < first_segment:
+                continue
+            with open(path, 'rb') as f:
+                for line in f:
+                    try:
+                        record = loads(line)
+                    except ValueError:
+                        logger.warning(f"Skipping torn event log record in {path}")
+                        continue
+                    room_code = record['room']
+                    if record['event'] == ROOM_CLOSED:
+                        games.pop(room_code, None)
+                        continue
+                    game = games.get(room_code)
+                    if game is None:
+                        game = games[room_code] = DecryptoGame(room_code)
+                    if record['version'] > game.version:
+                        game.apply_change(record['version'], record['delta'], record['at'])
+                        replayed += 1
+        for game in games.values():
+            # Deltas don't carry the pre-drawn next code, which may have been used since the snapshot
+            game.next_code = None
+        replayed_events.inc(replayed)
+        logger.info(f"Recovered {len(games)} rooms from {self.directory} "
+                    f"({replayed} events replayed in {time.perf_counter() - started_at:.2f}s)")
+        return games
+
+    def run_snapshots(self, read_games, interval=EVENT_LOG_SNAPSHOT_INTERVAL, sleep=time.sleep):
+        """Snapshot read_games() every interval seconds"""
+        while True:
+            sleep(interval)
+            try:
+                self.snapshot(read_games())
+            except Exception as e:
+                logger.error(f"Error snapshotting rooms: {e}")
+
+    def close(self):
+        self.flush()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        with self._file_lock:
+            self._file.close()
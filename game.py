@@ -0,0 +1,791 @@
+import json
+import time
+import random
+import threading
+from contextlib import contextmanager
+import structlog
+import metrics
+from ai_player import DecryptoAI
+from ai_scheduler import ai_scheduler, check_task, time_left
+from ai_prewarm import prewarmer
+from clue_bank import clue_bank
+from embedding_guesser import embedding_guesser
+from opponent_model import ClueModel
+from word_list import WordList, load_word_list
+
+try:
+    import orjson  # Optional, several times faster than the json module
+except ImportError:
+    orjson = None
+
+logger = structlog.getLogger()
+
+# Game constants
+TEAM_COLORS = ['red', 'blue']
+GAME_PHASES = ['setup', 'clue_giving', 'guessing', 'scoring', 'finished']
+CODE_WORDS_PER_TEAM = 4
+CODES_TO_WIN = 8
+INTERCEPTIONS_TO_LOSE = 2
+
+# Seconds rooms spend in each phase before moving on, from a quick AI move to a long human discussion
+phase_seconds = {phase: metrics.histogram('game_phase_seconds', 'Time a room spent in a phase before leaving it',
+                                          buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800),
+                                          labels={'phase': phase})
+                 for phase in GAME_PHASES}
+
+# Who a projected state is for: one of the teams, or a spectator who sees neither team's secrets
+VIEWERS = TEAM_COLORS + ['spectator']
+
+# Word universe for generated and validated code words
+code_words = WordList(())
+
+# Callables invoked as listener(room_code, payload) after every state change
+change_listeners = []
+
+def apply_in_place(game, mutate):
+    return mutate(game)
+
+# How AI results reach a room: mutator(game, mutate) applies mutate to the
+# authoritative copy of the game, which may live in an external room store
+room_mutator = apply_in_place
+
+# How AI tasks check whether a room has moved on: reader(game) returns the
+# stored copy of the game, which other workers may have changed, or None if
+# the room is gone
+room_reader = lambda game: game
+
+# Callables invoked as listener(room_code, payload) for every change while
+# its writer still holds the room, so each room's changes reach them in
+# version order (e.g. the event log); they must not block
+ordered_change_listeners = []
+
+def publish(payload):
+    """Hand a state change to every change listener"""
+    publish_ordered(payload)
+    for listener in change_listeners:
+        listener(payload['room_code'], payload)
+
+def publish_ordered(payload):
+    for listener in ordered_change_listeners:
+        listener(payload['room_code'], payload)
+
+# Callables invoked as listener(room_code, payload) with partial AI answers
+# as they stream in; these aren't state changes and carry no version
+progress_listeners = []
+
+def publish_progress(payload):
+    for listener in progress_listeners:
+        listener(payload['room_code'], payload)
+
+_pending = threading.local()
+
+class ChangeBatch:
+    """Change events and after_commit actions held back by collect_changes"""
+
+    def __init__(self):
+        self.changes = []
+        self.actions = []
+        self.recorded = False
+
+    def record(self):
+        """Hand the held changes to the ordered change listeners; call before letting go of the room"""
+        if not self.recorded:
+            self.recorded = True
+            for payload in self.changes:
+                publish_ordered(payload)
+
+    def flush(self):
+        """Publish the held changes, then run the held actions"""
+        self.record()
+        for payload in self.changes:
+            for listener in change_listeners:
+                listener(payload['room_code'], payload)
+        for action in self.actions:
+            action()
+
+@contextmanager
+def collect_changes():
+    """Hold back change events and after_commit actions raised on this thread
+
+    Yields a ChangeBatch for the caller to flush once its write has
+    succeeded. Nested blocks join the outermost one and yield None.
+    """
+    if getattr(_pending, 'batch', None) is not None:
+        yield None
+        return
+    _pending.batch = batch = ChangeBatch()
+    try:
+        yield batch
+    finally:
+        _pending.batch = None
+
+def after_commit(action):
+    """Run action once the surrounding collect_changes block succeeds, or now outside one"""
+    batch = getattr(_pending, 'batch', None)
+    if batch is None:
+        action()
+    else:
+        batch.actions.append(action)
+
+def dumps(value):
+    """Compact JSON text, through orjson when it's installed"""
+    if orjson is not None:
+        return orjson.dumps(value).decode()
+    return json.dumps(value, separators=(',', ':'))
+
+def loads(text):
+    return orjson.loads(text) if orjson is not None else json.loads(text)
+
+def project(fields, viewer, phase, current_team):
+    """Copy of state or delta fields with what `viewer` may not see blanked out
+
+    Teams see only their own code words, the current code only while they
+    are the team giving clues, and the other team's guess only once the
+    round is scored. Everything is revealed when the game is finished.
+    """
+    if phase == 'finished':
+        return fields
+    view = dict(fields)
+    if 'teams' in fields:
+        view['teams'] = {
+            team_color: {**team, 'code_words': team['code_words'] if team_color == viewer else [],
+                         'code_word_count': len(team['code_words'])}
+            for team_color, team in fields['teams'].items()
+        }
+    if view.get('current_code') is not None and viewer != current_team:
+        view['current_code'] = None
+    if phase == 'guessing' and 'team_guesses' in fields:
+        view['team_guesses'] = {team_color: guess if team_color == viewer else None
+                                for team_color, guess in fields['team_guesses'].items()}
+    return view
+
+def project_delta(payload, viewer):
+    """A change payload as `viewer` may see it"""
+    return {**payload, 'delta': project(payload['delta'], viewer, payload['phase'], payload['current_team'])}
+
+def load_code_words(path, themes_dir=None):
+    """Load the code word list and any themed lists, falling back to a tiny built-in list"""
+    global code_words
+    code_words = load_word_list(path, themes_dir, embedding_guesser.embed if embedding_guesser.available else None)
+    return code_words
+
+class Team:
+    """One team's roster, secret words and score"""
+    __slots__ = ('players', 'code_words', 'successful_codes', 'interception_tokens', 'ai_players')
+
+    def __init__(self, players=None, code_words=None, successful_codes=0, interception_tokens=0, ai_players=None):
+        self.players = players if players is not None else []
+        self.code_words = code_words if code_words is not None else []
+        self.successful_codes = successful_codes
+        self.interception_tokens = interception_tokens
+        self.ai_players = ai_players if ai_players is not None else []
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.__slots__}
+
+class RoundRecord:
+    """A completed round; never changes once it is in the history"""
+    __slots__ = ('round', 'team', 'code', 'clues', 'guesses')
+
+    def __init__(self, round, team, code, clues, guesses):
+        self.round = round
+        self.team = team
+        self.code = code
+        self.clues = clues
+        self.guesses = guesses
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.__slots__}
+
+class RoundHistory:
+    """Append-only round history that keeps its serialized forms up to date
+
+    Each record is converted to a dict and encoded to JSON once, when it is
+    appended, so serializing a room doesn't re-encode rounds already played.
+    """
+    __slots__ = ('_records', '_dicts', '_json')
+
+    def __init__(self, records=()):
+        self._records = []
+        self._dicts = []
+        self._json = '[]'
+        for record in records:
+            self.append(record)
+
+    def append(self, record):
+        entry = record.to_dict()
+        chunk = dumps(entry)
+        self._json = f"[{chunk}]" if not self._records else f"{self._json[:-1]},{chunk}]"
+        self._records.append(record)
+        self._dicts.append(entry)
+
+    def to_list(self):
+        """Rounds as dicts; shared, so callers must not modify them"""
+        return self._dicts
+
+    def to_json(self):
+        return self._json
+
+    def __iter__(self):
+        return iter(self._records)
+
+    def __len__(self):
+        return len(self._records)
+
+    def __getitem__(self, index):
+        return self._records[index]
+
+class DecryptoGame:
+    # AI collaborators, swappable per game (e.g. for headless self-play)
+    ai_class = DecryptoAI
+    scheduler = ai_scheduler
+    clue_bank = clue_bank
+    prewarmer = prewarmer
+
+    # Fields persisted by to_state(), in order
+    STATE_FIELDS = ('room_code', 'teams', 'current_round', 'current_team', 'phase', 'current_code',
+                    'current_clues', 'team_guesses', 'round_history', 'winner', 'version', 'updated_at',
+                    'applied_commands', 'clue_models', 'phase_started', 'next_code')
+
+    # Command IDs remembered per room for idempotent retries
+    MAX_APPLIED_COMMANDS = 64
+
+    def __init__(self, room_code):
+        self.room_code = room_code
+        self.teams = {team_color: Team() for team_color in TEAM_COLORS}
+        self.current_round = 1
+        self.current_team = 'red'  # Which team is giving clues
+        self.phase = 'setup'
+        self.current_code = None  # 3-digit code like [4, 2, 1]
+        self.current_clues = []   # Clues for current code
+        self.team_guesses = {}    # Guesses from both teams
+        self.round_history = RoundHistory()
+        self.winner = None
+        self.version = 0          # Bumped on every state change
+        self.updated_at = time.time()
+        self.applied_commands = []  # [command_id, result] of recent client commands
+        self.clue_models = {team_color: ClueModel() for team_color in TEAM_COLORS}  # What each team's clues reveal
+        self.phase_started = [self.phase, self.updated_at]  # [phase, wall-clock time it was entered]
+        self.next_code = None     # Next round's code when drawn early for speculative AI clues
+        self._state_changed = threading.Condition()
+        self._json = {}           # viewer -> (version, to_json() text) of its last serialization
+
+    def to_state(self):
+        """Compact serialized form of the full game, for external room stores"""
+        parts = []
+        for field in self.STATE_FIELDS:
+            if field == 'round_history':
+                parts.append(self.round_history.to_json())
+            elif field == 'teams':
+                parts.append(dumps(self.teams_dict()))
+            elif field == 'clue_models':
+                parts.append(dumps({team_color: model.to_list() for team_color, model in self.clue_models.items()}))
+            else:
+                parts.append(dumps(getattr(self, field)))
+        return f"[{','.join(parts)}]"
+
+    @classmethod
+    def from_state(cls, state):
+        """Rebuild a game from to_state() output"""
+        values = loads(state)
+        game = cls(values[0])
+        for field, value in zip(cls.STATE_FIELDS, values):
+            if field == 'teams':
+                value = {team_color: Team(**team) for team_color, team in value.items()}
+            elif field == 'round_history':
+                value = RoundHistory(RoundRecord(**entry) for entry in value)
+            elif field == 'clue_models':
+                value = {team_color: ClueModel(slot_clues) for team_color, slot_clues in value.items()}
+            setattr(game, field, value)
+        if len(values) <= cls.STATE_FIELDS.index('clue_models'):
+            # Saved before clue models existed
+            for record in game.round_history:
+                game.clue_models[record.team].update(record.code, record.clues)
+        if len(values) <= cls.STATE_FIELDS.index('phase_started'):
+            game.phase_started = [game.phase, game.updated_at]
+        return game
+
+    def apply_change(self, version, delta, at):
+        """Replay a delta published by _changed(), e.g. from the event log
+
+        Replaying every delta a room published rebuilds its state, apart from
+        applied_commands, which deltas don't carry.
+        """
+        for field, value in delta.items():
+            if field == 'teams':
+                for team_color, team in value.items():
+                    self.teams[team_color] = Team(**team)
+            elif field == 'history_entry':
+                record = RoundRecord(**value)
+                self.round_history.append(record)
+                self.clue_models[record.team].update(record.code, record.clues, code_words)
+            elif field == 'current_code' and value is None:
+                # Hidden from clients once the round is scored, but still part of the state
+                continue
+            else:
+                setattr(self, field, value)
+        self.version = version
+        self.updated_at = at
+        if self.phase != self.phase_started[0]:
+            self.phase_started = [self.phase, at]
+
+    def resume_ai(self):
+        """Queue the AI move a restored room was waiting for, if any"""
+        if self.phase == 'clue_giving' and self.teams[self.current_team].ai_players:
+            self._ai_generate_clues()
+        elif self.phase == 'guessing':
+            self._ai_guess_codes()
+
+    def visible_code(self):
+        """The current code as exposed to clients (hidden outside active play)"""
+        return self.current_code if self.phase in ['clue_giving', 'guessing'] else None
+
+    def etag(self, viewer=None):
+        """Entity tag identifying the current state version as seen by viewer"""
+        return f"{self.room_code}-{self.version}" + (f"-{viewer}" if viewer else '')
+
+    def wait_for_change(self, since, timeout):
+        """Block until the state version moves past `since` or the timeout expires"""
+        with self._state_changed:
+            return self._state_changed.wait_for(lambda: self.version > since, timeout=timeout)
+
+    def _changed(self, event, delta):
+        """Bump the state version and push an incremental delta to room subscribers"""
+        with self._state_changed:
+            self.version += 1
+            self.updated_at = time.time()
+            self._state_changed.notify_all()
+        if self.phase != self.phase_started[0]:
+            phase_seconds[self.phase_started[0]].observe(self.updated_at - self.phase_started[1])
+            self.phase_started = [self.phase, self.updated_at]
+        payload = {
+            'room_code': self.room_code,
+            'version': self.version,
+            'event': event,
+            'phase': self.phase,
+            'current_team': self.current_team,
+            'delta': delta
+        }
+        batch = getattr(_pending, 'batch', None)
+        if batch is not None:
+            batch.changes.append(payload)
+        else:
+            publish(payload)
+
+    def run_command(self, command_id, mutate):
+        """Apply a client command once; a retry with the same ID returns the first result"""
+        for applied_id, result in self.applied_commands:
+            if applied_id == command_id:
+                return result
+        version = self.version
+        result = mutate(self)
+        if self.version != version:
+            self.applied_commands = (self.applied_commands + [[command_id, result]])[-self.MAX_APPLIED_COMMANDS:]
+        return result
+
+    def _ai_progress(self, kind, round_number):
+        """Callback publishing an AI answer's items for this round as they arrive"""
+        def progress(team_color, items):
+            publish_progress({
+                'room_code': self.room_code,
+                'round': round_number,
+                'kind': kind,
+                'team': team_color,
+                'items': items
+            })
+        return progress
+
+    def _apply_ai(self, mutate):
+        """Apply an AI result to the authoritative copy of this room"""
+        return room_mutator(self, mutate)
+
+    def _stored(self):
+        """The authoritative copy of this room, or None if it was closed"""
+        return room_reader(self)
+
+    def teams_dict(self):
+        return {team_color: team.to_dict() for team_color, team in self.teams.items()}
+
+    def _summary(self, viewer=None):
+        """API fields other than the round history, projected for viewer if given"""
+        summary = {
+            'room_code': self.room_code,
+            'teams': self.teams_dict(),
+            'current_round': self.current_round,
+            'current_team': self.current_team,
+            'phase': self.phase,
+            'current_code': self.visible_code(),
+            'current_clues': self.current_clues,
+            'team_guesses': self.team_guesses,
+            'winner': self.winner,
+            'version': self.version
+        }
+        return summary if viewer is None else project(summary, viewer, self.phase, self.current_team)
+
+    def to_dict(self, viewer=None):
+        """Convert game state to dictionary for API responses
+
+        With a viewer from VIEWERS, only what that viewer may see is included.
+        """
+        state = self._summary(viewer)
+        state['round_history'] = self.round_history.to_list()
+        return state
+
+    def to_json(self, viewer=None):
+        """to_dict(viewer) as JSON text, computed once per state version and viewer"""
+        version = self.version
+        cached = self._json.get(viewer)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        text = f"{dumps(self._summary(viewer))[:-1]},\"round_history\":{self.round_history.to_json()}}}"
+        self._json[viewer] = (version, text)
+        return text
+
+    def add_player(self, player_name, team_color):
+        """Add a player to a team"""
+        if team_color in self.teams:
+            if player_name not in self.teams[team_color].players:
+                self.teams[team_color].players.append(player_name)
+                self._changed('player_joined', {'teams': {team_color: self.teams[team_color].to_dict()}})
+                return True
+        return False
+
+    def add_ai_players(self, team_color, count=2):
+        """Add AI players to a team"""
+        if team_color in self.teams:
+            ai_names = [f"AI {i+1}" for i in range(count)]
+            self.teams[team_color].ai_players.extend(ai_names)
+            self._changed('ai_added', {'teams': {team_color: self.teams[team_color].to_dict()}})
+            return True
+        return False
+
+    def generate_code_words(self, team_color, theme=None):
+        """Deal 4 random code words for a team, from one theme if given
+
+        They differ from, and aren't too alike to, each other and the other
+        team's words whenever the list allows it.
+        """
+        pool_size = len(code_words.themes.get(theme, ())) if theme else len(code_words)
+        if team_color in self.teams and pool_size >= CODE_WORDS_PER_TEAM:
+            other_words = [word for other, team in self.teams.items() if other != team_color for word in team.code_words]
+            selected_words = code_words.deal(CODE_WORDS_PER_TEAM, exclude=other_words, theme=theme)
+            self.teams[team_color].code_words = selected_words
+            logger.info(f"Generated code words for team {team_color}: {selected_words}")
+            self._changed('words_set', {'teams': {team_color: self.teams[team_color].to_dict()}})
+            return selected_words
+        return []
+
+    def set_code_words(self, team_color, words):
+        """Set the 4 code words for a team; they must be distinct words from the word list"""
+        if not isinstance(words, list) or not all(word in code_words for word in words):
+            return False
+        words = [word.upper() for word in words]
+        if team_color in self.teams and len(set(words)) == CODE_WORDS_PER_TEAM == len(words):
+            self.teams[team_color].code_words = words
+            self._changed('words_set', {'teams': {team_color: self.teams[team_color].to_dict()}})
+            return True
+        return False
+
+    def generate_code(self):
+        """Generate a random 3-digit code"""
+        return random.choices(range(1, CODE_WORDS_PER_TEAM + 1), k=3)
+
+    def start_round(self):
+        """Start a new round"""
+        if self.phase == 'setup' and self.all_teams_ready():
+            self.current_code = self.generate_code()
+            self.current_clues = []
+            self.team_guesses = {}
+            self.phase = 'clue_giving'
+            logger.info(f"Round {self.current_round} started for team {self.current_team}, code: {self.current_code}")
+            self._changed('round_started', {
+                'current_team': self.current_team,
+                'phase': self.phase,
+                'current_code': self.visible_code(),
+                'current_clues': self.current_clues,
+                'team_guesses': self.team_guesses
+            })
+            
+            # If current team is AI, generate clues automatically
+            if self.teams[self.current_team].ai_players:
+                self._ai_generate_clues()
+                
+            return True
+        return False
+
+    def _ai_generate_clues(self):
+        """Queue AI clue generation for the current team's code"""
+        team_color = self.current_team
+        round_number = self.current_round
+        code_words = list(self.teams[team_color].code_words)
+        code = list(self.current_code)
+
+        # Answer straight from the clue bank when it has unused clues
+        clues = self.clue_bank.assemble(code_words, code, self._used_clues(team_color)) if self.clue_bank else None
+        if clues:
+            logger.info(f"AI team {team_color} gave clue bank clues: {clues}")
+            self.submit_clues(clues)
+            return True
+
+        # Or with the clues generated for this code while the last round was guessed. The speculation
+        # is only claimed once this state is saved, so an update retried after a conflict finds it again
+        room_code = self.room_code
+        speculation = self.prewarmer.peek(room_code, round_number, code) if self.prewarmer else None
+        if speculation is not None and speculation.done and speculation.clues:
+            logger.info(f"AI team {team_color} gave speculative clues: {speculation.clues}")
+
+            def use_speculation():
+                claimed = self.prewarmer.claim(room_code, round_number, code)
+                if claimed is not None:
+                    claimed.result()  # Counts the hit
+            after_commit(use_speculation)
+            self.submit_clues(speculation.clues)
+            return True
+
+        used_clues = self._used_clues(team_color)
+
+        def generate():
+            clues = None
+            speculation = self.prewarmer.claim(room_code, round_number, code) if self.prewarmer else None
+            if speculation is not None:
+                # Leave the task time to ask the LLM itself if the speculation fails
+                left = time_left()
+                wait = self.prewarmer.wait if left is None else min(self.prewarmer.wait, left / 2)
+                clues = speculation.result(wait, check=check_task)
+            if not clues:
+                clues = self.ai_class(team_color).generate_clues(code_words, code,
+                                                                 on_progress=self._ai_progress('clues', round_number),
+                                                                 used_clues=used_clues)
+            logger.info(f"AI team {team_color} generated clues: {clues}")
+            return clues
+
+        def still_giving_clues():
+            game = self._stored()
+            return game is not None and game.phase == 'clue_giving' and game.current_round == round_number
+
+        # Queue only once this state is saved, so the task sees the round it belongs to
+        after_commit(lambda: self.scheduler.submit(
+            self.room_code,
+            generate,
+            on_result=lambda clues: self._apply_ai(
+                lambda game: game.current_round == round_number and game.submit_clues(clues)),
+            # Fallback simple clues
+            fallback=lambda: [f"word{i}" for i in code],
+            is_current=still_giving_clues
+        ))
+        return True
+
+    def _used_clues(self, team_color):
+        return [clue for record in self.round_history if record.team == team_color for clue in record.clues]
+
+    def _prewarm_next_clues(self):
+        """Draw the next round's code now and, if an AI gives its clues, start generating them
+
+        The next code doesn't depend on this round's guesses, so the clues can
+        be ready by the time the round starts.
+        """
+        next_team = 'blue' if self.current_team == 'red' else 'red'
+        if not self.prewarmer or not self.teams[next_team].ai_players:
+            return
+        self.next_code = self.generate_code()
+        code_words = list(self.teams[next_team].code_words)
+        code = list(self.next_code)
+        if self.clue_bank and self.clue_bank.covers(code_words, code, self._used_clues(next_team)):
+            return
+        # The team's used clues can't change before its next round, so the speculation can avoid them now
+        used_clues = self._used_clues(next_team)
+        ai = self.ai_class(next_team)
+        round_number = self.current_round + 1
+        after_commit(lambda: self.prewarmer.start(self.room_code, round_number, code,
+                                                  lambda: ai.generate_clues(code_words, code, used_clues=used_clues),
+                                                  self.scheduler))
+
+    def all_teams_ready(self):
+        """Check if both teams have code words set"""
+        for team in self.teams.values():
+            if len(team.code_words) != CODE_WORDS_PER_TEAM:
+                return False
+        return True
+
+    def submit_clues(self, clues):
+        """Submit clues for the current code"""
+        if self.phase == 'clue_giving' and len(clues) == 3:
+            self.current_clues = clues
+            self.phase = 'guessing'
+            logger.info(f"Clues submitted: {clues}")
+            self._changed('clues_submitted', {'phase': self.phase, 'current_clues': self.current_clues})
+            if self.prewarmer:
+                # Clues that didn't come from this round's speculation (e.g. the clue bank's) make it useless
+                room_code, round_number = self.room_code, self.current_round
+                after_commit(lambda: self.prewarmer.cancel(room_code, round_number))
+            
+            # Trigger AI decoding and interception
+            self._ai_guess_codes()
+            self._prewarm_next_clues()
+                
+            return True
+        return False
+
+    def _ai_guess_codes(self):
+        """Queue guesses for every AI team, sharing one LLM call where the teams know the same words"""
+        round_number = self.current_round
+        clues = list(self.current_clues)
+        clue_model = self.clue_models[self.current_team]
+
+        guessers = {}
+        for team_color in TEAM_COLORS:
+            if not self.teams[team_color].ai_players:
+                continue
+            own_team = team_color == self.current_team
+            # Interceptors only get the opponent's words once some have been revealed through play
+            known_words = own_team or len(self.round_history) > 2
+            guessers[team_color] = {
+                'code_words': list(self.teams[self.current_team].code_words) if known_words else None,
+                # Guessers without the words get the likeliest words from the list for each slot instead
+                'slot_summary': clue_model.summary(None if known_words else code_words),
+                'own_team': own_team
+            }
+        if not guessers:
+            return
+
+        # A single prompt would leak the words to an interceptor that isn't entitled to them yet
+        if all(guesser['code_words'] for guesser in guessers.values()):
+            groups = [guessers]
+        else:
+            groups = [{team_color: guesser} for team_color, guesser in guessers.items()]
+
+        def still_guessing(game, team_color):
+            return (game.phase == 'guessing' and game.current_round == round_number
+                    and team_color not in game.team_guesses)
+
+        def group_still_guessing(group):
+            game = self._stored()
+            return game is not None and any(still_guessing(game, team_color) for team_color in group)
+
+        def apply(guesses):
+            def submit(game):
+                for team_color, guess in guesses.items():
+                    if still_guessing(game, team_color):
+                        game.submit_guess(team_color, guess)
+            self._apply_ai(submit)
+
+        for group in groups:
+            def plan(group=group):
+                guesses = self.ai_class(next(iter(group))).plan_guesses(
+                    clues, group, on_progress=self._ai_progress('guess', round_number))
+                logger.info(f"AI teams guessed: {guesses}")
+                return guesses
+
+            after_commit(lambda group=group, plan=plan: self.scheduler.submit(
+                self.room_code,
+                plan,
+                on_result=apply,
+                # Fallback random guesses
+                fallback=lambda group=group: {team_color: random.choices(range(1, 5), k=3) for team_color in group},
+                is_current=lambda group=group: group_still_guessing(group)
+            ))
+
+    def submit_guess(self, team_color, guess):
+        """Submit a guess from a team"""
+        if self.phase == 'guessing' and len(guess) == 3:
+            self.team_guesses[team_color] = guess
+            logger.info(f"Team {team_color} guessed: {guess}")
+            self._changed('guess_submitted', {'team_guesses': self.team_guesses})
+            
+            # Check if both teams have guessed
+            if len(self.team_guesses) == 2:
+                self.evaluate_round()
+            return True
+        return False
+
+    def evaluate_round(self):
+        """Evaluate the round and update scores"""
+        self.phase = 'scoring'
+        
+        current_team_guess = self.team_guesses.get(self.current_team, [])
+        other_team = 'blue' if self.current_team == 'red' else 'red'
+        other_team_guess = self.team_guesses.get(other_team, [])
+        
+        # Check if current team guessed correctly
+        if current_team_guess == self.current_code:
+            self.teams[self.current_team].successful_codes += 1
+            logger.info(f"Team {self.current_team} successfully communicated!")
+        
+        # Check if other team intercepted
+        if other_team_guess == self.current_code:
+            self.teams[other_team].interception_tokens += 1
+            logger.info(f"Team {other_team} intercepted the code!")
+        
+        # Add to history
+        record = RoundRecord(self.current_round, self.current_team, self.current_code,
+                             self.current_clues.copy(), self.team_guesses.copy())
+        self.round_history.append(record)
+        self.clue_models[self.current_team].update(self.current_code, self.current_clues, code_words)
+        
+        # Check win conditions
+        finished = self.check_win_conditions()
+        if finished:
+            self.phase = 'finished'
+            # Only once the finished state is saved, as a retried update must still find them
+            room_code = self.room_code
+            after_commit(lambda: self.scheduler.cancel(room_code))
+            if self.prewarmer:
+                after_commit(lambda: self.prewarmer.discard(room_code))
+        self._changed('round_evaluated', {
+            'phase': self.phase,
+            'current_code': self.visible_code(),
+            'teams': self.teams_dict(),
+            'winner': self.winner,
+            'history_entry': self.round_history.to_list()[-1]
+        })
+        if not finished:
+            self.next_round()
+
+    def check_win_conditions(self):
+        """Check if game should end"""
+        for team_color, team in self.teams.items():
+            # Win by successful communication
+            if team.successful_codes >= CODES_TO_WIN:
+                self.winner = team_color
+                logger.info(f"Team {team_color} wins by successful communication!")
+                return True
+            
+            # Lose by too many interceptions
+            if team.interception_tokens >= INTERCEPTIONS_TO_LOSE:
+                other_team = 'blue' if team_color == 'red' else 'red'
+                self.winner = other_team
+                logger.info(f"Team {other_team} wins by intercepting team {team_color}!")
+                return True
+        
+        return False
+
+    def next_round(self):
+        """Advance to next round"""
+        # Switch teams
+        self.current_team = 'blue' if self.current_team == 'red' else 'red'
+        self.current_round += 1
+        self.phase = 'clue_giving'
+        
+        # Use the code drawn early for speculative AI clues, if any
+        self.current_code = self.next_code or self.generate_code()
+        self.next_code = None
+        self.current_clues = []
+        self.team_guesses = {}
+        
+        logger.info(f"Round {self.current_round} - Team {self.current_team}'s turn")
+        self._changed('next_round', {
+            'current_round': self.current_round,
+            'current_team': self.current_team,
+            'phase': self.phase,
+            'current_code': self.visible_code(),
+            'current_clues': self.current_clues,
+            'team_guesses': self.team_guesses
+        })
+        
+        # Drop AI work queued for the previous round, before this round's is queued
+        room_code = self.room_code
+        after_commit(lambda: self.scheduler.cancel(room_code))
+
+        # If new current team is AI, generate clues automatically
+        if self.teams[self.current_team].ai_players:
+            self._ai_generate_clues()
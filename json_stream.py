@@ -0,0 +1,160 @@
+"""Incremental parsing of streamed JSON answers
+
+The model answers with objects like {"clues": ["a", "b", "c"]} or
+{"red": [1, 2, 3], "blue": [4, 4, 1]}. ArrayStreamParser accepts exactly that
+shape (or a bare array) a chunk at a time and reports each array item the
+moment it is complete, so callers can validate and use items before the
+response has finished, and give up on a malformed response at the first
+character that can't be part of one.
+"""
+import json
+
+WHITESPACE = ' \t\r\n'
+
+# Clues are a word or two; anything much longer is the model rambling
+MAX_STRING_LENGTH = 64
+
+
+class StreamFormatError(ValueError):
+    """The streamed text can't be an answer of the expected shape"""
+
+
+class ArrayStreamParser:
+    def __init__(self, max_string_length=MAX_STRING_LENGTH):
+        self.max_string_length = max_string_length
+        self.items = {}          # key (None for a bare array) -> items so far
+        self._state = 'start'
+        self._top_array = False
+        self._key = None
+        self._token = ''         # string or number being read
+        self._escaped = False
+        self._string_role = None  # 'key' or 'value' while reading a string
+
+    @property
+    def done(self):
+        return self._state == 'done'
+
+    def feed(self, text):
+        """Consume a chunk; returns the (key, index, value) items it completed"""
+        completed = []
+        for char in text:
+            self._step(char, completed)
+        return completed
+
+    def close(self):
+        """Check that the whole answer has been read"""
+        if self._state == 'number':
+            raise StreamFormatError('Answer ended inside a number')
+        if self._state != 'done':
+            raise StreamFormatError(f"Answer ended early ({self._state})")
+        return self.items
+
+    def _fail(self, char):
+        raise StreamFormatError(f"Unexpected {char!r} while expecting {self._state}")
+
+    def _emit(self, value, completed):
+        items = self.items.setdefault(self._key, [])
+        completed.append((self._key, len(items), value))
+        items.append(value)
+
+    def _end_array(self):
+        self._state = 'done' if self._top_array else 'object_comma_or_end'
+
+    def _step(self, char, completed):
+        state = self._state
+        if state == 'string':
+            self._read_string(char, completed)
+            return
+        if state == 'number':
+            if char.isdigit():
+                self._token += char
+                if len(self._token) > 16:
+                    self._fail(char)
+                return
+            if self._token in ('', '-'):
+                self._fail(char)
+            self._emit(int(self._token), completed)
+            self._state = 'array_comma_or_end'
+            state = self._state
+        if char in WHITESPACE:
+            return
+
+        if state == 'start':
+            if char == '{':
+                self._state = 'key_or_end'
+            elif char == '[':
+                self._top_array = True
+                self._key = None
+                self.items[None] = []
+                self._state = 'value_or_end'
+            else:
+                self._fail(char)
+        elif state in ('key_or_end', 'key'):
+            if char == '"':
+                self._start_string('key')
+            elif char == '}' and state == 'key_or_end':
+                self._state = 'done'
+            else:
+                self._fail(char)
+        elif state == 'colon':
+            if char != ':':
+                self._fail(char)
+            self._state = 'array_start'
+        elif state == 'array_start':
+            if char != '[':
+                self._fail(char)
+            self.items.setdefault(self._key, [])
+            self._state = 'value_or_end'
+        elif state in ('value_or_end', 'value'):
+            if char == ']' and state == 'value_or_end':
+                self._end_array()
+            elif char == '"':
+                self._start_string('value')
+            elif char == '-' or char.isdigit():
+                self._token = char
+                self._state = 'number'
+            else:
+                self._fail(char)
+        elif state == 'array_comma_or_end':
+            if char == ',':
+                self._state = 'value'
+            elif char == ']':
+                self._end_array()
+            else:
+                self._fail(char)
+        elif state == 'object_comma_or_end':
+            if char == ',':
+                self._state = 'key'
+            elif char == '}':
+                self._state = 'done'
+            else:
+                self._fail(char)
+        else:  # done: only trailing whitespace is allowed
+            self._fail(char)
+
+    def _start_string(self, role):
+        self._string_role = role
+        self._token = ''
+        self._escaped = False
+        self._state = 'string'
+
+    def _read_string(self, char, completed):
+        if self._escaped:
+            self._escaped = False
+        elif char == '\\':
+            self._escaped = True
+        elif char == '"':
+            try:
+                value = json.loads(f'"{self._token}"')
+            except ValueError as e:
+                raise StreamFormatError(f"Bad string {self._token!r}: {e}")
+            if self._string_role == 'key':
+                self._key = value
+                self._state = 'colon'
+            else:
+                self._emit(value, completed)
+                self._state = 'array_comma_or_end'
+            return
+        self._token += char
+        if len(self._token) > self.max_string_length:
+            raise StreamFormatError(f"String longer than {self.max_string_length} characters")
@@ -0,0 +1,423 @@
+"""Pluggable chat completion backends for the AI players
+
+LLM_BACKEND picks where AI prompts go:
+
+    openai                      the OpenAI API (default)
+    http://127.0.0.1:8089/v1    any OpenAI-compatible server, e.g. the stub below
+    fake://?latency=0.8&jitter=0.5&error_rate=0.02&seed=1
+                                an in-process stand-in with no network at all
+
+The fake answers every prompt the game sends with a well-formed,
+deterministic answer (the same prompt always gets the same answer) after a
+log-normally distributed delay with the given median and spread, and fails
+the given share of requests. The same fake is served over HTTP by
+
+    python llm_backend.py serve --port 8089 --latency 0.8 --jitter 0.5 --error-rate 0.02
+
+so the real OpenAI client and its connection pool can be load tested too.
+
+Every backend reports request latency, time to first token and errors as
+ai_llm_<backend>_* metrics, and sits behind a circuit breaker that refuses
+requests with CircuitOpenError while the backend is failing or slow.
+"""
+import os
+import re
+import math
+import time
+import json
+import zlib
+import random
+import argparse
+import threading
+import structlog
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import metrics
+import tracing
+from circuit_breaker import CircuitBreaker
+from prompts import CLUE_PROMPT, GUESS_PROMPT, PLAN_PROMPT
+
+logger = structlog.getLogger()
+
+LLM_BACKEND = os.environ.get('LLM_BACKEND', 'openai')
+DEFAULT_MODEL = os.environ.get('LLM_MODEL', 'gpt-4o-mini')
+OPENAI_TIMEOUT = float(os.environ.get('OPENAI_TIMEOUT', 15))
+OPENAI_MAX_RETRIES = int(os.environ.get('OPENAI_MAX_RETRIES', 0))
+OPENAI_MAX_CONNECTIONS = int(os.environ.get('OPENAI_MAX_CONNECTIONS', 16))
+# Where to look for the API key when OPENAI_KEY isn't set
+OPENAI_KEY_FILES = [os.environ['OPENAI_KEY_FILE']] if os.environ.get('OPENAI_KEY_FILE') else [
+    '/root/decryptai/.openai_key', '/Users/jong/.openai_key', '/app/.openai_key'
+]
+
+
+class BackendError(Exception):
+    """A backend request failed (the fake's simulated failures included)"""
+
+
+class CircuitOpenError(BackendError):
+    """The backend's circuit breaker is open, so the request wasn't sent"""
+
+
+class LLMBackend:
+    """Streams chat completions and records how long they take"""
+    name = 'base'
+
+    def __init__(self, model=DEFAULT_MODEL, use_breaker=True):
+        self.model = model
+        self.breaker = CircuitBreaker(f'ai_llm_{self.name}') if use_breaker else None
+        self.requests = metrics.counter(f'ai_llm_{self.name}_requests_total', f'Requests sent to the {self.name} backend')
+        self.errors = metrics.counter(f'ai_llm_{self.name}_errors_total', f'Failed {self.name} backend requests')
+        self.request_seconds = metrics.histogram(f'ai_llm_{self.name}_request_seconds',
+                                                 f'Time from request to the end of the {self.name} answer')
+        self.first_token_seconds = metrics.histogram(f'ai_llm_{self.name}_first_token_seconds',
+                                                     f'Time from request to the first {self.name} answer text')
+
+    @property
+    def available(self):
+        return True
+
+    def stream(self, messages, temperature):
+        """Answer text as it arrives, as a TextStream to close when done"""
+        if self.breaker and not self.breaker.allow():
+            raise CircuitOpenError(f"The {self.name} backend is unhealthy, not sending requests")
+        started_at = time.monotonic()
+        self.requests.inc()
+        span = tracing.start_span('llm_call', backend=self.name, model=self.model)
+        try:
+            chunks = self._open(messages, temperature)
+        except Exception as e:
+            elapsed = time.monotonic() - started_at
+            self.errors.inc()
+            self.request_seconds.observe(elapsed)
+            if self.breaker:
+                self.breaker.record(False, elapsed)
+            tracing.end_span(span, e)
+            raise
+        return TextStream(self, chunks, started_at, span)
+
+    def complete(self, messages, temperature):
+        """The whole answer text"""
+        stream = self.stream(messages, temperature)
+        try:
+            return ''.join(stream)
+        finally:
+            stream.close()
+
+    def _open(self, messages, temperature):
+        """Start a request; returns an iterable of answer text chunks, closed with the stream if it has close()"""
+        raise NotImplementedError
+
+
+class TextStream:
+    """Answer text chunks from a backend, timed into its histograms"""
+
+    def __init__(self, backend, chunks, started_at, span=None):
+        self.backend = backend
+        self._chunks = chunks
+        self._started_at = started_at
+        self._span = span
+        self._first = True
+        self._failed = False
+        self._closed = False
+
+    def __iter__(self):
+        try:
+            for text in self._chunks:
+                if self._first:
+                    self.backend.first_token_seconds.observe(time.monotonic() - self._started_at)
+                    self._first = False
+                yield text
+        except Exception:
+            self._failed = True
+            self.backend.errors.inc()
+            raise
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        close = getattr(self._chunks, 'close', None)
+        if close:
+            close()
+        elapsed = time.monotonic() - self._started_at
+        self.backend.request_seconds.observe(elapsed)
+        if self.backend.breaker:
+            self.backend.breaker.record(not self._failed, elapsed)
+        if self._span is not None:
+            self._span.set(failed=self._failed, first_token=not self._first)
+            tracing.end_span(self._span)
+
+
+def _load_api_key():
+    api_key = os.environ.get("OPENAI_KEY", None)
+    if api_key:
+        return api_key
+    for path in OPENAI_KEY_FILES:
+        try:
+            with open(path) as f:
+                return f.read().strip()
+        except OSError:
+            continue
+    raise BackendError(f"No OPENAI_KEY and no key file in {OPENAI_KEY_FILES}")
+
+
+class OpenAIBackend(LLMBackend):
+    """The OpenAI API, or any server speaking its chat completions protocol at base_url"""
+    name = 'openai'
+
+    def __init__(self, base_url=None, api_key=None, model=DEFAULT_MODEL, use_breaker=True):
+        super().__init__(model, use_breaker)
+        self.base_url = base_url
+        self.api_key = api_key
+        self._client = None
+        self._client_failed = False
+        self._client_lock = threading.Lock()
+
+    @property
+    def available(self):
+        return self.client is not None
+
+    @property
+    def client(self):
+        """Shared OpenAI client with a pooled HTTP connection, created on first use"""
+        if self._client is None and not self._client_failed:
+            with self._client_lock:
+                if self._client is None and not self._client_failed:
+                    try:
+                        import httpx
+                        from openai import OpenAI
+                        self._client = OpenAI(
+                            api_key=self.api_key or _load_api_key(),
+                            base_url=self.base_url,
+                            timeout=OPENAI_TIMEOUT,
+                            max_retries=OPENAI_MAX_RETRIES,
+                            http_client=httpx.Client(
+                                limits=httpx.Limits(max_connections=OPENAI_MAX_CONNECTIONS,
+                                                    max_keepalive_connections=OPENAI_MAX_CONNECTIONS),
+                                timeout=OPENAI_TIMEOUT
+                            )
+                        )
+                    except Exception as e:
+                        logger.error(f"Could not initialize OpenAI client: {e}")
+                        self._client_failed = True
+        return self._client
+
+    def _open(self, messages, temperature):
+        stream = self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            response_format={"type": "json_object"},
+            temperature=temperature,
+            stream=True
+        )
+        return _OpenAIChunks(stream)
+
+
+class _OpenAIChunks:
+    def __init__(self, stream):
+        self._stream = stream
+
+    def __iter__(self):
+        for chunk in self._stream:
+            text = chunk.choices[0].delta.content if chunk.choices else None
+            if text:
+                yield text
+
+    def close(self):
+        self._stream.close()
+
+
+# Clues the fake gives, whatever the code words
+FAKE_CLUES = [
+    'ocean', 'engine', 'garden', 'winter', 'castle', 'signal', 'harvest', 'thunder', 'marble', 'compass',
+    'lantern', 'orbit', 'canyon', 'velvet', 'anchor', 'ember', 'meadow', 'circuit', 'glacier', 'parade'
+]
+# Characters per streamed chunk, about a token
+FAKE_CHUNK_SIZE = 4
+# Share of a request's delay spent before the first chunk
+FAKE_FIRST_TOKEN_SHARE = 0.5
+
+
+class FakeBackend(LLMBackend):
+    """In-process stand-in answering the game's prompts with configurable latency and failures
+
+    Each request sleeps a log-normal delay with median `latency` seconds and
+    shape `jitter`, half of it before the first chunk and the rest spread
+    over the chunks, and fails with BackendError with probability
+    `error_rate`. Answers depend only on the prompt and `seed`.
+    """
+    name = 'fake'
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, seed=0, model='fake', use_breaker=True):
+        super().__init__(model, use_breaker)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.seed = seed
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._kinds = {CLUE_PROMPT.system: 'clues', GUESS_PROMPT.system: 'guess', PLAN_PROMPT.system: 'plan'}
+
+    def _delay_and_outcome(self):
+        with self._lock:
+            delay = self.latency * math.exp(self._random.gauss(0, self.jitter)) if self.latency else 0.0
+            failed = self._random.random() < self.error_rate
+        return delay, failed
+
+    def _open(self, messages, temperature):
+        delay, failed = self._delay_and_outcome()
+        if failed:
+            time.sleep(delay * FAKE_FIRST_TOKEN_SHARE)
+            raise BackendError('Simulated backend failure')
+        return self._chunks(self.answer(messages), delay)
+
+    def _chunks(self, text, delay):
+        pieces = [text[i:i + FAKE_CHUNK_SIZE] for i in range(0, len(text), FAKE_CHUNK_SIZE)]
+        time.sleep(delay * FAKE_FIRST_TOKEN_SHARE)
+        gap = delay * (1 - FAKE_FIRST_TOKEN_SHARE) / max(len(pieces) - 1, 1)
+        for i, piece in enumerate(pieces):
+            if i and gap:
+                time.sleep(gap)
+            yield piece
+
+    def answer(self, messages):
+        """A well-formed JSON answer to the game's prompt in messages"""
+        user = messages[-1]['content']
+        rng = random.Random(zlib.crc32(f"{self.seed}\n{user}".encode()))
+        kind = self._kinds.get(messages[0]['content']) if len(messages) > 1 else None
+        if kind == 'clues':
+            return json.dumps({'clues': rng.sample(FAKE_CLUES, 3)})
+        if kind == 'guess':
+            return json.dumps({'guess': [rng.randint(1, 4) for _ in range(3)]})
+        if kind == 'plan':
+            teams = re.findall(r'^### Team (\S+)', user, re.MULTILINE)
+            return json.dumps({team: [rng.randint(1, 4) for _ in range(3)] for team in teams})
+        # Clue bank batch: clues for every listed word
+        words = re.search(r'^Words: (.+)$', user, re.MULTILINE)
+        per_word = re.search(r'give (\d+) different clues', user)
+        if words:
+            count = int(per_word.group(1)) if per_word else 3
+            return json.dumps({word.strip(): rng.sample(FAKE_CLUES, min(count, len(FAKE_CLUES)))
+                               for word in words.group(1).split(',')})
+        return '{}'
+
+
+def build_backend(url):
+    """Backend for an LLM_BACKEND setting: openai, http(s)://.../v1 or fake://?latency=...&error_rate=..."""
+    if not url or url == 'openai':
+        return OpenAIBackend()
+    if url.startswith(('http://', 'https://')):
+        # Local OpenAI-compatible servers don't check the key
+        return OpenAIBackend(base_url=url, api_key=os.environ.get('OPENAI_KEY', 'local'))
+    if url.startswith('fake:'):
+        options = {key: values[-1] for key, values in parse_qs(urlsplit(url).query).items()}
+        return FakeBackend(latency=float(options.get('latency', 0)), jitter=float(options.get('jitter', 0)),
+                           error_rate=float(options.get('error_rate', 0)), seed=int(options.get('seed', 0)))
+    raise ValueError(f"Unsupported LLM_BACKEND: {url}")
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """The backend configured by LLM_BACKEND, created on first use"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = build_backend(LLM_BACKEND)
+                logger.info(f"AI prompts go to the {_backend.name} backend ({_backend.model})")
+    return _backend
+
+
+def set_backend(backend):
+    """Replace the shared backend, e.g. with a FakeBackend for a load test"""
+    global _backend
+    _backend = backend
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """OpenAI-compatible /chat/completions answered by the server's FakeBackend"""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send_json(404, {'error': {'message': f"Unknown path {self.path}"}})
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        backend = self.server.backend
+        try:
+            chunks = backend.stream(request.get('messages', []), request.get('temperature', 1.0))
+        except BackendError as e:
+            self._send_json(500, {'error': {'message': str(e), 'type': 'server_error'}})
+            return
+
+        completion_id = f"chatcmpl-stub-{random.getrandbits(32):08x}"
+        created = int(time.time())
+        model = request.get('model', backend.model)
+        try:
+            if not request.get('stream'):
+                text = ''.join(chunks)
+                self._send_json(200, {
+                    'id': completion_id, 'object': 'chat.completion', 'created': created, 'model': model,
+                    'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': text}, 'finish_reason': 'stop'}]
+                })
+                return
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            self.close_connection = True
+
+            def event(delta, finish_reason=None):
+                chunk = {'id': completion_id, 'object': 'chat.completion.chunk', 'created': created, 'model': model,
+                         'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]}
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.wfile.flush()
+
+            event({'role': 'assistant', 'content': ''})
+            for text in chunks:
+                event({'content': text})
+            event({}, 'stop')
+            self.wfile.write(b"data: [DONE]\n\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # The client stopped reading early, as streamed answers do
+        finally:
+            chunks.close()
+
+
+def serve_stub(port, backend):
+    server = ThreadingHTTPServer(('127.0.0.1', port), StubHandler)
+    server.daemon_threads = True
+    server.backend = backend
+    logger.info(f"Stub LLM listening on http://127.0.0.1:{port}/v1 "
+                f"(latency {backend.latency}s, jitter {backend.jitter}, error rate {backend.error_rate})")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run an OpenAI-compatible stub LLM server for load testing')
+    parser.add_argument('command', choices=['serve'])
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', type=float, default=0.8, help='Median answer time in seconds')
+    parser.add_argument('--jitter', type=float, default=0.5, help='Log-normal shape of the answer time')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of requests that fail with HTTP 500')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    # The stub plays the failing provider, so it never short-circuits its own requests
+    serve_stub(args.port, FakeBackend(args.latency, args.jitter, args.error_rate, args.seed, use_breaker=False))
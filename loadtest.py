@@ -0,0 +1,431 @@
+"""Load test the server with rooms of simulated players following the UI's flow
+
+    python loadtest.py --rooms 20 --clients 4 --duration 60 --out report.json
+    python loadtest.py --rooms 20 --clients 4 --duration 60 --compare report.json
+
+Unless --url points at a running server, this starts one the way it is
+deployed (gunicorn, one eventlet worker) with the fake LLM backend, so runs
+are reproducible and spend no API quota.
+
+Each room's first client creates it, adds the AI team, deals both teams'
+words and starts the first round, and the other clients join. Every client
+then polls its room every --poll-interval seconds, as the UI does while its
+socket is down, and acts when it is its turn: each human team's first
+player gives the clues and submits the team's guess after --think seconds.
+A finished game is followed by a new room.
+
+The JSON report covers throughput and p50/p95/p99 latency per route, the
+server's event loop lag (see /api/metrics) and its memory over the run.
+--compare prints how a run moved against an earlier report and exits with
+status 1 when a route's p95 or the loop lag regressed by more than
+--tolerance.
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from collections import defaultdict
+import requests
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_LLM_BACKEND = 'fake://?latency=0.8&jitter=0.5&error_rate=0.02&seed=1'
+# Ignore latency changes smaller than this when comparing reports, however large in relative terms
+MIN_REGRESSION_MS = 5
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return sorted_values[min(int(q * len(sorted_values)), len(sorted_values) - 1)]
+
+
+class Recorder:
+    """Latency and status of every request, per route"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self._lock = threading.Lock()
+
+    def record(self, route, seconds, status):
+        with self._lock:
+            self.latencies[route].append(seconds)
+            self.statuses[route][status] += 1
+
+    def report(self, duration):
+        routes = {}
+        for route in sorted(self.latencies):
+            latencies = sorted(self.latencies[route])
+            statuses = dict(self.statuses[route])
+            routes[route] = {
+                'count': len(latencies),
+                'rps': round(len(latencies) / duration, 2),
+                'errors': sum(count for status, count in statuses.items() if status == 'error' or int(status) >= 500),
+                'statuses': {str(status): count for status, count in sorted(statuses.items(), key=str)},
+                **{f"p{round(q * 100)}_ms": round(percentile(latencies, q) * 1000, 2) for q in (0.5, 0.95, 0.99)},
+                'max_ms': round(latencies[-1] * 1000, 2)
+            }
+        return routes
+
+
+class Client:
+    """One simulated player with its own keep-alive connection"""
+
+    def __init__(self, base_url, recorder, name):
+        self.base_url = base_url
+        self.recorder = recorder
+        self.name = name
+        self.session = requests.Session()
+
+    def call(self, method, route, path, **kwargs):
+        """Send a request, recording it under route; returns the JSON body, or None on failure"""
+        started_at = time.perf_counter()
+        try:
+            response = self.session.request(method, self.base_url + path, timeout=30, **kwargs)
+        except requests.RequestException:
+            self.recorder.record(route, time.perf_counter() - started_at, 'error')
+            return None
+        self.recorder.record(route, time.perf_counter() - started_at, response.status_code)
+        return response.json() if response.ok else None
+
+
+class Room:
+    """A table of clients playing one game after another until the run stops"""
+
+    def __init__(self, index, base_url, recorder, stats, args, stop):
+        self.index = index
+        self.args = args
+        self.stop = stop
+        self.stats = stats
+        self.clients = [Client(base_url, recorder, f"p{index}-{i}") for i in range(args.clients)]
+        # Players join red, and blue too unless it's an AI team; with two AI teams they only watch
+        human_teams = ['red', 'blue'][:2 - args.ai_teams]
+        self.teams = [human_teams[i % len(human_teams)] if human_teams else 'spectator' for i in range(args.clients)]
+        self.ai_teams = ['blue', 'red'][:args.ai_teams]
+        self.barrier = threading.Barrier(args.clients)
+        self.room_code = None
+
+    def run(self):
+        threads = [threading.Thread(target=self._play, args=(i,), daemon=True) for i in range(len(self.clients))]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def _wait(self):
+        """Wait for the room's other clients; False once the run is stopping"""
+        while not self.stop.is_set():
+            try:
+                self.barrier.wait(timeout=1)
+                return True
+            except threading.BrokenBarrierError:
+                if self.stop.is_set():
+                    return False
+                self.barrier.reset()
+        return False
+
+    def _setup(self, client):
+        created = client.call('POST', 'POST /api/create_room', '/api/create_room')
+        self.room_code = created and created['room_code']
+        if not self.room_code:
+            return
+        for team_color in self.ai_teams:
+            client.call('POST', 'POST /api/room/<code>/add_ai', f"/api/room/{self.room_code}/add_ai/{team_color}")
+        for team_color in ('red', 'blue'):
+            client.call('POST', 'POST /api/room/<code>/generate_words',
+                        f"/api/room/{self.room_code}/generate_words/{team_color}")
+        self.stats['rooms_created'] += 1
+
+    def _play(self, i):
+        client, team = self.clients[i], self.teams[i]
+        leads = i == self.teams.index(team)  # The team's first player gives clues and guesses
+        rng = random.Random(f"{self.args.seed}-{self.index}-{i}")
+        # Stagger rooms over the ramp-up so they don't all poll in lockstep
+        if self.stop.wait(self.args.ramp * self.index / max(self.args.rooms, 1) + rng.random() * self.args.poll_interval):
+            return
+        while not self.stop.is_set():
+            if i == 0:
+                self._setup(client)
+            if not self._wait() or not self.room_code:
+                continue
+            room_code = self.room_code
+            if team != 'spectator':
+                joined = client.call('POST', 'POST /api/join_room', f"/api/join_room/{room_code}/{team}/{client.name}")
+                # The token from joining is what lets the player see their team's words
+                client.session.headers['X-Player-Token'] = joined['player_token'] if joined else ''
+            if not self._wait():
+                return
+            if i == 0:
+                client.call('POST', 'POST /api/room/<code>/start_round', f"/api/room/{room_code}/start_round")
+
+            acted = None  # (round, phase) last acted on, so a slow poll doesn't act twice
+            while not self.stop.wait(self.args.poll_interval):
+                state = client.call('GET', 'GET /api/room/<code>', f"/api/room/{room_code}")
+                if state is None:
+                    break
+                if state['phase'] == 'finished':
+                    if i == 0:
+                        self.stats['games_finished'] += 1
+                        self.stats['rounds_played'] += state['current_round']
+                    break
+                turn = (state['current_round'], state['phase'])
+                if not leads or team == 'spectator' or acted == turn:
+                    continue
+                if state['phase'] == 'clue_giving' and state['current_team'] == team:
+                    if self.stop.wait(self.args.think):
+                        return
+                    clues = [f"clue{rng.randrange(1000)}" for _ in range(3)]
+                    client.call('POST', 'POST /api/room/<code>/submit_clues', f"/api/room/{room_code}/submit_clues",
+                                json={'clues': clues})
+                    acted = turn
+                elif state['phase'] == 'guessing' and state['team_guesses'].get(team) is None:
+                    if self.stop.wait(self.args.think):
+                        return
+                    guess = [rng.randint(1, 4) for _ in range(3)]
+                    client.call('POST', 'POST /api/room/<code>/submit_guess', f"/api/room/{room_code}/submit_guess/{team}",
+                                json={'guess': guess})
+                    acted = turn
+            if not self._wait():
+                return
+
+
+def parse_prometheus(text):
+    """Sample name with labels -> value"""
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            name, _, value = line.rpartition(' ')
+            samples[name] = float(value)
+    return samples
+
+
+def histogram_summary(before, after, name):
+    """Count, mean and bucket-bound p50/p99/max of what a histogram observed between two scrapes"""
+    buckets = []
+    for key, value in after.items():
+        if key.startswith(f"{name}_bucket{{"):
+            bound = key.split('le="')[1].rstrip('"}')
+            buckets.append((float(bound), value - before.get(key, 0)))
+    buckets.sort()
+    count = after.get(f"{name}_count", 0) - before.get(f"{name}_count", 0)
+    if not count:
+        return {'count': 0}
+
+    def bound_at(q):
+        return next((bound for bound, cumulative in buckets if cumulative >= q * count), float('inf'))
+
+    return {
+        'count': int(count),
+        'mean_ms': round((after.get(f"{name}_sum", 0) - before.get(f"{name}_sum", 0)) / count * 1000, 2),
+        'p50_le_ms': bound_at(0.5) * 1000,
+        'p99_le_ms': bound_at(0.99) * 1000,
+        'max_le_ms': bound_at(1.0) * 1000
+    }
+
+
+class ServerSampler:
+    """Scrapes /api/metrics periodically for memory and live rooms, and keeps the first and last scrape"""
+
+    def __init__(self, base_url, interval):
+        self.client = Client(base_url, Recorder(), 'sampler')
+        self.interval = interval
+        self.samples = []
+        self.first = self.last = None
+        self._started_at = time.monotonic()
+
+    def scrape(self):
+        started_at = time.perf_counter()
+        try:
+            response = self.client.session.get(self.client.base_url + '/api/metrics', timeout=30)
+            scrape = parse_prometheus(response.text)
+        except (requests.RequestException, ValueError):
+            return None
+        self.samples.append({'t': round(time.monotonic() - self._started_at, 1),
+                             'rss_mb': round(scrape.get('process_resident_memory_bytes', 0) / 2 ** 20, 1),
+                             'rooms': int(scrape.get('rooms_live', 0)),
+                             'scrape_ms': round((time.perf_counter() - started_at) * 1000, 1)})
+        self.first = self.first or scrape
+        self.last = scrape
+        return scrape
+
+    def run(self, stop):
+        while not stop.wait(self.interval):
+            self.scrape()
+
+    def memory(self):
+        rss = [(sample['t'], sample['rss_mb']) for sample in self.samples if sample['rss_mb']]
+        if len(rss) < 2:
+            return {'samples': self.samples}
+        # Least-squares slope, so one late spike doesn't read as a leak
+        mean_t = sum(t for t, _ in rss) / len(rss)
+        mean_mb = sum(mb for _, mb in rss) / len(rss)
+        variance = sum((t - mean_t) ** 2 for t, _ in rss)
+        slope = sum((t - mean_t) * (mb - mean_mb) for t, mb in rss) / variance if variance else 0
+        return {
+            'start_mb': rss[0][1],
+            'end_mb': rss[-1][1],
+            'peak_mb': max(mb for _, mb in rss),
+            'growth_mb': round(rss[-1][1] - rss[0][1], 1),
+            'growth_mb_per_min': round(slope * 60, 2),
+            'samples': self.samples
+        }
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(args, log):
+    """The deployed server command on a free local port; returns (process, base URL)"""
+    port = free_port()
+    env = {**os.environ, 'LLM_BACKEND': args.llm_backend, 'PORT': str(port)}
+    command = [sys.executable, '-m', 'gunicorn', '--worker-class', 'eventlet', '-w', '1',
+               '--bind', f"127.0.0.1:{port}", 'server:app']
+    process = subprocess.Popen(command, cwd=HERE, env=env, stdout=log, stderr=subprocess.STDOUT)
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with status {process.returncode}, see {log.name}")
+        try:
+            if requests.get(base_url + '/api/health', timeout=1).ok:
+                return process, base_url
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"Server didn't become healthy within 60s, see {log.name}")
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    process = None
+    log = None
+    base_url = args.url
+    if not base_url:
+        log = open(args.server_log, 'w') if args.server_log else tempfile.NamedTemporaryFile('w', suffix='.log', delete=False)
+        process, base_url = start_server(args, log)
+    try:
+        recorder = Recorder()
+        stats = defaultdict(int)
+        stop = threading.Event()
+        sampler = ServerSampler(base_url, args.sample_interval)
+        sampler.scrape()
+        threads = [threading.Thread(target=sampler.run, args=(stop,), daemon=True)]
+
+        # A client probing the server at a steady rate sees stalls even between the players' polls
+        probe = Client(base_url, recorder, 'probe')
+
+        def run_probe():
+            while not stop.wait(args.probe_interval):
+                probe.call('GET', 'GET /api/health', '/api/health')
+        threads.append(threading.Thread(target=run_probe, daemon=True))
+
+        started_at = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for index in range(args.rooms):
+            threads += Room(index, base_url, recorder, stats, args, stop).run()
+        time.sleep(args.duration)
+        stop.set()
+        for thread in threads:
+            thread.join(timeout=35)
+        duration = time.monotonic() - started_at
+        final = sampler.scrape() or sampler.last
+
+        routes = recorder.report(duration)
+        total = sum(route['count'] for route in routes.values())
+        return {
+            'config': {'rooms': args.rooms, 'clients': args.clients, 'ai_teams': args.ai_teams,
+                       'duration': args.duration, 'poll_interval': args.poll_interval, 'think': args.think,
+                       'llm_backend': args.llm_backend if not args.url else None, 'url': args.url,
+                       'seed': args.seed},
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'duration_s': round(duration, 1),
+            'requests': total,
+            'throughput_rps': round(total / duration, 1),
+            'errors': sum(route['errors'] for route in routes.values()),
+            'routes': routes,
+            'event_loop_lag': histogram_summary(sampler.first or {}, final or {}, 'event_loop_lag_seconds'),
+            'memory': sampler.memory(),
+            'games': dict(stats)
+        }
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+            log.close()
+
+
+def compare(report, baseline, tolerance):
+    """Lines describing how report moved against baseline, and whether anything regressed"""
+    lines = [f"{'route':40} {'p95 before':>11} {'p95 after':>10} {'change':>8}"]
+    regressed = False
+
+    def check(label, before, after):
+        nonlocal regressed
+        if before is None or after is None:
+            return
+        change = (after - before) / before if before else 0
+        flag = ''
+        if after - before > MIN_REGRESSION_MS and change > tolerance:
+            regressed = True
+            flag = '  REGRESSED'
+        lines.append(f"{label:40} {before:>9.1f}ms {after:>8.1f}ms {change:>+7.0%}{flag}")
+
+    for route, stats in report['routes'].items():
+        check(route, baseline['routes'].get(route, {}).get('p95_ms'), stats['p95_ms'])
+    check('event loop lag (p99 bucket)', baseline['event_loop_lag'].get('p99_le_ms'),
+          report['event_loop_lag'].get('p99_le_ms'))
+    lines.append(f"throughput {baseline['throughput_rps']} -> {report['throughput_rps']} req/s, "
+                 f"memory growth {baseline['memory'].get('growth_mb')} -> {report['memory'].get('growth_mb')} MB")
+    return lines, regressed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='DecryptAI HTTP load test')
+    parser.add_argument('--rooms', type=int, default=20, help='Rooms played at once')
+    parser.add_argument('--clients', type=int, default=4, help='Players per room')
+    parser.add_argument('--ai-teams', type=int, choices=(0, 1, 2), default=1, help='AI teams per room')
+    parser.add_argument('--duration', type=float, default=60, help='Seconds to run after starting the rooms')
+    parser.add_argument('--ramp', type=float, default=5, help='Seconds over which rooms start')
+    parser.add_argument('--poll-interval', type=float, default=2, help='Seconds between a client\'s polls, as in the UI')
+    parser.add_argument('--think', type=float, default=1, help='Seconds a player takes before giving clues or guessing')
+    parser.add_argument('--probe-interval', type=float, default=0.25, help='Seconds between health probes')
+    parser.add_argument('--sample-interval', type=float, default=1, help='Seconds between server metrics scrapes')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--url', help='Load test a running server instead of starting one')
+    parser.add_argument('--llm-backend', default=DEFAULT_LLM_BACKEND, help='LLM_BACKEND for the started server')
+    parser.add_argument('--server-log', help='Where the started server logs (default: a temporary file)')
+    parser.add_argument('--out', help='Write the JSON report here as well as to stdout')
+    parser.add_argument('--compare', help='Earlier report to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Relative p95 increase that counts as a regression')
+    args = parser.parse_args()
+
+    report = run(args)
+    json.dump(report, sys.stdout, indent=2)
+    print()
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            lines, regressed = compare(report, json.load(f), args.tolerance)
+        print('\n'.join(lines), file=sys.stderr)
+        sys.exit(1 if regressed else 0)
@@ -0,0 +1,185 @@
+import bisect
+import threading
+
+# Latency buckets in seconds, from a cache hit up to a slow LLM call
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Size buckets in bytes, from an empty room up to a long game's full state
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _label_text(labels):
+    return ','.join(f'{key}="{value}"' for key, value in sorted(labels.items()))
+
+
+class Counter:
+    """Monotonically increasing count"""
+
+    def __init__(self, name, help_text='', labels=None):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels or {}
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self):
+        return self._value
+
+    def snapshot(self):
+        return self._value
+
+
+class Gauge:
+    """Value that can go up and down"""
+
+    def __init__(self, name, help_text='', labels=None):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels or {}
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self._value -= amount
+
+    def set(self, value):
+        self._value = value
+
+    @property
+    def value(self):
+        return self._value
+
+    def snapshot(self):
+        return self._value
+
+
+class Histogram:
+    """Bucketed distribution of observed values with approximate quantiles"""
+
+    def __init__(self, name, help_text='', buckets=DEFAULT_BUCKETS, labels=None):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels or {}
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self._counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._sum += value
+            self._count += 1
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def sum(self):
+        return self._sum
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile"""
+        if not self._count:
+            return 0.0
+        rank = q * self._count
+        seen = 0
+        for i, count in enumerate(self._counts):
+            seen += count
+            if seen >= rank:
+                return self.buckets[i] if i < len(self.buckets) else float('inf')
+        return float('inf')
+
+    def cumulative_counts(self):
+        """(upper bound, observations at or below it) per bucket, ending with +Inf"""
+        with self._lock:
+            counts = list(self._counts)
+        total = 0
+        cumulative = []
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            total += count
+            cumulative.append((bound, total))
+        return cumulative
+
+    def snapshot(self):
+        return {
+            'count': self._count,
+            'sum': round(self._sum, 6),
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99)
+        }
+
+
+REGISTRY = {}  # name, or name{labels} for labelled series -> metric
+_registry_lock = threading.Lock()
+
+
+def _get_or_create(cls, name, help_text, labels=None, **kwargs):
+    key = f"{name}{{{_label_text(labels)}}}" if labels else name
+    with _registry_lock:
+        metric = REGISTRY.get(key)
+        if metric is None:
+            metric = REGISTRY[key] = cls(name, help_text, labels=labels, **kwargs)
+        return metric
+
+
+def counter(name, help_text='', labels=None):
+    return _get_or_create(Counter, name, help_text, labels)
+
+
+def gauge(name, help_text='', labels=None):
+    return _get_or_create(Gauge, name, help_text, labels)
+
+
+def histogram(name, help_text='', buckets=DEFAULT_BUCKETS, labels=None):
+    return _get_or_create(Histogram, name, help_text, labels, buckets=buckets)
+
+
+def snapshot(prefix=''):
+    """Current value of every registered metric whose name starts with prefix"""
+    return {name: metric.snapshot() for name, metric in sorted(REGISTRY.items()) if name.startswith(prefix)}
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus():
+    """Every registered metric in the Prometheus text exposition format"""
+    with _registry_lock:
+        metrics = sorted(REGISTRY.values(), key=lambda metric: (metric.name, _label_text(metric.labels)))
+    lines = []
+    described = set()
+    for metric in metrics:
+        if metric.name not in described:
+            described.add(metric.name)
+            kind = {Counter: 'counter', Gauge: 'gauge', Histogram: 'histogram'}[type(metric)]
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {kind}")
+        labels = _label_text(metric.labels)
+        if isinstance(metric, Histogram):
+            for bound, count in metric.cumulative_counts():
+                bucket_labels = ','.join(filter(None, [labels, f'le="{_format_value(bound)}"']))
+                lines.append(f"{metric.name}_bucket{{{bucket_labels}}} {count}")
+            suffix = f"{{{labels}}}" if labels else ''
+            lines.append(f"{metric.name}_sum{suffix} {_format_value(round(metric.sum, 6))}")
+            lines.append(f"{metric.name}_count{suffix} {metric.count}")
+        else:
+            lines.append(f"{metric.name}{{{labels}}} {_format_value(metric.value)}" if labels
+                         else f"{metric.name} {_format_value(metric.value)}")
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,77 @@
+"""Incremental model of what a team's clues reveal about its code words
+
+Each team gets a ClueModel with, for each of its 4 word slots, every clue
+it has given for that slot and a belief over which word from the code word
+list sits there. Both are updated once per scored round, so guessers get a
+constant-size summary of the whole game instead of a transcript of its last
+few rounds.
+"""
+import os
+import numpy as np
+from embedding_guesser import embedding_guesser
+
+SLOTS = 4
+# Most recent clues per slot shown to guessers, and candidate words per slot
+SUMMARY_CLUES_PER_SLOT = int(os.environ.get('AI_SUMMARY_CLUES_PER_SLOT', 4))
+SUMMARY_CANDIDATES = 3
+LIKELY_WORD_MIN_PROBABILITY = 0.05
+# Softmax temperature turning accumulated clue similarity into word probabilities
+BELIEF_TEMPERATURE = 0.1
+
+
+class ClueModel:
+    """Clues given for each of one team's word slots, with a belief over each slot's word
+
+    The clues are persisted with the game. The belief is derived from them
+    with the embedding guesser's word vectors, so it is kept in memory only,
+    extended as rounds are scored and rebuilt from the clues after a load.
+    """
+    __slots__ = ('slot_clues', 'guesser', '_logits', '_candidates')
+
+    def __init__(self, slot_clues=None, guesser=embedding_guesser):
+        self.slot_clues = slot_clues if slot_clues is not None else [[] for _ in range(SLOTS)]
+        self.guesser = guesser
+        self._logits = None       # SLOTS x len(candidates) summed clue similarity
+        self._candidates = None
+
+    def update(self, code, clues, candidates=None):
+        """Record a scored round's clues, extending the belief over candidates if there is one"""
+        for position, clue in zip(code, clues):
+            self.slot_clues[position - 1].append(clue)
+        if self._logits is not None and candidates is self._candidates:
+            similarity = self.guesser.similarity(clues, candidates)
+            for row, position in enumerate(code):
+                self._logits[position - 1] += similarity[row]
+
+    def beliefs(self, candidates):
+        """Probability of each candidate word for each slot, or None without word vectors"""
+        if not candidates or not self.guesser or not self.guesser.available:
+            return None
+        if self._logits is None or candidates is not self._candidates:
+            self._candidates = candidates
+            self._logits = np.zeros((SLOTS, len(candidates)), dtype=np.float32)
+            for position, given in enumerate(self.slot_clues):
+                if given:
+                    self._logits[position] = self.guesser.similarity(given, candidates).sum(axis=0)
+        scaled = self._logits / BELIEF_TEMPERATURE
+        odds = np.exp(scaled - scaled.max(axis=1, keepdims=True))
+        return odds / odds.sum(axis=1, keepdims=True)
+
+    def summary(self, candidates=None):
+        """Per slot: the latest clues, how many there have been and, given candidates, the likeliest words"""
+        probabilities = self.beliefs(candidates)
+        slots = []
+        for position, given in enumerate(self.slot_clues):
+            slot = {'slot': position + 1, 'clues': given[-SUMMARY_CLUES_PER_SLOT:], 'clue_count': len(given)}
+            if probabilities is not None and given:
+                likely = {}
+                for i in np.argsort(probabilities[position])[::-1]:
+                    if len(likely) == SUMMARY_CANDIDATES or probabilities[position][i] < LIKELY_WORD_MIN_PROBABILITY:
+                        break
+                    likely.setdefault(candidates[i], round(float(probabilities[position][i]), 2))
+                slot['likely_words'] = [[word, p] for word, p in likely.items()]
+            slots.append(slot)
+        return slots
+
+    def to_list(self):
+        return self.slot_clues
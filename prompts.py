@@ -0,0 +1,184 @@
+"""Precompiled AI prompts with a static prefix and token budgets
+
+Each prompt is a system message that never changes, holding the rules,
+strategy and examples, followed by a short user message with the game
+details. Keeping every varying detail (personality included) out of the
+system message makes the prefix byte-identical across calls, which is what
+provider-side prompt caching keys on.
+
+Tokens are counted with tiktoken when it is installed and estimated from
+the text length otherwise.
+"""
+import os
+import time
+import string
+import structlog
+import metrics
+
+logger = structlog.getLogger()
+
+TOKENIZER_ENCODING = 'o200k_base'  # gpt-4o family
+# Rough characters per token for English prompts when tiktoken isn't available
+CHARS_PER_TOKEN = 4
+
+CLUE_PROMPT_BUDGET = int(os.environ.get('AI_CLUE_PROMPT_BUDGET', 700))
+GUESS_PROMPT_BUDGET = int(os.environ.get('AI_GUESS_PROMPT_BUDGET', 700))
+PLAN_PROMPT_BUDGET = int(os.environ.get('AI_PLAN_PROMPT_BUDGET', 900))
+
+prompt_tokens = metrics.counter('ai_prompt_tokens_total', 'Prompt tokens sent to the model')
+static_prompt_tokens = metrics.counter('ai_prompt_static_tokens_total', 'Prompt tokens in the cacheable static prefix')
+completion_tokens = metrics.counter('ai_completion_tokens_total', 'Completion tokens streamed back from the model')
+prompt_truncations = metrics.counter('ai_prompt_truncations_total', 'Prompts shortened to fit their token budget')
+prompt_build_seconds = metrics.histogram('ai_prompt_build_seconds', 'Time to render a prompt and count its tokens',
+                                         buckets=(0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01))
+
+_encoding = None
+_encoding_failed = False
+
+
+def count_tokens(text):
+    """Tokens in text for the default model, estimated when tiktoken is unavailable"""
+    global _encoding, _encoding_failed
+    if _encoding is None and not _encoding_failed:
+        try:
+            import tiktoken  # Optional, exact counts
+            _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+        except Exception as e:
+            logger.info(f"Estimating prompt tokens from length ({e})")
+            _encoding_failed = True
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+class Prompt:
+    """A rendered prompt ready to send, with its token count"""
+    __slots__ = ('template', 'messages', 'tokens', 'build_seconds')
+
+    def __init__(self, template, messages, tokens, build_seconds):
+        self.template = template
+        self.messages = messages
+        self.tokens = tokens
+        self.build_seconds = build_seconds
+
+    @property
+    def over_budget(self):
+        return self.tokens > self.template.budget
+
+    def report(self, completion_text, seconds):
+        """Record token usage and timing of the call made with this prompt"""
+        completion = count_tokens(completion_text)
+        prompt_tokens.inc(self.tokens)
+        static_prompt_tokens.inc(self.template.static_tokens)
+        completion_tokens.inc(completion)
+        logger.info(f"AI {self.template.name} call: {self.tokens} prompt tokens "
+                    f"({self.template.static_tokens} static), {completion} completion tokens, "
+                    f"built in {self.build_seconds * 1000:.2f}ms, answered in {seconds:.2f}s")
+
+
+class PromptTemplate:
+    """A static system prefix plus a user message template compiled once into literal and field parts"""
+
+    def __init__(self, name, system, user, budget):
+        self.name = name
+        self.system = system
+        self.budget = budget
+        self._parts = [(literal, field) for literal, field, _, _ in string.Formatter().parse(user)]
+        self._static_tokens = None
+
+    @property
+    def static_tokens(self):
+        if self._static_tokens is None:
+            self._static_tokens = count_tokens(self.system)
+        return self._static_tokens
+
+    def render(self, **fields):
+        started_at = time.perf_counter()
+        user = ''.join(literal + (str(fields[field]) if field is not None else '') for literal, field in self._parts)
+        tokens = self.static_tokens + count_tokens(user)
+        build_seconds = time.perf_counter() - started_at
+        prompt_build_seconds.observe(build_seconds)
+        return Prompt(self, [{"role": "system", "content": self.system}, {"role": "user", "content": user}],
+                      tokens, build_seconds)
+
+    def render_within_budget(self, variants):
+        """Render the first of variants (field dicts, fullest first, may be lazy) that fits the budget, else the last"""
+        for i, fields in enumerate(variants):
+            prompt = self.render(**fields)
+            if not prompt.over_budget:
+                if i:
+                    prompt_truncations.inc()
+                return prompt
+        prompt_truncations.inc()
+        logger.warning(f"AI {self.name} prompt is {prompt.tokens} tokens, over its {self.budget} budget")
+        return prompt
+
+
+CLUE_PROMPT = PromptTemplate('clues', """You are playing Decrypto as your team's encryptor. You need to give clues for a secret code.
+
+Your team has 4 numbered code words. The secret code is a sequence of 3 numbers from 1 to 4; give one clue for each number in the sequence, in order, pointing at the code word with that number.
+
+CRITICAL RULES:
+- Give exactly 3 clues, one for each position in the sequence
+- Clues MUST help your teammates identify the correct word numbers
+- Clues CANNOT contain any part of the actual code words or sound-alikes
+- Each clue should be 1-2 words maximum
+- Think about synonyms, categories, associations, or descriptions
+- Be specific enough for your team but vague enough that opponents struggle
+
+STRATEGY TIPS:
+- Use categories (e.g., "animal" for TIGER, "metal" for IRON)
+- Use synonyms (e.g., "large" for BIG, "fast" for QUICK)
+- Use associations (e.g., "fire" for RED, "ocean" for BLUE)
+- Use functions (e.g., "communication" for PHONE, "transportation" for CAR)
+- Avoid obvious rhymes or word parts
+
+Examples of GOOD clues:
+- For ELEPHANT: "Africa", "trunk", "gray"
+- For GUITAR: "strings", "music", "strum"
+- For THUNDER: "storm", "loud", "sky"
+
+Examples of BAD clues:
+- For ELEPHANT: "el-something", "phant", "large mammal with trunk" (too obvious/contains word parts)
+- For GUITAR: "instrument with 6 strings that you play" (too long and obvious)
+
+Respond with a JSON object holding exactly 3 clues:
+{"clues": ["clue1", "clue2", "clue3"]}""", """Play as a {personality}.
+
+Your team's 4 code words are:
+{code_words}
+
+Give clues for the sequence: {code_sequence}
+This means give a clue for word #{first}, then word #{second}, then word #{third}.""", CLUE_PROMPT_BUDGET)
+
+_GUESS_STRATEGY = """STRATEGY:
+- Analyze each clue and think what code word it might refer to
+- Consider the patterns from previous rounds
+- Each number in a guess should be 1, 2, 3, or 4
+- The same number can appear multiple times in a code"""
+
+GUESS_PROMPT = PromptTemplate('guess', f"""You are playing Decrypto. You need to guess a 3-digit code based on clues.
+
+Each clue points at one of 4 numbered code words. Guess which 3 code words (numbered 1-4) the clues refer to, in order.
+
+{_GUESS_STRATEGY}
+
+Think through each clue carefully and respond with a JSON object holding exactly 3 numbers:
+{{"guess": [number1, number2, number3]}}
+
+Example: {{"guess": [2, 1, 4]}}""", """Play as a {personality}.
+
+The clues given were: {clues}
+{context}""", GUESS_PROMPT_BUDGET)
+
+PLAN_PROMPT = PromptTemplate('plan', f"""You are playing Decrypto. You need to make a guess for each of several teams about the same 3-digit code.
+
+Each clue points at one of 4 numbered code words. For each team, guess which 3 code words (numbered 1-4) the clues refer to, in order, using only what that team knows.
+
+{_GUESS_STRATEGY}
+
+Respond with a JSON object mapping each team named below to its guess of exactly 3 numbers, for example:
+{{"red": [number1, number2, number3], "blue": [number1, number2, number3]}}""", """Play as a {personality}.
+
+The clues given were: {clues}
+{sections}""", PLAN_PROMPT_BUDGET)
@@ -0,0 +1,164 @@
+"""Room code allocation and eviction of idle, finished and excess rooms"""
+import os
+import time
+import string
+import random
+import hashlib
+import threading
+import structlog
+from contextlib import nullcontext
+import metrics
+
+logger = structlog.getLogger()
+
+ROOM_IDLE_TTL = float(os.environ.get('ROOM_IDLE_TTL', 2 * 3600))
+ROOM_FINISHED_TTL = float(os.environ.get('ROOM_FINISHED_TTL', 10 * 60))
+ROOM_MAX_ROOMS = int(os.environ.get('ROOM_MAX_ROOMS', 10000))
+ROOM_REAP_INTERVAL = float(os.environ.get('ROOM_REAP_INTERVAL', 60))
+# Rooms serialized to estimate bytes per room in stats()
+STATS_SAMPLE_SIZE = 100
+
+ROOM_CODE_ALPHABET = string.ascii_uppercase + string.digits
+ROOM_CODE_LENGTH = 6
+
+
+class RoomCodeAllocator:
+    """Collision-free, unguessable room codes in O(1)
+
+    Codes are a keyed pseudorandom permutation of a counter over all 36^6
+    codes: a 4-round Feistel network on 32-bit values, cycle-walking until
+    the result falls inside the code space. Distinct counters always give
+    distinct codes, so allocation never has to retry however full the table
+    gets, and without the key the next code can't be predicted from
+    previous ones.
+    """
+
+    SPACE = len(ROOM_CODE_ALPHABET) ** ROOM_CODE_LENGTH
+
+    def __init__(self, key=None, start=None):
+        self._key = key if key is not None else os.urandom(16)
+        self._round_keys = [hashlib.blake2b(self._key + bytes([i]), digest_size=4).digest() for i in range(4)]
+        self._counter = start if start is not None else random.randrange(self.SPACE)
+        self._lock = threading.Lock()
+
+    def _feistel(self, value):
+        left, right = value >> 16, value & 0xFFFF
+        for round_key in self._round_keys:
+            mixed = int.from_bytes(hashlib.blake2b(right.to_bytes(2, 'big'), digest_size=2, key=round_key).digest(), 'big')
+            left, right = right, left ^ mixed
+        return (left << 16) | right
+
+    def _permute(self, index):
+        value = self._feistel(index)
+        while value >= self.SPACE:
+            value = self._feistel(value)
+        return value
+
+    def allocate(self):
+        with self._lock:
+            index = self._counter
+            self._counter = (self._counter + 1) % self.SPACE
+        value = self._permute(index)
+        code = []
+        for _ in range(ROOM_CODE_LENGTH):
+            value, digit = divmod(value, len(ROOM_CODE_ALPHABET))
+            code.append(ROOM_CODE_ALPHABET[digit])
+        return ''.join(code)
+
+
+class RoomReaper:
+    """Removes finished and abandoned rooms and keeps the room count under a cap"""
+
+    def __init__(self, rooms, on_evict=None, room_locks=None, idle_ttl=ROOM_IDLE_TTL,
+                 finished_ttl=ROOM_FINISHED_TTL, max_rooms=ROOM_MAX_ROOMS, interval=ROOM_REAP_INTERVAL):
+        self.rooms = rooms
+        self.room_locks = room_locks
+        self.on_evict = on_evict
+        self.idle_ttl = idle_ttl
+        self.finished_ttl = finished_ttl
+        self.max_rooms = max_rooms
+        self.interval = interval
+        self.evictions = {
+            reason: metrics.counter(f'rooms_evicted_{reason}_total', f'Rooms evicted because they were {reason}')
+            for reason in ('idle', 'finished', 'lru')
+        }
+        self._started = False
+        self._lock = threading.Lock()
+
+    def _hold(self, room_code):
+        return self.room_locks.hold(room_code) if self.room_locks else nullcontext()
+
+    def _expired(self, game, now):
+        """Why a room should go: 'finished', 'idle' or None"""
+        idle = now - game.updated_at
+        if game.phase == 'finished' and idle > self.finished_ttl:
+            return 'finished'
+        if idle > self.idle_ttl:
+            return 'idle'
+        return None
+
+    def _evict(self, room_code, now):
+        """Delete a room under its lock if it is still expired once no writer holds it"""
+        with self._hold(room_code):
+            game = self.rooms.peek(room_code)
+            reason = self._expired(game, now) if game is not None else None
+            if reason is None:
+                return False
+            self.rooms.delete(room_code)
+        self.evictions[reason].inc()
+        logger.info(f"Evicted room {room_code} ({reason})")
+        if self.on_evict:
+            self.on_evict(room_code, reason)
+        return True
+
+    def reap(self, now=None):
+        """Evict rooms past their TTL; returns how many were removed"""
+        now = time.time() if now is None else now
+        evicted = 0
+        for room_code in self.rooms.room_codes():
+            game = self.rooms.peek(room_code)
+            # Checked again under the room lock, since a writer may touch the room meanwhile
+            if game is not None and self._expired(game, now) and self._evict(room_code, now):
+                evicted += 1
+        return evicted
+
+    def make_room(self):
+        """Evict least recently used rooms until another one fits under the cap"""
+        while len(self.rooms) >= self.max_rooms:
+            room_code = self.rooms.evict_lru()
+            if room_code is None:
+                break
+            self.evictions['lru'].inc()
+            logger.info(f"Evicted room {room_code} (lru)")
+            if self.on_evict:
+                self.on_evict(room_code, 'lru')
+
+    def run_forever(self, sleep=time.sleep):
+        while True:
+            sleep(self.interval)
+            try:
+                self.reap()
+            except Exception as e:
+                logger.error(f"Error reaping rooms: {e}")
+
+    def start(self, start_background_task):
+        """Start the reaper loop once, using the server's background task runner"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        start_background_task(self.run_forever)
+
+    def stats(self):
+        room_codes = self.rooms.room_codes()
+        sample = [game for game in map(self.rooms.peek, random.sample(room_codes, min(len(room_codes), STATS_SAMPLE_SIZE)))
+                  if game is not None]
+        return {
+            'live_rooms': len(room_codes),
+            'finished_rooms_sampled': sum(game.phase == 'finished' for game in sample),
+            'bytes_per_room': round(sum(len(game.to_state()) for game in sample) / len(sample)) if sample else 0,
+            'max_rooms': self.max_rooms,
+            'idle_ttl': self.idle_ttl,
+            'finished_ttl': self.finished_ttl,
+            'evictions': {reason: counter.value for reason, counter in self.evictions.items()}
+        }
@@ -0,0 +1,409 @@
+"""Pluggable storage for game rooms
+
+The default MemoryRoomStore keeps live DecryptoGame objects in a dict, as the
+server always has. SQLiteRoomStore and RedisRoomStore keep each room as a
+compact serialized game so several gunicorn workers (or nodes) can share
+rooms; writes use optimistic concurrency on the game's state version.
+FakeRoomStore behaves like an external store without needing a server.
+"""
+import os
+import time
+import sqlite3
+import itertools
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+import structlog
+import metrics
+from game import DecryptoGame
+
+logger = structlog.getLogger()
+
+# How often stores without change notifications re-check a room during long polls
+POLL_INTERVAL = 0.25
+
+# In-memory rooms are never serialized on writes, so only one write in this many measures their size
+ROOM_STATE_BYTES_SAMPLE = int(os.environ.get('ROOM_STATE_BYTES_SAMPLE', 64))
+
+state_bytes = metrics.histogram('room_state_bytes', 'Size of serialized rooms written to the store '
+                                '(a sample of writes for in-memory rooms)', buckets=metrics.BYTES_BUCKETS)
+_memory_writes = itertools.count()
+
+
+def serialize(game):
+    """game.to_state(), recording its size"""
+    state = game.to_state()
+    state_bytes.observe(len(state))
+    return state
+
+
+def _sample_state_bytes(game):
+    """Record the serialized size of an in-memory room on a sample of its writes"""
+    if next(_memory_writes) % ROOM_STATE_BYTES_SAMPLE == 0:
+        state_bytes.observe(len(game.to_state()))
+
+
+class VersionConflict(Exception):
+    """The room was changed by someone else since it was loaded"""
+
+
+class RoomLocks:
+    """Per-room locks serializing every mutation of a room within this process
+
+    Records how long writers wait and how often they find the lock taken, per
+    room, so hot rooms show up under load.
+    """
+
+    def __init__(self):
+        self._locks = {}
+        self._contention = {}  # room_code -> times a writer had to wait
+        self._lock = threading.Lock()
+        self.wait_time = metrics.histogram('room_lock_wait_seconds', 'Time spent waiting for a room lock')
+        self.hold_time = metrics.histogram('room_lock_hold_seconds', 'Time a room lock was held')
+        self.contended = metrics.counter('room_lock_contended_total', 'Room lock acquisitions that had to wait')
+
+    @contextmanager
+    def hold(self, room_code):
+        with self._lock:
+            lock = self._locks.get(room_code)
+            if lock is None:
+                lock = self._locks[room_code] = threading.RLock()
+        started_at = time.monotonic()
+        if not lock.acquire(blocking=False):
+            self.contended.inc()
+            with self._lock:
+                self._contention[room_code] = self._contention.get(room_code, 0) + 1
+            lock.acquire()
+        acquired_at = time.monotonic()
+        self.wait_time.observe(acquired_at - started_at)
+        try:
+            yield
+        finally:
+            self.hold_time.observe(time.monotonic() - acquired_at)
+            lock.release()
+
+    def discard(self, room_code):
+        with self._lock:
+            self._locks.pop(room_code, None)
+            self._contention.pop(room_code, None)
+
+    def hot_rooms(self, limit=10):
+        """Rooms whose writers waited most often"""
+        with self._lock:
+            ranked = sorted(self._contention.items(), key=lambda item: item[1], reverse=True)
+        return dict(ranked[:limit])
+
+
+class RoomStore:
+    """Interface shared by all room stores"""
+
+    def get(self, room_code):
+        """Load a room, or None if it doesn't exist"""
+        raise NotImplementedError
+
+    def peek(self, room_code):
+        """Load a room without counting it as a use"""
+        return self.get(room_code)
+
+    def get_many(self, room_codes):
+        """Load several rooms at once: a dict of room code to game, without the missing ones"""
+        games = {}
+        for room_code in room_codes:
+            game = self.get(room_code)
+            if game is not None:
+                games[room_code] = game
+        return games
+
+    def add(self, game):
+        """Insert a new room; returns False if the code is already taken"""
+        raise NotImplementedError
+
+    def save(self, game, expected_version):
+        """Persist a room, raising VersionConflict if the stored version isn't expected_version"""
+        raise NotImplementedError
+
+    def delete(self, room_code):
+        raise NotImplementedError
+
+    def room_codes(self):
+        raise NotImplementedError
+
+    def evict_lru(self):
+        """Delete the least recently updated room; returns its code"""
+        games = [game for game in map(self.peek, self.room_codes()) if game is not None]
+        if not games:
+            return None
+        oldest = min(games, key=lambda game: game.updated_at)
+        self.delete(oldest.room_code)
+        return oldest.room_code
+
+    def __contains__(self, room_code):
+        return self.get(room_code) is not None
+
+    def __getitem__(self, room_code):
+        game = self.get(room_code)
+        if game is None:
+            raise KeyError(room_code)
+        return game
+
+    def __len__(self):
+        return len(self.room_codes())
+
+    def wait_for_change(self, room_code, since, timeout):
+        """Block until the room's version moves past `since`; returns the latest game"""
+        deadline = time.monotonic() + timeout
+        game = self.get(room_code)
+        while game is not None and game.version <= since and time.monotonic() < deadline:
+            time.sleep(min(POLL_INTERVAL, max(deadline - time.monotonic(), 0)))
+            game = self.get(room_code)
+        return game
+
+
+class MemoryRoomStore(RoomStore):
+    """Live game objects in a process-local dict, kept in least-recently-used order"""
+
+    def __init__(self):
+        self._rooms = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, room_code):
+        with self._lock:
+            game = self._rooms.get(room_code)
+            if game is not None:
+                self._rooms.move_to_end(room_code)
+            return game
+
+    def peek(self, room_code):
+        with self._lock:
+            return self._rooms.get(room_code)
+
+    def get_many(self, room_codes):
+        games = {}
+        with self._lock:
+            for room_code in room_codes:
+                game = self._rooms.get(room_code)
+                if game is not None:
+                    self._rooms.move_to_end(room_code)
+                    games[room_code] = game
+        return games
+
+    def add(self, game):
+        with self._lock:
+            if game.room_code in self._rooms:
+                return False
+            self._rooms[game.room_code] = game
+        _sample_state_bytes(game)
+        return True
+
+    def save(self, game, expected_version):
+        # Games are mutated in place, so there is nothing to write back
+        if self.peek(game.room_code) is not game:
+            raise VersionConflict(game.room_code)
+        _sample_state_bytes(game)
+
+    def delete(self, room_code):
+        with self._lock:
+            self._rooms.pop(room_code, None)
+
+    def room_codes(self):
+        with self._lock:
+            return list(self._rooms)
+
+    def evict_lru(self):
+        with self._lock:
+            if not self._rooms:
+                return None
+            return self._rooms.popitem(last=False)[0]
+
+    def __contains__(self, room_code):
+        with self._lock:
+            return room_code in self._rooms
+
+    def __len__(self):
+        with self._lock:
+            return len(self._rooms)
+
+    def wait_for_change(self, room_code, since, timeout):
+        game = self.get(room_code)
+        if game is not None:
+            game.wait_for_change(since, timeout)
+        return game
+
+
+class FakeRoomStore(RoomStore):
+    """Serialized rooms in a local dict, mimicking an external store for tests
+
+    Every get() returns a fresh copy, so code that relies on mutating a
+    shared object instead of saving it shows up as lost updates.
+    """
+
+    def __init__(self):
+        self._rooms = {}  # room_code -> (version, state)
+        self._lock = threading.Lock()
+
+    def get(self, room_code):
+        entry = self._rooms.get(room_code)
+        return DecryptoGame.from_state(entry[1]) if entry else None
+
+    def add(self, game):
+        with self._lock:
+            if game.room_code in self._rooms:
+                return False
+            self._rooms[game.room_code] = (game.version, serialize(game))
+            return True
+
+    def save(self, game, expected_version):
+        with self._lock:
+            entry = self._rooms.get(game.room_code)
+            if entry is None or entry[0] != expected_version:
+                raise VersionConflict(game.room_code)
+            self._rooms[game.room_code] = (game.version, serialize(game))
+
+    def delete(self, room_code):
+        with self._lock:
+            self._rooms.pop(room_code, None)
+
+    def room_codes(self):
+        return list(self._rooms)
+
+    def __contains__(self, room_code):
+        return room_code in self._rooms
+
+
+class SQLiteRoomStore(RoomStore):
+    """Rooms in a SQLite file shared by every worker on one host"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._conn().execute(
+            'CREATE TABLE IF NOT EXISTS rooms (room_code TEXT PRIMARY KEY, version INTEGER NOT NULL, state TEXT NOT NULL)'
+        )
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, isolation_level=None, timeout=10)
+            conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def get(self, room_code):
+        row = self._conn().execute('SELECT state FROM rooms WHERE room_code = ?', (room_code,)).fetchone()
+        return DecryptoGame.from_state(row[0]) if row else None
+
+    def get_many(self, room_codes):
+        room_codes = list(room_codes)
+        games = {}
+        # SQLite caps the number of query parameters
+        for start in range(0, len(room_codes), 500):
+            chunk = room_codes[start:start + 500]
+            rows = self._conn().execute(f"SELECT room_code, state FROM rooms WHERE room_code IN ({','.join('?' * len(chunk))})",
+                                        chunk)
+            games.update((room_code, DecryptoGame.from_state(state)) for room_code, state in rows)
+        return games
+
+    def add(self, game):
+        try:
+            self._conn().execute('INSERT INTO rooms (room_code, version, state) VALUES (?, ?, ?)',
+                                 (game.room_code, game.version, serialize(game)))
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+    def save(self, game, expected_version):
+        cursor = self._conn().execute(
+            'UPDATE rooms SET version = ?, state = ? WHERE room_code = ? AND version = ?',
+            (game.version, serialize(game), game.room_code, expected_version)
+        )
+        if cursor.rowcount != 1:
+            raise VersionConflict(game.room_code)
+
+    def delete(self, room_code):
+        self._conn().execute('DELETE FROM rooms WHERE room_code = ?', (room_code,))
+
+    def room_codes(self):
+        return [row[0] for row in self._conn().execute('SELECT room_code FROM rooms')]
+
+    def __contains__(self, room_code):
+        return self._conn().execute('SELECT 1 FROM rooms WHERE room_code = ?', (room_code,)).fetchone() is not None
+
+    def __len__(self):
+        return self._conn().execute('SELECT COUNT(*) FROM rooms').fetchone()[0]
+
+
+# Compare-and-set: write the room only if its stored version is still ARGV[1]
+_REDIS_SAVE_SCRIPT = """
+local current = redis.call('HGET', KEYS[1], 'version')
+if current ~= ARGV[1] then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'version', ARGV[2], 'state', ARGV[3])
+return 1
+"""
+
+# Create the room only if no room has its key, writing version and state together
+_REDIS_ADD_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'version', ARGV[1], 'state', ARGV[2])
+return 1
+"""
+
+
+class RedisRoomStore(RoomStore):
+    """Rooms in Redis (or any Redis-compatible server), shared across nodes"""
+
+    def __init__(self, url, prefix='decryptai:room:'):
+        import redis  # Optional dependency, only needed for this backend
+
+        self.prefix = prefix
+        self._redis = redis.Redis.from_url(url)
+        self._save_script = self._redis.register_script(_REDIS_SAVE_SCRIPT)
+        self._add_script = self._redis.register_script(_REDIS_ADD_SCRIPT)
+
+    def _key(self, room_code):
+        return self.prefix + room_code
+
+    def get(self, room_code):
+        state = self._redis.hget(self._key(room_code), 'state')
+        return DecryptoGame.from_state(state) if state else None
+
+    def get_many(self, room_codes):
+        room_codes = list(room_codes)
+        pipeline = self._redis.pipeline(transaction=False)
+        for room_code in room_codes:
+            pipeline.hget(self._key(room_code), 'state')
+        return {room_code: DecryptoGame.from_state(state)
+                for room_code, state in zip(room_codes, pipeline.execute()) if state}
+
+    def add(self, game):
+        return bool(self._add_script(keys=[self._key(game.room_code)], args=[game.version, serialize(game)]))
+
+    def save(self, game, expected_version):
+        saved = self._save_script(keys=[self._key(game.room_code)],
+                                  args=[expected_version, game.version, serialize(game)])
+        if not saved:
+            raise VersionConflict(game.room_code)
+
+    def delete(self, room_code):
+        self._redis.delete(self._key(room_code))
+
+    def room_codes(self):
+        return [key.decode()[len(self.prefix):] for key in self._redis.scan_iter(match=self.prefix + '*')]
+
+    def __contains__(self, room_code):
+        return bool(self._redis.exists(self._key(room_code)))
+
+
+def build_room_store(url):
+    """Room store for a ROOM_STORE setting: memory, fake, sqlite:///path or redis://..."""
+    if not url or url == 'memory':
+        return MemoryRoomStore()
+    if url == 'fake':
+        return FakeRoomStore()
+    if url.startswith('sqlite:///'):
+        return SQLiteRoomStore(url[len('sqlite:///'):])
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisRoomStore(url)
+    raise ValueError(f"Unsupported ROOM_STORE: {url}")
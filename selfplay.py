@@ -0,0 +1,224 @@
+"""Headless self-play runner and throughput benchmark for DecryptoGame
+
+Plays complete AI-vs-AI games in-process with a deterministic local stand-in
+for DecryptoAI (no network), spread across a process pool:
+
+    python selfplay.py --games 2000 --workers 4 --seed 1
+
+Reports games/sec, rounds/sec, p50/p99 latency per phase transition and the
+memory retained per game, for comparing changes to the game engine.
+"""
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import tracemalloc
+from collections import deque, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import structlog
+
+# Game logs every move at info level, which would dominate the benchmark
+structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(logging.WARNING))
+
+import game as game_engine
+from game import DecryptoGame, TEAM_COLORS
+
+# Games longer than this are abandoned so a bad change can't hang the run
+MAX_ROUNDS = 200
+
+
+class StubAI:
+    """Deterministic stand-in for DecryptoAI
+
+    Clues encode the target word so guessers that know the words decode them
+    with a fixed accuracy; guessers without the words guess at random.
+    """
+
+    def __init__(self, team_color, rng, own_accuracy=0.85, intercept_accuracy=0.35):
+        self.team_color = team_color
+        self.rng = rng
+        self.own_accuracy = own_accuracy
+        self.intercept_accuracy = intercept_accuracy
+
+    def generate_clues(self, code_words, code_sequence, on_progress=None, used_clues=()):
+        return [f"{code_words[pos - 1][::-1].lower()}-{self.rng.randrange(1000)}" for pos in code_sequence]
+
+    def guess_code(self, clues, opponent_code_words=None, slot_summary=None, own_team=False, on_progress=None):
+        accuracy = self.own_accuracy if own_team else self.intercept_accuracy
+        guess = []
+        for clue in clues:
+            target = clue.split('-')[0][::-1].upper()
+            if opponent_code_words and target in opponent_code_words and self.rng.random() < accuracy:
+                guess.append(opponent_code_words.index(target) + 1)
+            else:
+                guess.append(self.rng.randint(1, 4))
+        return guess
+
+    def plan_guesses(self, clues, guessers, on_progress=None):
+        return {
+            team_color: self.guess_code(clues, guesser['code_words'], guesser['slot_summary'], guesser['own_team'])
+            for team_color, guesser in guessers.items()
+        }
+
+
+class InlineScheduler:
+    """Runs AI tasks on the calling thread, one at a time, in submission order"""
+
+    def __init__(self):
+        self._tasks = deque()
+
+    def submit(self, room_code, task, on_result, fallback, is_current=lambda: True, timeout=None):
+        self._tasks.append((task, on_result, fallback, is_current))
+        return True
+
+    def cancel(self, room_code):
+        self._tasks.clear()
+
+    def run_until_idle(self):
+        while self._tasks:
+            task, on_result, fallback, is_current = self._tasks.popleft()
+            if not is_current():
+                continue
+            try:
+                result = task()
+            except Exception:
+                result = fallback()
+            if is_current():
+                on_result(result)
+
+
+class TransitionTimer:
+    """Change listener recording the time between consecutive state events"""
+
+    def __init__(self):
+        self.samples = defaultdict(list)  # 'from->to' -> seconds
+        self._last = {}  # room_code -> (event, timestamp)
+
+    def __call__(self, room_code, payload):
+        now = time.perf_counter()
+        last = self._last.get(room_code)
+        if last is not None:
+            self.samples[f"{last[0]}->{payload['event']}"].append(now - last[1])
+        self._last[room_code] = (payload['event'], now)
+
+
+def new_game(room_code, rng):
+    game = DecryptoGame(room_code)
+    game.ai_class = lambda team_color: StubAI(team_color, rng)
+    game.scheduler = InlineScheduler()
+    game.clue_bank = None
+    game.prewarmer = None
+    for team_color in TEAM_COLORS:
+        game.add_ai_players(team_color, 2)
+        game.generate_code_words(team_color)
+    return game
+
+
+def play_game(room_code, seed):
+    """Play one game to completion; returns the finished game"""
+    random.seed(seed)
+    game = new_game(room_code, random.Random(seed))
+    game.start_round()
+    while game.phase != 'finished' and game.current_round <= MAX_ROUNDS:
+        before = game.version
+        game.scheduler.run_until_idle()
+        if game.version == before:
+            break
+    return game
+
+
+def play_batch(seeds):
+    """Worker entry point: play one game per seed and return raw timings"""
+    timer = TransitionTimer()
+    game_engine.change_listeners[:] = [timer]
+    game_seconds = []
+    rounds = 0
+    unfinished = 0
+    for seed in seeds:
+        started_at = time.perf_counter()
+        game = play_game(f"SP{seed}", seed)
+        game_seconds.append(time.perf_counter() - started_at)
+        rounds += len(game.round_history)
+        unfinished += game.phase != 'finished'
+    return {'game_seconds': game_seconds, 'rounds': rounds, 'unfinished': unfinished, 'transitions': dict(timer.samples)}
+
+
+def measure_memory(seed, samples):
+    """Average bytes retained by a finished game, measured with tracemalloc"""
+    game_engine.change_listeners[:] = []
+    sizes = []
+    for i in range(samples):
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        game = play_game(f"MEM{i}", seed + i)
+        retained = tracemalloc.get_traced_memory()[0] - baseline
+        tracemalloc.stop()
+        sizes.append(retained)
+        del game
+    return sum(sizes) / len(sizes) if sizes else 0
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def run(games, workers, seed, words_path, memory_samples=5):
+    seeds = [seed + i for i in range(games)]
+    chunks = [seeds[i::workers] for i in range(workers)]
+    started_at = time.perf_counter()
+    if workers == 1:
+        results = [play_batch(seeds)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=game_engine.load_code_words,
+                                 initargs=(words_path,)) as pool:
+            results = list(pool.map(play_batch, chunks))
+    elapsed = time.perf_counter() - started_at
+
+    rounds = sum(r['rounds'] for r in results)
+    game_seconds = [s for r in results for s in r['game_seconds']]
+    transitions = defaultdict(list)
+    for r in results:
+        for name, samples in r['transitions'].items():
+            transitions[name].extend(samples)
+
+    return {
+        'games': games,
+        'workers': workers,
+        'seed': seed,
+        'seconds': round(elapsed, 3),
+        'games_per_sec': round(games / elapsed, 1),
+        'rounds_per_sec': round(rounds / elapsed, 1),
+        'rounds_per_game': round(rounds / games, 2) if games else 0,
+        'unfinished_games': sum(r['unfinished'] for r in results),
+        'game_ms': {'p50': round(percentile(game_seconds, 0.5) * 1000, 3),
+                    'p99': round(percentile(game_seconds, 0.99) * 1000, 3)},
+        'transition_us': {
+            name: {'count': len(samples),
+                   'p50': round(percentile(samples, 0.5) * 1e6, 1),
+                   'p99': round(percentile(samples, 0.99) * 1e6, 1)}
+            for name, samples in sorted(transitions.items())
+        },
+        'bytes_per_game': round(measure_memory(seed, memory_samples)) if memory_samples else None
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Headless DecryptoGame self-play benchmark')
+    parser.add_argument('--games', type=int, default=1000, help='Games to play')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Worker processes')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the first game')
+    parser.add_argument('--memory-samples', type=int, default=5, help='Games to measure with tracemalloc')
+    parser.add_argument('--words', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'code_words.txt'),
+                        help='Code word list')
+    args = parser.parse_args()
+
+    game_engine.load_code_words(args.words)
+    report = run(args.games, max(1, args.workers), args.seed, args.words, args.memory_samples)
+    json.dump(report, sys.stdout, indent=2)
+    print()
@@ -1,305 +1,441 @@
 import os
-import random
-import string
-import json
+import hmac
+import time
+import hashlib
+import secrets
 import threading
+import json
 import functools
 import structlog
-from flask import Flask, request, jsonify, send_from_directory
-from flask_socketio import SocketIO
+from flask import Flask, Response, g, request, jsonify, send_from_directory
+from flask.json.provider import DefaultJSONProvider
+from flask_socketio import SocketIO, emit, join_room as join_socket_room, leave_room as leave_socket_room
 from flask_cors import CORS
-from flasgger import Swagger
-from ai_player import DecryptoAI
+from ai_scheduler import ai_scheduler
+from ai_prewarm import prewarmer
+from clue_bank import clue_bank
+from llm_backend import get_backend
+import game as game_engine
+from game import DecryptoGame, TEAM_COLORS, VIEWERS, dumps, load_code_words, project_delta
+from room_store import RoomLocks, VersionConflict, build_room_store
+import metrics
+import tracing
+from room_lifecycle import RoomCodeAllocator, RoomReaper
+from event_log import EVENT_LOG_DIR, EventLog
 
 logger = structlog.getLogger()
 
-# Paths for deployment
-prefix = '/root/decryptai/'
-if not os.path.exists(prefix):
-    prefix = '/Users/jong/Documents/decryptai/'
-if not os.path.exists(prefix):
-    prefix = '/app/'
+# Directory holding code_words.txt, themed word lists (word_lists/*.txt) and the built UI (ui/build), the checkout by default
+DATA_DIR = os.environ.get('DECRYPTAI_DATA_DIR', os.path.dirname(os.path.abspath(__file__)))
+UI_BUILD_DIR = os.path.join(DATA_DIR, 'ui', 'build')
+# Paths served by the Swagger UI, which is only built when first requested
+API_DOCS_PATHS = ('/apidocs', '/apispec', '/flasgger_static')
+
+class CompactJSONProvider(DefaultJSONProvider):
+    """jsonify() through the game's fast encoder, falling back for types it can't encode"""
+
+    def dumps(self, obj, **kwargs):
+        try:
+            return dumps(obj)
+        except TypeError:
+            return super().dumps(obj, **kwargs)
 
-app = Flask(__name__, static_folder=prefix+'ui/build')
+app = Flask(__name__, static_folder=UI_BUILD_DIR)
+app.json = CompactJSONProvider(app)
 CORS(app, supports_credentials=True)
-app.config['SECRET_KEY'] = 'decrypto_secret'
-socketio = SocketIO(app, cors_allowed_origins="*")
-swagger = Swagger(app)
+# Signs player tokens; set it so tokens survive restarts and every worker accepts them
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY') or secrets.token_hex(32)
+# A shared message queue (e.g. redis://) lets every worker emit to every client
+socketio = SocketIO(app, cors_allowed_origins="*", message_queue=os.environ.get('SOCKETIO_MESSAGE_QUEUE'))
 
 # Load code words
-code_words = []
-try:
-    with open(prefix + 'code_words.txt', 'r') as f:
-        code_words = [word.strip().upper() for word in f.readlines() if word.strip()]
-    logger.info(f"Loaded {len(code_words)} code words")
-except FileNotFoundError:
-    logger.error("code_words.txt not found")
-    code_words = ['OCEAN', 'GUITAR', 'THUNDER', 'CASTLE']  # Fallback
-
-# Game state storage
-rooms = {}
-
-# Game constants
-TEAM_COLORS = ['red', 'blue']
-GAME_PHASES = ['setup', 'clue_giving', 'guessing', 'scoring', 'finished']
-CODE_WORDS_PER_TEAM = 4
-CODES_TO_WIN = 8
-INTERCEPTIONS_TO_LOSE = 2
-
-class DecryptoGame:
-    def __init__(self, room_code):
-        self.room_code = room_code
-        self.teams = {
-            'red': {
-                'players': [],
-                'code_words': [],
-                'successful_codes': 0,
-                'interception_tokens': 0,
-                'ai_players': []
-            },
-            'blue': {
-                'players': [],
-                'code_words': [],
-                'successful_codes': 0,
-                'interception_tokens': 0,
-                'ai_players': []
-            }
-        }
-        self.current_round = 1
-        self.current_team = 'red'  # Which team is giving clues
-        self.phase = 'setup'
-        self.current_code = None  # 3-digit code like [4, 2, 1]
-        self.current_clues = []   # Clues for current code
-        self.team_guesses = {}    # Guesses from both teams
-        self.round_history = []   # History of all rounds
-        self.winner = None
-
-    def to_dict(self):
-        """Convert game state to dictionary for API responses"""
-        return {
-            'room_code': self.room_code,
-            'teams': self.teams,
-            'current_round': self.current_round,
-            'current_team': self.current_team,
-            'phase': self.phase,
-            'current_code': self.current_code if self.phase in ['clue_giving', 'guessing'] else None,
-            'current_clues': self.current_clues,
-            'team_guesses': self.team_guesses,
-            'winner': self.winner,
-            'round_history': self.round_history
-        }
-
-    def add_player(self, player_name, team_color):
-        """Add a player to a team"""
-        if team_color in self.teams:
-            if player_name not in self.teams[team_color]['players']:
-                self.teams[team_color]['players'].append(player_name)
-                return True
-        return False
-
-    def add_ai_players(self, team_color, count=2):
-        """Add AI players to a team"""
-        if team_color in self.teams:
-            ai_names = [f"AI {i+1}" for i in range(count)]
-            self.teams[team_color]['ai_players'].extend(ai_names)
-            return True
-        return False
-
-    def generate_code_words(self, team_color):
-        """Generate 4 random code words for a team"""
-        if team_color in self.teams and len(code_words) >= CODE_WORDS_PER_TEAM:
-            selected_words = random.sample(code_words, CODE_WORDS_PER_TEAM)
-            self.teams[team_color]['code_words'] = selected_words
-            logger.info(f"Generated code words for team {team_color}: {selected_words}")
-            return selected_words
-        return []
-
-    def set_code_words(self, team_color, words):
-        """Set the 4 code words for a team"""
-        if team_color in self.teams and len(words) == CODE_WORDS_PER_TEAM:
-            self.teams[team_color]['code_words'] = words
-            return True
-        return False
-
-    def generate_code(self):
-        """Generate a random 3-digit code"""
-        return random.choices(range(1, CODE_WORDS_PER_TEAM + 1), k=3)
-
-    def start_round(self):
-        """Start a new round"""
-        if self.phase == 'setup' and self.all_teams_ready():
-            self.current_code = self.generate_code()
-            self.current_clues = []
-            self.team_guesses = {}
-            self.phase = 'clue_giving'
-            logger.info(f"Round {self.current_round} started for team {self.current_team}, code: {self.current_code}")
-            
-            # If current team is AI, generate clues automatically
-            if self.teams[self.current_team].get('ai_players'):
-                threading.Thread(target=self._ai_generate_clues).start()
-                
-            return True
-        return False
-
-    def _ai_generate_clues(self):
-        """Have AI team generate clues for their code"""
-        try:
-            ai = DecryptoAI(self.current_team)
-            clues = ai.generate_clues(self.teams[self.current_team]['code_words'], self.current_code)
-            self.submit_clues(clues)
-            logger.info(f"AI team {self.current_team} generated clues: {clues}")
-        except Exception as e:
-            logger.error(f"Error in AI clue generation: {e}")
-            # Fallback simple clues
-            fallback_clues = [f"word{i}" for i in self.current_code]
-            self.submit_clues(fallback_clues)
-
-    def all_teams_ready(self):
-        """Check if both teams have code words set"""
-        for team in self.teams.values():
-            if len(team['code_words']) != CODE_WORDS_PER_TEAM:
-                return False
-        return True
-
-    def submit_clues(self, clues):
-        """Submit clues for the current code"""
-        if self.phase == 'clue_giving' and len(clues) == 3:
-            self.current_clues = clues
-            self.phase = 'guessing'
-            logger.info(f"Clues submitted: {clues}")
-            
-            # Trigger AI guessing for opposing team
-            other_team = 'blue' if self.current_team == 'red' else 'red'
-            if self.teams[other_team].get('ai_players'):
-                threading.Thread(target=self._ai_guess_code, args=(other_team,)).start()
-                
-            return True
-        return False
-
-    def _ai_guess_code(self, team_color):
-        """Have AI team make a guess"""
-        try:
-            ai = DecryptoAI(team_color)
-            
-            # Get opponent's code words if any have been revealed through play
-            opponent_team = 'red' if team_color == 'blue' else 'blue'
-            opponent_words = self.teams[opponent_team]['code_words'] if len(self.round_history) > 2 else None
-            
-            guess = ai.guess_code(self.current_clues, opponent_words, self.round_history)
-            self.submit_guess(team_color, guess)
-            logger.info(f"AI team {team_color} guessed: {guess}")
-        except Exception as e:
-            logger.error(f"Error in AI guess: {e}")
-            # Fallback random guess
-            fallback_guess = random.choices(range(1, 5), k=3)
-            self.submit_guess(team_color, fallback_guess)
-
-    def submit_guess(self, team_color, guess):
-        """Submit a guess from a team"""
-        if self.phase == 'guessing' and len(guess) == 3:
-            self.team_guesses[team_color] = guess
-            logger.info(f"Team {team_color} guessed: {guess}")
-            
-            # Check if both teams have guessed
-            if len(self.team_guesses) == 2:
-                self.evaluate_round()
-            return True
-        return False
-
-    def evaluate_round(self):
-        """Evaluate the round and update scores"""
-        self.phase = 'scoring'
-        
-        current_team_guess = self.team_guesses.get(self.current_team, [])
-        other_team = 'blue' if self.current_team == 'red' else 'red'
-        other_team_guess = self.team_guesses.get(other_team, [])
-        
-        # Check if current team guessed correctly
-        if current_team_guess == self.current_code:
-            self.teams[self.current_team]['successful_codes'] += 1
-            logger.info(f"Team {self.current_team} successfully communicated!")
-        
-        # Check if other team intercepted
-        if other_team_guess == self.current_code:
-            self.teams[other_team]['interception_tokens'] += 1
-            logger.info(f"Team {other_team} intercepted the code!")
-        
-        # Add to history
-        self.round_history.append({
-            'round': self.current_round,
-            'team': self.current_team,
-            'code': self.current_code,
-            'clues': self.current_clues.copy(),
-            'guesses': self.team_guesses.copy()
-        })
-        
-        # Check win conditions
-        if self.check_win_conditions():
-            self.phase = 'finished'
+code_words = load_code_words(os.path.join(DATA_DIR, 'code_words.txt'), os.path.join(DATA_DIR, 'word_lists'))
+
+# Fill the AI clue bank for the word list without blocking startup
+if os.environ.get('CLUE_BANK_BUILD'):
+    clue_bank.build_in_background(code_words)
+
+# Game state storage: memory (default), fake, sqlite:///path or redis://...
+rooms = build_room_store(os.environ.get('ROOM_STORE', 'memory'))
+
+LONG_POLL_MAX_TIMEOUT = 25  # Seconds a ?since= poll may block
+EVENT_LOOP_LAG_INTERVAL = float(os.environ.get('EVENT_LOOP_LAG_INTERVAL', 0.25))  # 0 turns the lag probe off
+ROOM_BATCH_MAX = int(os.environ.get('ROOM_BATCH_MAX', 500))  # Rooms one bulk request may create or read
+ROOM_SAVE_RETRIES = 5
+
+room_locks = RoomLocks()
+_updating = threading.local()
+
+live_rooms = metrics.gauge('rooms_live', 'Rooms in the room store')
+save_retries = metrics.counter('room_save_retries_total', 'Room updates retried after a concurrent write')
+resident_memory = metrics.gauge('process_resident_memory_bytes', 'Resident memory of this server process')
+event_loop_lag = metrics.histogram('event_loop_lag_seconds',
+                                   'How late a timed sleep on the server loop woke; blocking calls under eventlet show up here',
+                                   buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+_watching_event_loop = False
+
+def watch_event_loop(interval=EVENT_LOOP_LAG_INTERVAL):
+    """Measure how much later than asked each sleep of the server's loop returns"""
+    while True:
+        started_at = time.monotonic()
+        socketio.sleep(interval)
+        event_loop_lag.observe(max(time.monotonic() - started_at - interval, 0))
+
+def resident_bytes():
+    """Current resident set size, where /proc is available"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return 0
+
+@app.before_request
+def start_request():
+    global _watching_event_loop
+    if not _watching_event_loop and EVENT_LOOP_LAG_INTERVAL > 0:
+        _watching_event_loop = True
+        socketio.start_background_task(watch_event_loop)
+    g.request_started_at = time.perf_counter()
+    g.request_span = tracing.start_span('http_request', activate=True, method=request.method, path=request.path)
+
+@app.after_request
+def record_request(response):
+    """Per-route latency, status and response size"""
+    route = request.endpoint or 'unmatched'
+    metrics.histogram('http_request_seconds', 'Time to handle a request', labels={'route': route}).observe(
+        time.perf_counter() - g.request_started_at)
+    metrics.counter('http_requests_total', 'Requests handled', labels={'route': route, 'status': response.status_code}).inc()
+    if response.content_length is not None:
+        metrics.histogram('http_response_bytes', 'Size of response bodies', buckets=metrics.BYTES_BUCKETS,
+                          labels={'route': route}).observe(response.content_length)
+    span = g.get('request_span')
+    if span is not None:
+        span.set(route=route, status=response.status_code)
+        response.headers['X-Trace-Id'] = span.trace_id
+    return response
+
+@app.teardown_request
+def end_request(error=None):
+    tracing.end_span(g.pop('request_span', None), error)
+
+def update_room(room_code, mutate):
+    """Apply mutate(game) to a room and save it, retrying on concurrent updates
+
+    Writers in this process take the room's lock, so a human request and an
+    AI result can't interleave; other workers are caught by the version
+    check on save. State deltas and queued AI work are released only after
+    the write succeeds and the lock is dropped, so subscribers never see a
+    change that lost an optimistic-concurrency race. The event log gets the
+    changes just before the lock is dropped, so it logs them in version order.
+    Returns (game, result of mutate), or (None, None) if the room is gone.
+    """
+    in_progress = getattr(_updating, 'games', None)
+    if in_progress is None:
+        in_progress = _updating.games = {}
+    if room_code in in_progress:
+        # Nested update of a room this thread is already updating
+        game = in_progress[room_code]
+        return game, mutate(game)
+
+    with room_locks.hold(room_code):
+        for attempt in range(ROOM_SAVE_RETRIES):
+            game = rooms.get(room_code)
+            if game is None:
+                return None, None
+            expected_version = game.version
+            in_progress[room_code] = game
+            try:
+                with game_engine.collect_changes() as batch:
+                    result = mutate(game)
+                    if game.version != expected_version:
+                        rooms.save(game, expected_version)
+                break
+            except VersionConflict:
+                save_retries.inc()
+                logger.warning(f"Room {room_code} changed concurrently, retrying update (attempt {attempt + 1})")
+            finally:
+                del in_progress[room_code]
         else:
-            self.next_round()
-
-    def check_win_conditions(self):
-        """Check if game should end"""
-        for team_color, team in self.teams.items():
-            # Win by successful communication
-            if team['successful_codes'] >= CODES_TO_WIN:
-                self.winner = team_color
-                logger.info(f"Team {team_color} wins by successful communication!")
-                return True
-            
-            # Lose by too many interceptions
-            if team['interception_tokens'] >= INTERCEPTIONS_TO_LOSE:
-                other_team = 'blue' if team_color == 'red' else 'red'
-                self.winner = other_team
-                logger.info(f"Team {other_team} wins by intercepting team {team_color}!")
-                return True
-        
-        return False
-
-    def next_round(self):
-        """Advance to next round"""
-        # Switch teams
-        self.current_team = 'blue' if self.current_team == 'red' else 'red'
-        self.current_round += 1
-        self.phase = 'clue_giving'
-        
-        # Generate new code
-        self.current_code = self.generate_code()
-        self.current_clues = []
-        self.team_guesses = {}
-        
-        logger.info(f"Round {self.current_round} - Team {self.current_team}'s turn")
-        
-        # If new current team is AI, generate clues automatically
-        if self.teams[self.current_team].get('ai_players'):
-            threading.Thread(target=self._ai_generate_clues).start()
+            raise VersionConflict(room_code)
+        # Log the changes before another writer can make newer ones
+        batch.record()
+    batch.flush()
+    return game, result
+
+def run_room_command(room_code, mutate):
+    """update_room for client requests; an X-Command-Id header makes retries apply once"""
+    command_id = request.headers.get('X-Command-Id')
+    if not command_id:
+        return update_room(room_code, mutate)
+    return update_room(room_code, lambda game: game.run_command(command_id, mutate))
+
+# AI results are applied through the store too, and AI tasks check the stored room to see if it moved on
+game_engine.room_mutator = lambda game, mutate: update_room(game.room_code, mutate)[1]
+game_engine.room_reader = lambda game: rooms.peek(game.room_code)
 
 # Serve React App
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
 def serve(path):
-    if path != "" and os.path.exists(prefix+"ui/build/" + path):
-        return send_from_directory(prefix+'ui/build', path)
+    if path != "" and os.path.exists(os.path.join(UI_BUILD_DIR, path)):
+        return send_from_directory(UI_BUILD_DIR, path)
     else:
-        return send_from_directory(prefix+'ui/build', 'index.html')
+        return send_from_directory(UI_BUILD_DIR, 'index.html')
+
+def player_token(room_code, team_color):
+    """Token proving its holder joined team_color in room_code, which join_room hands out"""
+    message = f"{room_code}/{team_color}".encode()
+    return f"{team_color}.{hmac.new(app.config['SECRET_KEY'].encode(), message, hashlib.sha256).hexdigest()[:32]}"
+
+def token_viewer(room_code, token):
+    """The team whose view of room_code a player token grants, else a spectator's"""
+    team_color = (token or '').partition('.')[0]
+    if team_color in TEAM_COLORS and hmac.compare_digest(token, player_token(room_code, team_color)):
+        return team_color
+    return 'spectator'
+
+def request_token():
+    return request.headers.get('X-Player-Token') or request.args.get('token')
+
+def request_viewer(room_code):
+    """Whose view of a room a request gets: the team of its player token, or a spectator's without a valid one
+
+    ?team= alone no longer reveals a team's words, since anyone can send it.
+    """
+    return token_viewer(room_code, request_token())
+
+def viewer_room(room_code, viewer):
+    """Socket room receiving the deltas projected for one viewer"""
+    return f"{room_code}/{viewer}"
+
+def state_response(game, viewer=None, **fields):
+    """JSON response of fields plus the requester's view of the game, reusing its cached serialization"""
+    state = game.to_json(viewer or request_viewer(game.room_code))
+    return Response(f"{dumps(fields)[:-1]},\"game_state\":{state}}}", status=200, mimetype='application/json')
+
+def broadcast_delta(room_code, payload):
+    """Push a versioned state delta to every client subscribed to the room, projected per viewer"""
+    try:
+        for viewer in VIEWERS:
+            socketio.emit('state_delta', project_delta(payload, viewer), to=viewer_room(room_code, viewer))
+    except Exception as e:
+        logger.error(f"Error broadcasting delta for room {room_code}: {e}")
+
+game_engine.change_listeners.append(broadcast_delta)
+
+def broadcast_progress(room_code, payload):
+    """Push partial AI clues to the whole room, and partial guesses only to the guessing team"""
+    to = room_code if payload['kind'] == 'clues' else viewer_room(room_code, payload['team'])
+    try:
+        socketio.emit('ai_progress', payload, to=to)
+    except Exception as e:
+        logger.error(f"Error broadcasting AI progress for room {room_code}: {e}")
+
+game_engine.progress_listeners.append(broadcast_progress)
+
+@socketio.on('subscribe')
+def on_subscribe(data):
+    """Subscribe a socket to a room's state deltas and send it a full snapshot
+
+    Deltas and the snapshot are projected for the team of data['token'],
+    the player token from join_room, or for a spectator without one.
+    """
+    room_code = (data or {}).get('room_code')
+    viewer = token_viewer(room_code, (data or {}).get('token'))
+    game = rooms.get(room_code) if room_code else None
+    if game is None:
+        emit('error', {'error': 'Room not found'})
+        return
+    join_socket_room(room_code)
+    join_socket_room(viewer_room(room_code, viewer))
+    emit('state', game.to_dict(viewer))
+
+@socketio.on('unsubscribe')
+def on_unsubscribe(data):
+    """Stop receiving state deltas for a room"""
+    room_code = (data or {}).get('room_code')
+    if room_code:
+        leave_socket_room(room_code)
+        for viewer in VIEWERS:
+            leave_socket_room(viewer_room(room_code, viewer))
+
+room_code_allocator = RoomCodeAllocator()
 
 def generate_room_code():
-    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
+    return room_code_allocator.allocate()
+
+def close_room(room_code, reason):
+    """Drop a room's pending AI work and tell its subscribers it is gone"""
+    ai_scheduler.cancel(room_code)
+    if prewarmer:
+        prewarmer.discard(room_code)
+    room_locks.discard(room_code)
+    socketio.emit('room_closed', {'room_code': room_code, 'reason': reason}, to=room_code)
+    if event_log:
+        event_log.drop(room_code)
+
+room_reaper = RoomReaper(rooms, on_evict=close_room, room_locks=room_locks)
+
+def snapshot_games():
+    """Every room, each read while holding its lock"""
+    for room_code in rooms.room_codes():
+        with room_locks.hold(room_code):
+            yield rooms.peek(room_code)
+
+# Log every room change so a restarted server picks up where it left off
+event_log = EventLog(EVENT_LOG_DIR) if EVENT_LOG_DIR else None
+if event_log:
+    game_engine.ordered_change_listeners.append(event_log.append)
+    restored = [game.room_code for game in event_log.recover().values() if rooms.add(game)]
+    for room_code in restored:
+        update_room(room_code, lambda game: game.resume_ai())
+    if restored:
+        room_reaper.start(lambda run: socketio.start_background_task(run, sleep=socketio.sleep))
+    socketio.start_background_task(event_log.run_snapshots, snapshot_games, sleep=socketio.sleep)
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
-    """Health check endpoint"""
-    return jsonify({'status': 'healthy', 'game': 'decrypto'}), 200
+    """Health check endpoint; degraded while the LLM circuit breaker keeps AI moves on local fallbacks"""
+    backend = get_backend()
+    circuit = backend.breaker.stats() if backend.breaker else None
+    status = 'healthy' if not circuit or circuit['state'] == 'closed' else 'degraded'
+    return jsonify({
+        'status': status,
+        'game': 'decrypto',
+        'ai': {'backend': backend.name, 'model': backend.model, 'circuit': circuit}
+    }), 200
 
 @app.route('/api/create_room', methods=['POST'])
 def create_room():
     """Create a new game room"""
+    room_reaper.start(lambda run: socketio.start_background_task(run, sleep=socketio.sleep))
+    room_reaper.make_room()
     room_code = generate_room_code()
-    rooms[room_code] = DecryptoGame(room_code)
+    while not rooms.add(DecryptoGame(room_code)):
+        room_code = generate_room_code()
     logger.info(f"Created room {room_code}")
     return jsonify({'room_code': room_code, 'status': 'created'}), 200
 
+def configure_room(game, spec):
+    """Set up a new game from a batch room spec; returns an error message, or None"""
+    teams = spec.get('teams') or {}
+    if not isinstance(teams, dict):
+        return 'Invalid teams'
+    if set(teams) - set(TEAM_COLORS):
+        return 'Invalid team color'
+    if not isinstance(spec.get('theme'), (str, type(None))):
+        return 'Invalid theme'
+    for team_color in TEAM_COLORS:
+        team = teams.get(team_color) or {}
+        if not isinstance(team, dict):
+            return f"Invalid spec for team {team_color}"
+        players = team.get('players') or []
+        if not isinstance(players, list) or not all(isinstance(player_name, str) for player_name in players):
+            return f"Players of team {team_color} must be a list of names"
+        if not isinstance(team.get('theme'), (str, type(None))):
+            return f"Invalid theme for team {team_color}"
+        for player_name in players:
+            if not game.add_player(player_name, team_color):
+                return f"Could not add player {player_name!r} to team {team_color}"
+        if team.get('ai') and not game.add_ai_players(team_color, 2):
+            return f"Could not add AI players to team {team_color}"
+        if team.get('words') is not None:
+            if not game.set_code_words(team_color, team['words']):
+                return f"Invalid words for team {team_color}"
+        elif not game.generate_code_words(team_color, team.get('theme', spec.get('theme'))):
+            return f"Could not generate words for team {team_color}"
+    if spec.get('start_round') and not game.start_round():
+        return 'Cannot start round'
+    return None
+
+@app.route('/api/rooms/batch', methods=['POST'])
+def create_rooms():
+    """Create and set up many rooms in one request, e.g. for a tournament
+
+    The body is either {"rooms": [spec, ...]} or {"count": n, "room": spec},
+    where a spec looks like
+    {"teams": {"red": {"players": ["Ann"], "words": [...]}, "blue": {"ai": true}}, "start_round": true}.
+    Teams without "words" get generated ones, from the word list named by
+    the team's or the room's "theme" if set. Every room is set up before
+    any is stored, so an invalid spec creates nothing. Each room is stored
+    with one write, and its deltas and AI work are released once it is.
+    Returns a short summary per room instead of full game states, with
+    player tokens for the teams given players.
+    """
+    data = request.get_json(silent=True) or {}
+    specs = data.get('rooms')
+    if specs is None:
+        count = data.get('count', 1)
+        if not isinstance(count, int) or isinstance(count, bool) or count < 1:
+            return jsonify({'error': 'Invalid count'}), 400
+        if count > ROOM_BATCH_MAX:
+            return jsonify({'error': f"At most {ROOM_BATCH_MAX} rooms per batch"}), 400
+        specs = [data.get('room') or {}] * count
+    if not isinstance(specs, list) or not specs:
+        return jsonify({'error': 'Invalid room specs'}), 400
+    if len(specs) > ROOM_BATCH_MAX:
+        return jsonify({'error': f"At most {ROOM_BATCH_MAX} rooms per batch"}), 400
+    if not all(isinstance(spec, dict) for spec in specs):
+        return jsonify({'error': 'Invalid room specs'}), 400
+
+    built = []
+    for index, spec in enumerate(specs):
+        game = DecryptoGame(generate_room_code())
+        with game_engine.collect_changes() as batch:
+            error = configure_room(game, spec)
+        if error:
+            return jsonify({'error': error, 'index': index}), 400
+        built.append((spec, game, batch))
+
+    room_reaper.start(lambda run: socketio.start_background_task(run, sleep=socketio.sleep))
+    created = []
+    for spec, game, batch in built:
+        room_reaper.make_room()
+        while not rooms.add(game):
+            # Taken since the code was allocated; the collected changes name the old code
+            game = DecryptoGame(generate_room_code())
+            with game_engine.collect_changes() as batch:
+                configure_room(game, spec)
+        batch.flush()
+        summary = {'room_code': game.room_code, 'version': game.version, 'phase': game.phase,
+                   'current_round': game.current_round, 'current_team': game.current_team}
+        # Tokens for the named players to see their team's words, as join_room would give them
+        tokens = {team_color: player_token(game.room_code, team_color)
+                  for team_color, team in (spec.get('teams') or {}).items() if team and team.get('players')}
+        if tokens:
+            summary['player_tokens'] = tokens
+        created.append(summary)
+    logger.info(f"Created {len(created)} rooms in a batch")
+    return jsonify({'rooms': created, 'status': 'created'}), 200
+
+@app.route('/api/rooms', methods=['GET'])
+def get_rooms():
+    """Current state of many rooms, for ?codes=ABC123,DEF456
+
+    Each room is seen as a spectator, or as the team of whichever player
+    token in ?tokens= (comma-separated) was issued for it. Rooms are loaded
+    from the store together and each state comes from its cached
+    serialization. Codes of rooms that don't exist are listed under
+    "missing".
+    """
+    room_codes = list(dict.fromkeys(code for code in request.args.get('codes', '').split(',') if code))
+    tokens = [token for token in request.args.get('tokens', '').split(',') if token]
+    if len(room_codes) > ROOM_BATCH_MAX or len(tokens) > ROOM_BATCH_MAX:
+        return jsonify({'error': f"At most {ROOM_BATCH_MAX} rooms per request"}), 400
+    # A token names its team, so each room only needs checking against the tokens for that team
+    by_team = {team_color: [token for token in tokens if token.startswith(f"{team_color}.")] for team_color in TEAM_COLORS}
+
+    def viewer(room_code):
+        for team_color, team_tokens in by_team.items():
+            if team_tokens and player_token(room_code, team_color) in team_tokens:
+                return team_color
+        return 'spectator'
+
+    games = rooms.get_many(room_codes)
+    states = ','.join(f"{dumps(room_code)}:{game.to_json(viewer(room_code))}" for room_code, game in games.items())
+    missing = [room_code for room_code in room_codes if room_code not in games]
+    return Response(f"{{\"rooms\":{{{states}}},\"missing\":{dumps(missing)}}}", mimetype='application/json')
+
 @app.route('/api/join_room/<room_code>/<team_color>/<player_name>', methods=['POST'])
 def join_room(room_code, team_color, player_name):
     """Join a game room as a specific team"""
@@ -309,21 +445,45 @@ def join_room(room_code, team_color, player_name):
     if team_color not in TEAM_COLORS:
         return jsonify({'error': 'Invalid team color'}), 400
     
-    game = rooms[room_code]
-    if game.add_player(player_name, team_color):
+    game, joined = run_room_command(room_code, lambda game: game.add_player(player_name, team_color))
+    if joined:
         logger.info(f"Player {player_name} joined team {team_color} in room {room_code}")
-        return jsonify({'status': 'joined', 'game_state': game.to_dict()}), 200
+        return state_response(game, viewer=team_color, status='joined', player_token=player_token(room_code, team_color))
     else:
         return jsonify({'error': 'Could not join team'}), 400
 
 @app.route('/api/room/<room_code>', methods=['GET'])
 def get_room(room_code):
-    """Get current state of a room"""
+    """Get current state of a room
+
+    Returns the view of the team whose player token (from join_room) is
+    sent in X-Player-Token or ?token=, or a spectator's, so clients only
+    receive what they may see. Honors If-None-Match
+    with a 304 when the state version is unchanged.
+    With ?since=<version> the request long-polls until the version moves
+    past it or ?timeout= seconds (capped at LONG_POLL_MAX_TIMEOUT) elapse.
+    """
     if room_code not in rooms:
         return jsonify({'error': 'Room not found'}), 404
     
-    game = rooms[room_code]
-    return jsonify(game.to_dict()), 200
+    since = request.args.get('since', type=int)
+    if since is not None:
+        timeout = min(request.args.get('timeout', LONG_POLL_MAX_TIMEOUT, type=float), LONG_POLL_MAX_TIMEOUT)
+        game = rooms.wait_for_change(room_code, since, max(timeout, 0))
+    else:
+        game = rooms.get(room_code)
+    if game is None:
+        return jsonify({'error': 'Room not found'}), 404
+
+    viewer = request_viewer(room_code)
+    etag = game.etag(viewer)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(game.to_json(viewer), mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 @app.route('/api/room/<room_code>/set_words/<team_color>', methods=['POST'])
 def set_code_words(room_code, team_color):
@@ -337,10 +497,10 @@ def set_code_words(room_code, team_color):
     data = request.get_json()
     words = data.get('words', [])
     
-    game = rooms[room_code]
-    if game.set_code_words(team_color, words):
+    game, words_set = run_room_command(room_code, lambda game: game.set_code_words(team_color, words))
+    if words_set:
         logger.info(f"Set code words for team {team_color} in room {room_code}")
-        return jsonify({'status': 'words_set', 'game_state': game.to_dict()}), 200
+        return state_response(game, status='words_set')
     else:
         return jsonify({'error': 'Invalid words'}), 400
 
@@ -350,9 +510,9 @@ def start_round(room_code):
     if room_code not in rooms:
         return jsonify({'error': 'Room not found'}), 404
     
-    game = rooms[room_code]
-    if game.start_round():
-        return jsonify({'status': 'round_started', 'game_state': game.to_dict()}), 200
+    game, started = run_room_command(room_code, lambda game: game.start_round())
+    if started:
+        return state_response(game, status='round_started')
     else:
         return jsonify({'error': 'Cannot start round'}), 400
 
@@ -365,9 +525,9 @@ def submit_clues(room_code):
     data = request.get_json()
     clues = data.get('clues', [])
     
-    game = rooms[room_code]
-    if game.submit_clues(clues):
-        return jsonify({'status': 'clues_submitted', 'game_state': game.to_dict()}), 200
+    game, submitted = run_room_command(room_code, lambda game: game.submit_clues(clues))
+    if submitted:
+        return state_response(game, status='clues_submitted')
     else:
         return jsonify({'error': 'Invalid clues'}), 400
 
@@ -383,9 +543,9 @@ def submit_guess(room_code, team_color):
     data = request.get_json()
     guess = data.get('guess', [])
     
-    game = rooms[room_code]
-    if game.submit_guess(team_color, guess):
-        return jsonify({'status': 'guess_submitted', 'game_state': game.to_dict()}), 200
+    game, submitted = run_room_command(room_code, lambda game: game.submit_guess(team_color, guess))
+    if submitted:
+        return state_response(game, status='guess_submitted')
     else:
         return jsonify({'error': 'Invalid guess'}), 400
 
@@ -398,26 +558,26 @@ def add_ai_team(room_code, team_color):
     if team_color not in TEAM_COLORS:
         return jsonify({'error': 'Invalid team color'}), 400
     
-    game = rooms[room_code]
-    if game.add_ai_players(team_color, 2):
+    game, added = run_room_command(room_code, lambda game: game.add_ai_players(team_color, 2))
+    if added:
         logger.info(f"Added AI players to team {team_color} in room {room_code}")
-        return jsonify({'status': 'ai_added', 'game_state': game.to_dict()}), 200
+        return state_response(game, status='ai_added')
     else:
         return jsonify({'error': 'Could not add AI players'}), 400
 
 @app.route('/api/room/<room_code>/generate_words/<team_color>', methods=['POST'])
 def generate_words(room_code, team_color):
-    """Generate random code words for a team"""
+    """Generate random code words for a team, from the themed word list ?theme= if given"""
     if room_code not in rooms:
         return jsonify({'error': 'Room not found'}), 404
     
     if team_color not in TEAM_COLORS:
         return jsonify({'error': 'Invalid team color'}), 400
     
-    game = rooms[room_code]
-    words = game.generate_code_words(team_color)
+    theme = request.args.get('theme')
+    game, words = run_room_command(room_code, lambda game: game.generate_code_words(team_color, theme))
     if words:
-        return jsonify({'status': 'words_generated', 'words': words, 'game_state': game.to_dict()}), 200
+        return state_response(game, status='words_generated', words=words)
     else:
         return jsonify({'error': 'Could not generate words'}), 400
 
@@ -427,18 +587,79 @@ def generate_ai_clues(room_code):
     if room_code not in rooms:
         return jsonify({'error': 'Room not found'}), 404
     
-    game = rooms[room_code]
-    if game.phase != 'clue_giving':
-        return jsonify({'error': 'Not in clue giving phase'}), 400
-    
-    if not game.teams[game.current_team].get('ai_players'):
-        return jsonify({'error': 'Current team is not AI'}), 400
-    
-    threading.Thread(target=game._ai_generate_clues).start()
+    def generate(game):
+        # Checked under the room lock, so a concurrent move can't make the trigger stale
+        if game.phase != 'clue_giving':
+            return 'Not in clue giving phase'
+        if not game.teams[game.current_team].ai_players:
+            return 'Current team is not AI'
+        game._ai_generate_clues()
+        return None
+
+    game, error = run_room_command(room_code, generate)
+    if game is None:
+        return jsonify({'error': 'Room not found'}), 404
+    if error:
+        return jsonify({'error': error}), 400
     return jsonify({'status': 'ai_clues_generating'}), 200
 
+@app.route('/api/stats', methods=['GET'])
+def room_stats():
+    """Live rooms, serialized bytes per room, evictions and room lock contention"""
+    return jsonify({
+        **room_reaper.stats(),
+        'locks': {**metrics.snapshot('room_lock_'), 'hot_rooms': room_locks.hot_rooms()}
+    }), 200
+
+@app.route('/api/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Every counter, gauge and histogram in the Prometheus text format"""
+    live_rooms.set(len(rooms))
+    resident_memory.set(resident_bytes())
+    return Response(metrics.render_prometheus(), content_type=metrics.PROMETHEUS_CONTENT_TYPE)
+
+@app.route('/api/ai/stats', methods=['GET'])
+def ai_stats():
+    """AI scheduler queue depth, latency and outcome counters, and how often speculative clues were used"""
+    return jsonify({**ai_scheduler.stats(), 'prewarm': prewarmer.stats() if prewarmer else None}), 200
+
+class LazyAPIDocs:
+    """WSGI middleware serving the Swagger UI from a docs app built on first request
+
+    flasgger is slow to import and must register its routes before an app
+    serves anything, so the docs live on a separate app that mirrors this
+    one's API routes and is only built once someone opens them.
+    """
+
+    def __init__(self, app, wsgi_app):
+        self.app = app
+        self.wsgi_app = wsgi_app
+        self._docs = None
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        if environ.get('PATH_INFO', '').startswith(API_DOCS_PATHS):
+            return self.docs.wsgi_app(environ, start_response)
+        return self.wsgi_app(environ, start_response)
+
+    @property
+    def docs(self):
+        if self._docs is None:
+            with self._lock:
+                if self._docs is None:
+                    from flasgger import Swagger
+                    docs = Flask(f"{__name__}.docs")
+                    for rule in self.app.url_map.iter_rules():
+                        if rule.rule.startswith('/api/'):
+                            docs.add_url_rule(rule.rule, rule.endpoint, self.app.view_functions[rule.endpoint],
+                                              methods=rule.methods)
+                    Swagger(docs)
+                    self._docs = docs
+        return self._docs
+
+app.wsgi_app = LazyAPIDocs(app, app.wsgi_app)
+
 if __name__ == '__main__':
-    import os
     port = int(os.environ.get('PORT', 5000))
     socketio.run(app, debug=False, host="0.0.0.0", port=port)
 
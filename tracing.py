@@ -0,0 +1,89 @@
+"""Optional trace spans linking an HTTP request to the background AI work it triggers
+
+Set TRACE_SPANS=1 to log a line per finished span:
+
+    span ai_task trace=3f2a... span=9c1d... parent=77e0... 812.4ms room=ABC123
+
+Spans nest through a context variable, and AIScheduler runs each task in a
+copy of the submitting request's context, so the AI task and the LLM calls
+it makes share the trace ID of the request that queued them. Responses carry
+the trace ID in an X-Trace-Id header. When tracing is off, span() costs one
+flag check.
+"""
+import os
+import time
+import secrets
+import contextvars
+from contextlib import contextmanager
+import structlog
+
+logger = structlog.getLogger()
+
+TRACE_SPANS = os.environ.get('TRACE_SPANS') == '1'
+
+_current = contextvars.ContextVar('trace_span', default=None)
+
+
+class Span:
+    __slots__ = ('name', 'trace_id', 'span_id', 'parent_id', 'attributes', 'started_at', '_token')
+
+    def __init__(self, name, parent, attributes):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else secrets.token_hex(8)
+        self.span_id = secrets.token_hex(4)
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = attributes
+        self.started_at = time.perf_counter()
+        self._token = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def finish(self, error=None):
+        if error is not None:
+            self.attributes['error'] = repr(error)
+        attributes = ' '.join(f"{key}={value}" for key, value in self.attributes.items())
+        logger.info(f"span {self.name} trace={self.trace_id} span={self.span_id} parent={self.parent_id} "
+                    f"{(time.perf_counter() - self.started_at) * 1000:.1f}ms {attributes}")
+
+
+def current():
+    """The innermost open span, or None"""
+    return _current.get()
+
+
+def start_span(name, activate=False, **attributes):
+    """Open a span under the current one, or return None when tracing is off
+
+    An activated span becomes the parent of spans opened after it until
+    end_span() is called on it in the same context.
+    """
+    if not TRACE_SPANS:
+        return None
+    span = Span(name, _current.get(), attributes)
+    if activate:
+        span._token = _current.set(span)
+    return span
+
+
+def end_span(span, error=None):
+    if span is None:
+        return
+    if span._token is not None:
+        _current.reset(span._token)
+        span._token = None
+    span.finish(error)
+
+
+@contextmanager
+def span(name, **attributes):
+    """Run a block inside a span that is the parent of any span opened within it"""
+    opened = start_span(name, activate=True, **attributes)
+    try:
+        yield opened
+    except Exception as e:
+        end_span(opened, e)
+        opened = None
+        raise
+    finally:
+        end_span(opened)
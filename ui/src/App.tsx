@@ -1,5 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import axios from 'axios';
+import { io } from 'socket.io-client';
 import {
   Container,
   Typography,
@@ -27,14 +28,16 @@ interface GameState {
   teams: {
     red: {
       players: string[];
-      code_words: string[];
+      code_words: string[];  // Empty for the other team until the game is over
+      code_word_count: number;
       successful_codes: number;
       interception_tokens: number;
       ai_players: string[];
     };
     blue: {
       players: string[];
-      code_words: string[];
+      code_words: string[];  // Empty for the other team until the game is over
+      code_word_count: number;
       successful_codes: number;
       interception_tokens: number;
       ai_players: string[];
@@ -45,7 +48,7 @@ interface GameState {
   phase: 'setup' | 'clue_giving' | 'guessing' | 'scoring' | 'finished';
   current_code?: number[];
   current_clues: string[];
-  team_guesses: Record<string, number[]>;
+  team_guesses: Record<string, number[] | null>;  // null: guessed, hidden until scored
   winner?: string;
   round_history?: Array<{
     round: number;
@@ -54,16 +57,55 @@ interface GameState {
     clues: string[];
     guesses: Record<string, number[]>;
   }>;
+  version: number;
 }
 
+interface StateDelta {
+  room_code: string;
+  version: number;
+  event: string;
+  delta: Partial<Omit<GameState, 'teams'>> & {
+    teams?: Partial<GameState['teams']>;
+    history_entry?: NonNullable<GameState['round_history']>[number];
+  };
+}
+
+// Partial AI clues or guess digits, pushed while the model is still answering
+interface AIProgress {
+  room_code: string;
+  round: number;
+  kind: 'clues' | 'guess';
+  team: 'red' | 'blue';
+  items: Array<string | number>;
+}
+
+// Merge an incremental server delta into the current game state
+const applyDelta = (state: GameState, { version, delta }: StateDelta): GameState => {
+  const { teams, history_entry, ...rest } = delta;
+  return {
+    ...state,
+    ...rest,
+    teams: { ...state.teams, ...teams },
+    round_history: history_entry
+      ? [...(state.round_history || []), history_entry]
+      : state.round_history,
+    version,
+  };
+};
+
+// Ask the server for the state as our team may see it, proven by the token join_room gave us
+const viewAs = (playerToken: string) => ({ headers: playerToken ? { 'X-Player-Token': playerToken } : {} });
+
 const App: React.FC = () => {
   const [gameState, setGameState] = useState<GameState | null>(null);
   const [roomCode, setRoomCode] = useState('');
   const [playerName, setPlayerName] = useState('');
   const [selectedTeam, setSelectedTeam] = useState<'red' | 'blue'>('red');
+  const [playerToken, setPlayerToken] = useState('');
   const [error, setError] = useState('');
   const [loading, setLoading] = useState(false);
   const [currentGuess, setCurrentGuess] = useState<number[]>([1, 1, 1]);
+  const [aiProgress, setAIProgress] = useState<AIProgress | null>(null);
 
   const createRoom = async () => {
     try {
@@ -89,6 +131,7 @@ const App: React.FC = () => {
       const response = await axios.post(
         `${API_URL}/join_room/${roomCode}/${selectedTeam}/${playerName}`
       );
+      setPlayerToken(response.data.player_token);
       setGameState(response.data.game_state);
       setError('');
     } catch (err: any) {
@@ -102,7 +145,7 @@ const App: React.FC = () => {
     if (!gameState) return;
     
     try {
-      const response = await axios.post(`${API_URL}/room/${gameState.room_code}/add_ai/${teamColor}`);
+      const response = await axios.post(`${API_URL}/room/${gameState.room_code}/add_ai/${teamColor}`, null, viewAs(playerToken));
       setGameState(response.data.game_state);
     } catch (err) {
       setError('Failed to add AI to team');
@@ -113,7 +156,7 @@ const App: React.FC = () => {
     if (!gameState) return;
     
     try {
-      const response = await axios.post(`${API_URL}/room/${gameState.room_code}/generate_words/${teamColor}`);
+      const response = await axios.post(`${API_URL}/room/${gameState.room_code}/generate_words/${teamColor}`, null, viewAs(playerToken));
       setGameState(response.data.game_state);
     } catch (err) {
       setError('Failed to generate words');
@@ -124,7 +167,7 @@ const App: React.FC = () => {
     if (!gameState) return;
     
     try {
-      const response = await axios.post(`${API_URL}/room/${gameState.room_code}/start_round`);
+      const response = await axios.post(`${API_URL}/room/${gameState.room_code}/start_round`, null, viewAs(playerToken));
       setGameState(response.data.game_state);
     } catch (err) {
       setError('Failed to start game');
@@ -139,7 +182,8 @@ const App: React.FC = () => {
     try {
       const response = await axios.post(
         `${API_URL}/room/${gameState.room_code}/submit_guess/${myTeam}`,
-        { guess: currentGuess }
+        { guess: currentGuess },
+        viewAs(playerToken)
       );
       setGameState(response.data.game_state);
     } catch (err) {
@@ -147,21 +191,47 @@ const App: React.FC = () => {
     }
   };
 
-  // Poll for game state updates
+  // Subscribe to pushed state deltas, polling only while the socket is down
   useEffect(() => {
     if (!gameState) return;
+    const room_code = gameState.room_code;
 
-    const interval = setInterval(async () => {
+    const fetchState = async () => {
       try {
-        const response = await axios.get(`${API_URL}/room/${gameState.room_code}`);
+        const response = await axios.get(`${API_URL}/room/${room_code}`, viewAs(playerToken));
         setGameState(response.data);
       } catch (err) {
         console.error('Failed to fetch game state');
       }
+    };
+
+    const socket = io();
+    socket.on('connect', () => socket.emit('subscribe', { room_code, token: playerToken }));
+    socket.on('state', (state: GameState) => setGameState(state));
+    socket.on('ai_progress', (progress: AIProgress) => setAIProgress(progress));
+    socket.on('state_delta', (message: StateDelta) => {
+      setGameState((state) => {
+        if (!state) return state;
+        if (message.version <= state.version) return state;
+        if (message.version !== state.version + 1) {
+          // Missed a delta, resync from a full snapshot
+          fetchState();
+          return state;
+        }
+        return applyDelta(state, message);
+      });
+    });
+
+    const interval = setInterval(() => {
+      if (!socket.connected) fetchState();
     }, 2000);
 
-    return () => clearInterval(interval);
-  }, [gameState?.room_code]);
+    return () => {
+      clearInterval(interval);
+      socket.emit('unsubscribe', { room_code });
+      socket.disconnect();
+    };
+  }, [gameState?.room_code, playerToken]);
 
   const renderTeamCard = (teamColor: 'red' | 'blue') => {
     if (!gameState) return null;
@@ -229,7 +299,7 @@ const App: React.FC = () => {
                 Add AI Players
               </Button>
             )}
-            {team.code_words.length === 0 && (
+            {team.code_word_count === 0 && (
               <Button 
                 variant="outlined" 
                 size="small" 
@@ -326,8 +396,8 @@ const App: React.FC = () => {
     );
   }
 
-  const canStartGame = gameState.teams.red.code_words.length === 4 && 
-                      gameState.teams.blue.code_words.length === 4 &&
+  const canStartGame = gameState.teams.red.code_word_count === 4 && 
+                      gameState.teams.blue.code_word_count === 4 &&
                       gameState.phase === 'setup';
 
   return (
@@ -379,18 +449,29 @@ const App: React.FC = () => {
             <Typography variant="h6">
               Team {gameState.current_team.toUpperCase()} is giving clues...
             </Typography>
-            {gameState.current_code && (() => {
+            {(() => {
               const myTeam = gameState.teams.red.players.includes(playerName) ? 'red' : 'blue';
               const isMyTeamGiving = myTeam === gameState.current_team;
+              const streamedClues = aiProgress?.kind === 'clues' && aiProgress.round === gameState.current_round
+                ? aiProgress.items : [];
               
-              return isMyTeamGiving ? (
-                <Typography variant="body2">
-                  Your code: {gameState.current_code.join('-')}
-                </Typography>
-              ) : (
-                <Typography variant="body2" color="text.secondary">
-                  Waiting for clues...
-                </Typography>
+              return (
+                <Box>
+                  {isMyTeamGiving && gameState.current_code ? (
+                    <Typography variant="body2">
+                      Your code: {gameState.current_code.join('-')}
+                    </Typography>
+                  ) : (
+                    <Typography variant="body2" color="text.secondary">
+                      Waiting for clues...
+                    </Typography>
+                  )}
+                  {streamedClues.length > 0 && (
+                    <Typography variant="body2" color="text.secondary">
+                      Clues so far: {streamedClues.join(' | ')}
+                    </Typography>
+                  )}
+                </Box>
               );
             })()}
           </CardContent>
@@ -408,6 +489,8 @@ const App: React.FC = () => {
             {(() => {
               const myTeam = gameState.teams.red.players.includes(playerName) ? 'red' : 'blue';
               const hasGuessed = gameState.team_guesses[myTeam];
+              const streamedGuess = aiProgress?.kind === 'guess' && aiProgress.team === myTeam &&
+                aiProgress.round === gameState.current_round ? aiProgress.items : [];
               
               return (
                 <Box>
@@ -417,6 +500,11 @@ const App: React.FC = () => {
                     </Typography>
                   ) : (
                     <Box>
+                      {streamedGuess.length > 0 && (
+                        <Typography variant="body2" color="text.secondary" sx={{ mb: 1 }}>
+                          Your AI is guessing: {streamedGuess.join('-')}
+                        </Typography>
+                      )}
                       <Typography variant="body2" sx={{ mb: 2 }}>
                         Make your guess for the 3-digit code:
                       </Typography>
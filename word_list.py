@@ -0,0 +1,180 @@
+import os
+import glob
+import random
+import numpy as np
+import structlog
+
+logger = structlog.getLogger()
+
+# Used when the word list file is missing, so a game can still be dealt
+FALLBACK_WORDS = ('OCEAN', 'GUITAR', 'THUNDER', 'CASTLE')
+
+# Cosine similarity at which two words' vectors make them too alike to deal in one game
+WORD_CONFLICT_SIMILARITY = float(os.environ.get('WORD_CONFLICT_SIMILARITY', 0.6))
+# Words sharing this many leading letters, or all but the last letter of the shorter one (PIANO, PIANIST), share a stem
+STEM_LETTERS = 5
+# Random candidates drawn per word dealt before falling back to a full shuffle
+CANDIDATES_PER_WORD = 4
+
+
+class WordList:
+    """Code words loaded once: a tuple for indexing and sampling plus an index for O(1) membership
+
+    Words are upper-cased and deduplicated, keeping their first position.
+    themes maps a theme name to its words, which join the list after words.
+    Words too alike to deal into one game are kept as a sparse adjacency
+    map from a word's index to its conflicts' (see build_conflicts).
+    """
+    __slots__ = ('words', 'themes', '_index', '_conflicts', '_vectors', '_similarity')
+
+    def __init__(self, words, themes=None):
+        index = {}
+        for word in words:
+            word = word.strip().upper()
+            if word:
+                index.setdefault(word, len(index))
+        theme_rows = {}
+        for theme, theme_words in (themes or {}).items():
+            rows = []
+            for word in theme_words:
+                word = word.strip().upper()
+                if word:
+                    rows.append(index.setdefault(word, len(index)))
+            theme_rows[theme] = np.unique(np.array(rows, dtype=np.int32))
+        self.words = tuple(index)
+        self.themes = theme_rows
+        self._index = index
+        self._conflicts = {}
+        self._vectors = None
+        self._similarity = WORD_CONFLICT_SIMILARITY
+
+    @classmethod
+    def from_file(cls, path, themes_dir=None):
+        """The words in path, plus a theme per *.txt file in themes_dir named after the file"""
+        with open(path) as f:
+            words = list(f)
+        themes = {}
+        for theme_path in (sorted(glob.glob(os.path.join(themes_dir, '*.txt'))) if themes_dir else ()):
+            with open(theme_path) as f:
+                themes[os.path.splitext(os.path.basename(theme_path))[0]] = list(f)
+        return cls(words, themes)
+
+    def __len__(self):
+        return len(self.words)
+
+    def __iter__(self):
+        return iter(self.words)
+
+    def __getitem__(self, i):
+        return self.words[i]
+
+    def __contains__(self, word):
+        return isinstance(word, str) and word.upper() in self._index
+
+    def index(self, word):
+        """Position of word in the list"""
+        return self._index[word.upper()]
+
+    def build_conflicts(self, vectors=None, similarity=WORD_CONFLICT_SIMILARITY):
+        """Precompute which words must not be dealt into the same game
+
+        Words sharing a stem always conflict. With vectors, one unit-length
+        row per word (zero rows for unknown words), words whose cosine
+        similarity reaches `similarity` conflict as well. Those are checked
+        against the few words already dealt instead of precomputed, as a
+        matrix over every pair would need n^2 entries for a 50k word list.
+        """
+        stems = np.array([word[:STEM_LETTERS - 1] for word in self.words])
+        order = np.argsort(stems, kind='stable')
+        # Words can only share a stem with the words next to them in stem order
+        bounds = np.flatnonzero(np.r_[True, stems[order][1:] != stems[order][:-1], True])
+        rows, cols = [], []
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            group = order[start:end]
+            for a in range(len(group)):
+                for b in range(a + 1, len(group)):
+                    i, j = int(group[a]), int(group[b])
+                    if _same_stem(self.words[i], self.words[j]):
+                        rows += (i, j)
+                        cols += (j, i)
+        rows = np.array(rows, dtype=np.int32)
+        cols = np.array(cols, dtype=np.int32)
+        order = np.lexsort((cols, rows))
+        words_with_conflicts, starts = np.unique(rows[order], return_index=True)
+        self._conflicts = dict(zip(words_with_conflicts.tolist(),
+                                   (tuple(part.tolist()) for part in np.split(cols[order], starts[1:]))))
+
+        if vectors is not None:
+            self._vectors = np.asarray(vectors, dtype=np.float32)
+            self._similarity = similarity
+        logger.info(f"Found {len(rows) // 2} shared-stem word pairs among {len(self.words)} words"
+                    + (' and loaded word vectors' if vectors is not None else ''))
+        return len(rows) // 2
+
+    def conflicts(self, i):
+        """Indices of the words sharing a stem with word i"""
+        return self._conflicts.get(i, ())
+
+    def deal(self, k, exclude=(), theme=None, rng=random):
+        """k distinct words, none of them in exclude or too alike to each other or to exclude
+
+        Takes each of a few random draws that doesn't conflict with the
+        words chosen so far. A list too small or crowded for that is shuffled
+        in full, then conflicts are ignored, and as a last resort excluded
+        words are reused.
+        """
+        pool = self.themes[theme] if theme is not None else range(len(self.words))
+        excluded = {self._index[word.upper()] for word in exclude if word in self}
+        chosen = list(excluded)
+        blocked = set(excluded)
+        for i in excluded:
+            blocked.update(self.conflicts(i))
+        dealt = []
+        for attempt in range(4):
+            if attempt == 2:
+                blocked = excluded | set(dealt)
+            elif attempt == 3:
+                blocked, chosen = set(dealt), list(dealt)
+            if attempt == 0:
+                # Repeats are blocked like any word already dealt
+                positions = (int(rng.random() * len(pool)) for _ in range(CANDIDATES_PER_WORD * k))
+            else:
+                positions = rng.sample(range(len(pool)), len(pool))
+            for position in positions:
+                i = int(pool[position])
+                if i in blocked or (attempt < 2 and self._too_similar(i, chosen)):
+                    continue
+                dealt.append(i)
+                chosen.append(i)
+                blocked.add(i)
+                if attempt < 2:
+                    blocked.update(self.conflicts(i))
+                if len(dealt) == k:
+                    return [self.words[i] for i in dealt]
+        raise ValueError(f"Can't deal {k} words from {len(pool)}")
+
+    def _too_similar(self, i, chosen):
+        if self._vectors is None or not chosen:
+            return False
+        return bool((self._vectors[chosen] @ self._vectors[i]).max() >= self._similarity)
+
+
+def _same_stem(a, b):
+    shorter = min(len(a), len(b))
+    return len(os.path.commonprefix((a, b))) >= min(STEM_LETTERS, max(STEM_LETTERS - 1, shorter - 1))
+
+
+def load_word_list(path, themes_dir=None, embed=None):
+    """The word list at path, or a tiny built-in one if it's missing, with its conflicts computed
+
+    embed, if given, maps a list of words to unit vectors for the similarity check.
+    """
+    try:
+        word_list = WordList.from_file(path, themes_dir)
+        logger.info(f"Loaded {len(word_list)} code words from {path}"
+                    + (f" with themes {', '.join(word_list.themes)}" if word_list.themes else ''))
+    except FileNotFoundError:
+        logger.error(f"{path} not found, using {len(FALLBACK_WORDS)} fallback code words")
+        word_list = WordList(FALLBACK_WORDS)
+    word_list.build_conflicts(embed(list(word_list.words)) if embed else None)
+    return word_list